@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+import sys
+import click
+import frappe
+from frappe.commands import pass_context, get_site
+
+
+@click.group("smpp-gateway")
+def smpp_gateway():
+    """Manage the SMPP gateway daemon"""
+    pass
+
+
+@smpp_gateway.command("start")
+@pass_context
+def start_gateway(context):
+    """Start the gateway daemon that owns all SMPP binds of the site"""
+    from smpp_gateway.smpp_gateway.tasks.gateway_daemon import run_gateway
+
+    run_gateway(get_site(context))
+
+
+@smpp_gateway.command("status")
+@pass_context
+def gateway_status(context):
+    """Print the state last reported by the gateway daemon"""
+    from smpp_gateway.smpp_gateway.api.gateway import get_gateway_status
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        click.echo(json.dumps(get_gateway_status(), indent=2, default=str))
+    finally:
+        frappe.destroy()
+
+
+@smpp_gateway.command("simulate")
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", default=2775, type=int, help="Port to listen on")
+@click.option("--system-id", default=None, help="System ID to require; any is accepted if not set")
+@click.option("--password", default=None, help="Password to require; any is accepted if not set")
+@click.option("--response-delay", default=0.0, type=float, help="Seconds before every submit_sm_resp")
+@click.option("--response-jitter", default=0.0, type=float, help="Random seconds added to the response delay")
+@click.option("--dlr-delay", default=1.0, type=float, help="Seconds before a delivery receipt; negative sends none")
+@click.option("--undeliverable-rate", default=0.0, type=float, help="Fraction of receipts reporting UNDELIV")
+@click.option("--throttle-rate", default=0.0, type=float, help="Fraction of submits answered with ESME_RTHROTTLED")
+@click.option("--max-tps", default=0, type=int, help="Submits per second and bind before throttling; 0 for no limit")
+@click.option("--reject-rate", default=0.0, type=float, help="Fraction of submits answered with ESME_RSUBMITFAIL")
+@click.option("--nack-rate", default=0.0, type=float, help="Fraction of submits answered with a generic_nack")
+@click.option("--slow-rate", default=0.0, type=float, help="Fraction of responses held back --slow-delay seconds")
+@click.option("--slow-delay", default=5.0, type=float, help="Extra seconds of a slow response")
+@click.option("--drop-rate", default=0.0, type=float, help="Fraction of submits after which the connection is closed")
+@click.option("--drop-every", default=0, type=int, help="Close every connection at this many-th submit; 0 for never")
+@click.option("--seed", default=None, type=int, help="Seed of the fault injection, for reproducible runs")
+def simulate(host, port, system_id, password, response_delay, response_jitter, dlr_delay,
+             undeliverable_rate, throttle_rate, max_tps, reject_rate, nack_rate, slow_rate,
+             slow_delay, drop_rate, drop_every, seed):
+    """Run a local SMSC simulator to test and benchmark the gateway against"""
+    from smpp_gateway.smpp_gateway.api.smsc_simulator import SMSCSimulator
+
+    simulator = SMSCSimulator(
+        host=host, port=port, system_id=system_id, password=password,
+        response_delay=response_delay, response_jitter=response_jitter,
+        dlr_delay=dlr_delay if dlr_delay >= 0 else None,
+        undeliverable_rate=undeliverable_rate, throttle_rate=throttle_rate, max_tps=max_tps,
+        reject_rate=reject_rate, nack_rate=nack_rate, slow_rate=slow_rate, slow_delay=slow_delay,
+        drop_rate=drop_rate, drop_every=drop_every, seed=seed
+    )
+
+    click.echo(f"SMSC simulator listening on {host}:{port}, press Ctrl+C to stop")
+    try:
+        simulator.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+    click.echo(json.dumps(simulator.stats, indent=2))
+
+
+@smpp_gateway.command("benchmark")
+@click.option("--mode", default="notification", type=click.Choice(["notification", "template", "queue"]),
+              help="API under test")
+@click.option("--messages", default=1000, type=int, help="Number of messages to send")
+@click.option("--batch-size", default=100, type=int, help="Recipients per API call or queue batch")
+@click.option("--rate", default=0.0, type=float, help="Target messages per second; 0 for as fast as possible")
+@click.option("--engine", default="smpplib", type=click.Choice(["smpplib", "asyncio"]), help="Session engine")
+@click.option("--window-size", default=10, type=int, help="Submit window size")
+@click.option("--max-binds", default=1, type=int, help="Binds to the simulator")
+@click.option("--response-delay", default=0.0, type=float, help="Simulator seconds before every submit_sm_resp")
+@click.option("--dlr-delay", default=0.1, type=float, help="Simulator seconds before a delivery receipt; negative sends none")
+@click.option("--throttle-rate", default=0.0, type=float, help="Fraction of submits the simulator throttles")
+@click.option("--seed", default=None, type=int, help="Seed of the simulator fault injection")
+@click.option("--keep", is_flag=True, help="Keep the messages and receipts of the run")
+@click.option("--output", default=None, help="Write the results to this JSON file")
+@pass_context
+def benchmark(context, mode, messages, batch_size, rate, engine, window_size, max_binds, response_delay,
+              dlr_delay, throttle_rate, seed, keep, output):
+    """Measure throughput, latency and database writes against a local SMSC simulator"""
+    from smpp_gateway.smpp_gateway.benchmarks.end_to_end import run_benchmark
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        results = run_benchmark(
+            output=output, mode=mode, messages=messages, batch_size=batch_size, rate=rate,
+            engine=engine, window_size=window_size, max_binds=max_binds, keep=keep,
+            response_delay=response_delay, dlr_delay=dlr_delay if dlr_delay >= 0 else None,
+            throttle_rate=throttle_rate, seed=seed
+        )
+        click.echo(json.dumps(results, indent=2, default=str))
+    finally:
+        frappe.destroy()
+
+
+@smpp_gateway.command("micro-benchmark")
+@click.option("--filter", "pattern", default=None, help="Only run benchmarks whose name contains this text")
+@click.option("--output", default=None, help="Write the results to this JSON file, e.g. as the next baseline")
+@click.option("--baseline", default=None, help="JSON file of an earlier run to compare against")
+@click.option("--threshold", default=10.0, type=float, help="Allowed slowdown against the baseline, in percent")
+@pass_context
+def micro_benchmark(context, pattern, output, baseline, threshold):
+    """Time the per-message hot paths in ns/op and bytes/op; exits with 1 on a regression against --baseline"""
+    from smpp_gateway.smpp_gateway.benchmarks.micro import find_regressions, run_micro_benchmarks
+
+    frappe.init(site=get_site(context))
+    frappe.connect()
+    try:
+        report = run_micro_benchmarks(pattern, output)
+    finally:
+        frappe.destroy()
+
+    for name, result in report["results"].items():
+        click.echo(f"{name:<42}{result['ns_per_op']:>12.1f} ns/op{result['allocated_bytes_per_op']:>10.1f} B/op")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = find_regressions(report, json.load(f), threshold)
+
+        for regression in regressions:
+            click.echo("REGRESSION {benchmark} {metric}: {baseline} -> {current} (+{change}%)".format(**regression))
+
+        if regressions:
+            sys.exit(1)
+
+
+commands = [smpp_gateway]
@@ -0,0 +1,662 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio SMPP Session Engine
+Runs every asyncio SMPP bind of the process on one shared event loop, with a
+reader task per session and a future per outstanding request PDU; enquire_link
+is scheduled by the process-wide keepalive scheduler
+"""
+
+from __future__ import unicode_literals
+import asyncio
+import concurrent.futures
+import logging
+import struct
+import threading
+import time
+from collections import deque
+
+import frappe
+from frappe.utils import cint
+import smpplib.client
+import smpplib.consts
+import smpplib.exceptions
+import smpplib.smpp
+
+from smpp_gateway.smpp_gateway.api.endpoint_health import SMSC_ERRORS, rank_endpoints
+from smpp_gateway.smpp_gateway.api.keepalive import get_keepalive_scheduler, new_keepalive_stats
+from smpp_gateway.smpp_gateway.api.pdu_codec import (
+    DELIVER_SM,
+    DELIVER_SM_RESP,
+    ENQUIRE_LINK_RESP,
+    GENERIC_NACK,
+    HEADER_SIZE,
+    MAX_PDU_LENGTH,
+    QUERY_SM_RESP,
+    SUBMIT_MULTI_RESP,
+    SUBMIT_SM_RESP,
+    UNBIND_RESP,
+    PDUEncoder,
+    decode_deliver_sm,
+    decode_generic_nack,
+    decode_query_sm_resp,
+    decode_submit_multi_resp,
+    decode_submit_sm_resp,
+    get_command_id
+)
+from smpp_gateway.smpp_gateway.api.priority_lanes import PriorityLanes
+from smpp_gateway.smpp_gateway.api.smpp_client import (
+    INTAKE_INTERVAL,
+    MAX_REPLAYS,
+    RECONNECT_ATTEMPTS,
+    SUBMIT_MULTI_UNSUPPORTED,
+    BaseSMPPClient,
+    configure_socket,
+    reconnect_delay
+)
+from smpp_gateway.smpp_gateway.api.throttle import THROTTLE_RETRIES, is_throttling_error
+
+
+# Seconds an idle reserved worker sleeps before looking for urgent jobs again
+URGENT_POLL_INTERVAL = 0.01
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Return the process-wide event loop that drives all asyncio SMPP sessions"""
+    global _loop
+
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="smpp-asyncio", daemon=True).start()
+
+        return _loop
+
+
+def run_coroutine(coro, timeout=None):
+    """Run a coroutine on the shared event loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+
+async def _gather(coros):
+    return await asyncio.gather(*coros)
+
+
+class AsyncSMPPSession:
+    """Non-blocking SMPP session bound to the shared event loop"""
+
+    def __init__(self, host, port, response_timeout=30, logger=None, endpoint=None, keepalive_stats=None,
+                 coalesce_bytes=0, coalesce_delay=0):
+        self.host = host
+        self.port = int(port)
+        self.endpoint = endpoint
+        self.response_timeout = response_timeout
+        self.coalesce_bytes = coalesce_bytes
+        self.coalesce_delay = coalesce_delay
+        self.keepalive_stats = keepalive_stats if keepalive_stats is not None else new_keepalive_stats()
+        self.logger = logger or logging.getLogger(f"smpp_session_{host}_{port}")
+        self.sequence_generator = smpplib.client.SimpleSequenceGenerator()
+        self.encoder = PDUEncoder()
+
+        self.reader = None
+        self.writer = None
+        self.bound = False
+        self.last_activity = 0
+
+        # sequence_number -> future resolved with the response PDU
+        self.pending = {}
+
+        # deliver_sm PDUs waiting to be persisted from a Frappe thread
+        self.received = deque()
+
+        self._reader_task = None
+
+        # Request PDUs gathered for the next flush
+        self._outbox = bytearray()
+        self._flush_handle = None
+
+    # smpplib PDUs draw their sequence numbers from the "client" they are built for
+    @property
+    def sequence(self):
+        return self.sequence_generator.sequence
+
+    def next_sequence(self):
+        return self.sequence_generator.next_sequence()
+
+    async def connect(self, bind_type, **bind_params):
+        """Open the TCP connection, start the reader task and bind"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            self.response_timeout
+        )
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+
+        resp = await self.request(f"bind_{bind_type}", **bind_params)
+        if resp.is_error():
+            await self.close()
+            raise smpplib.exceptions.PDUError(
+                "({}) {}: {}".format(resp.status, resp.command,
+                                     smpplib.consts.DESCRIPTIONS.get(resp.status, "Unknown status")),
+                int(resp.status)
+            )
+
+        self.bound = True
+        return resp
+
+    def send(self, command, **params):
+        """Write a request PDU and return the future of its response"""
+        if self.writer is None or self.writer.is_closing():
+            # The reader may not have seen the close yet; callers replay on an unbound session
+            self.bound = False
+            raise smpplib.exceptions.ConnectionError("Session is not connected")
+
+        sequence = self.next_sequence()
+
+        if command == "submit_sm":
+            self._gather_write(self.encoder.submit_sm(sequence, params))
+        elif command == "submit_multi":
+            self._gather_write(self.encoder.submit_multi(sequence, params))
+        elif command == "query_sm":
+            self._gather_write(self.encoder.query_sm(sequence, params))
+        else:
+            pdu = smpplib.smpp.make_pdu(command, client=self, **params)
+            pdu.sequence = sequence
+            self.writer.write(pdu.generate())
+
+        # Registered after writing; the response cannot be read before this returns to the loop
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(lambda _f, sequence=sequence: self.pending.pop(sequence, None))
+        self.pending[sequence] = future
+
+        self.last_activity = time.monotonic()
+        return future
+
+    def _gather_write(self, pdu):
+        """Add a PDU from the shared encoder buffer to the next flush, or write it now if coalescing is off"""
+        if not self.coalesce_bytes:
+            # The transport may keep what it cannot send yet, so hand it a copy of the shared buffer
+            self.writer.write(bytes(pdu))
+            return
+
+        self._outbox += pdu
+
+        if len(self._outbox) >= self.coalesce_bytes:
+            self.flush()
+        elif self._flush_handle is None:
+            # Other workers add their PDUs during this pass of the loop
+            loop = asyncio.get_event_loop()
+            if self.coalesce_delay:
+                self._flush_handle = loop.call_later(self.coalesce_delay, self.flush)
+            else:
+                self._flush_handle = loop.call_soon(self.flush)
+
+    def flush(self):
+        """Hand the gathered PDUs to the transport in one write"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._outbox and self.writer is not None:
+            # The transport may hold on to the buffer, so start a new one
+            outbox, self._outbox = self._outbox, bytearray()
+            self.writer.write(outbox)
+
+    async def request(self, command, **params):
+        """Send a request PDU and wait for its response"""
+        return await asyncio.wait_for(self.send(command, **params), self.response_timeout)
+
+    async def unbind(self):
+        """Unbind politely, then close the connection"""
+        try:
+            if self.bound:
+                await self.request("unbind")
+        except Exception as e:
+            self.logger.warning(f"Unbind failed: {str(e)}")
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Close the connection and fail every outstanding request"""
+        self.bound = False
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._outbox = bytearray()
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+        if self._reader_task and not self._reader_task.done():
+            self._reader_task.cancel()
+
+        self._fail_pending(smpplib.exceptions.ConnectionError("Session closed"))
+
+    async def _read_loop(self):
+        """Read PDUs as they arrive and dispatch them"""
+        try:
+            while True:
+                header = await self.reader.readexactly(4)
+                length = struct.unpack(">L", header)[0]
+
+                # As PDUReader checks it: a broken peer must not make the reader buffer gigabytes
+                if length < HEADER_SIZE or length > MAX_PDU_LENGTH:
+                    raise smpplib.exceptions.PDUError(f"Broken PDU: command_length {length}")
+
+                raw_pdu = header + await self.reader.readexactly(length - 4)
+
+                self.last_activity = time.monotonic()
+                command_id = get_command_id(raw_pdu)
+
+                if command_id == SUBMIT_SM_RESP:
+                    self._dispatch(decode_submit_sm_resp(raw_pdu, length))
+                elif command_id == SUBMIT_MULTI_RESP:
+                    self._dispatch(decode_submit_multi_resp(raw_pdu, length))
+                elif command_id == QUERY_SM_RESP:
+                    self._dispatch(decode_query_sm_resp(raw_pdu, length))
+                elif command_id == DELIVER_SM:
+                    self._dispatch(decode_deliver_sm(raw_pdu, length))
+                elif command_id == GENERIC_NACK:
+                    self._dispatch(decode_generic_nack(raw_pdu))
+                else:
+                    self._dispatch(smpplib.smpp.parse_pdu(raw_pdu, client=self,
+                                                          allow_unknown_opt_params=True))
+
+        except asyncio.CancelledError:
+            pass
+        except smpplib.exceptions.PDUError as e:
+            self.logger.error(f"SMPP session dropped: {str(e)}")
+            if self.endpoint and self.bound:
+                self.endpoint.record_failure()
+        except Exception as e:
+            self.logger.error(f"SMPP session lost: {str(e) or type(e).__name__}")
+            if self.endpoint and self.bound:
+                self.endpoint.record_failure()
+        finally:
+            self.bound = False
+            self._fail_pending(smpplib.exceptions.ConnectionError("Connection lost"))
+
+    def _dispatch(self, pdu):
+        """Resolve response futures and answer SMSC-initiated requests"""
+        if pdu.command.endswith("_resp") or pdu.command == "generic_nack":
+            if pdu.command == "enquire_link_resp":
+                self.keepalive_stats["acknowledged"] += 1
+
+            # generic_nack is a response too and resolves the request it rejects
+            future = self.pending.pop(pdu.sequence, None)
+            if future and not future.done():
+                future.set_result(pdu)
+            elif pdu.command == "generic_nack":
+                self.logger.warning(f"generic_nack for unknown sequence {pdu.sequence}: ({pdu.status})")
+
+        elif pdu.command == "deliver_sm":
+            self.received.append(pdu)
+            self._respond(pdu, DELIVER_SM_RESP)
+
+        elif pdu.command == "enquire_link":
+            self._respond(pdu, ENQUIRE_LINK_RESP)
+            self.keepalive_stats["answered"] += 1
+
+        elif pdu.command == "unbind":
+            self._respond(pdu, UNBIND_RESP)
+            asyncio.ensure_future(self.close())
+
+        else:
+            self.logger.warning(f'Unhandled SMPP command "{pdu.command}"')
+
+    def _respond(self, pdu, command_id):
+        """Answer a request PDU with the same sequence number"""
+        if self.writer is not None:
+            self.writer.write(bytes(self.encoder.response(command_id, pdu.sequence)))
+
+    def _fail_pending(self, error):
+        for future in list(self.pending.values()):
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    def send_keepalive(self):
+        """Write an enquire_link; called on the loop by the keepalive scheduler"""
+        if not self.bound:
+            return
+
+        try:
+            future = self.send("enquire_link")
+            future.add_done_callback(lambda f: f.exception() if not f.cancelled() else None)
+            self.keepalive_stats["sent"] += 1
+        except Exception as e:
+            self.keepalive_stats["failed"] += 1
+            self.logger.error(f"Enquire link failed: {str(e)}")
+
+
+class AsyncSMPPClient(BaseSMPPClient):
+    """SMPP client that drives its bind through an AsyncSMPPSession"""
+
+    def __init__(self, config_name=None):
+        self.session = None
+        super(AsyncSMPPClient, self).__init__(config_name)
+
+    @property
+    def connected(self):
+        return self._connected and self.session is not None and self.session.bound
+
+    @connected.setter
+    def connected(self, value):
+        self._connected = value
+
+    def connect(self):
+        """Bind to the healthiest SMSC endpoint on the shared event loop, failing over to the next one"""
+        try:
+            with self.lock:
+                if self.connected:
+                    return True
+
+                # Kept for rebinds on the event loop, which cannot read the password itself
+                self._bind_params = self._get_bind_params()
+                endpoint = run_coroutine(self._bind_best())
+
+                self._log_connection_event("bind_success",
+                                           f"Successfully connected to SMSC at {endpoint.address}")
+                return True
+
+        except Exception as e:
+            error_msg = f"Failed to connect to SMSC: {str(e)}"
+            self.logger.error(error_msg)
+            self._log_connection_event("bind_failed", error_msg, str(e))
+            raise frappe.ValidationError(error_msg)
+
+    async def _bind_best(self):
+        """Bind a new session to the first endpoint that accepts it, in health order; runs on the loop"""
+        endpoints = rank_endpoints(self.config)
+        errors = []
+
+        for endpoint in endpoints:
+            try:
+                started = time.monotonic()
+                await self._bind(endpoint, self._get_bind_timeout(endpoints))
+            except Exception as e:
+                endpoint.record_failure()
+                errors.append(f"{endpoint.address}: {str(e) or type(e).__name__}")
+                self.logger.warning(f"Bind to {endpoint.address} failed: {str(e) or type(e).__name__}")
+                continue
+
+            endpoint.record_bind(time.monotonic() - started)
+            self.endpoint = endpoint
+            self.connected = True
+
+            get_keepalive_scheduler().register(self, self._keepalive_interval())
+
+            return endpoint
+
+        raise ConnectionError("; ".join(errors))
+
+    async def _bind(self, endpoint, timeout):
+        """Connect and bind a new session to one endpoint"""
+        session = AsyncSMPPSession(
+            endpoint.host,
+            endpoint.port,
+            response_timeout=timeout,
+            logger=self.logger,
+            endpoint=endpoint,
+            keepalive_stats=self.keepalive_stats,
+            coalesce_bytes=self.coalesce_bytes,
+            coalesce_delay=cint(self.config.get("write_coalesce_delay")) / 1000.0
+        )
+
+        try:
+            await asyncio.wait_for(session.connect(self.config.bind_type.lower(), **self._bind_params), timeout * 2)
+        except BaseException:
+            await session.close()
+            raise
+
+        # The short failover timeout only applies to connect and bind
+        session.response_timeout = int(self.config.connection_timeout or 30)
+        configure_socket(session.writer.get_extra_info("socket"), self.config)
+        self.session = session
+
+    def disconnect(self):
+        """Disconnect from SMSC"""
+        try:
+            get_keepalive_scheduler().unregister(self)
+
+            with self.lock:
+                if self.session and self.connected:
+                    run_coroutine(self.session.unbind(), int(self.config.connection_timeout or 30))
+                    self.connected = False
+                    self._log_connection_event("disconnect", "Disconnected from SMSC")
+        except Exception as e:
+            self.logger.error(f"Error during disconnect: {str(e)}")
+
+    def ping(self):
+        """The reader task notices a dead socket on its own"""
+        return self.connected
+
+    def keepalive(self):
+        """Hand an enquire_link to the loop if the session has been idle; returns when to check again"""
+        if not self.connected:
+            return None
+
+        interval = self._keepalive_interval()
+        current = time.monotonic()
+        session = self.session
+
+        if current - session.last_activity < interval:
+            self.keepalive_stats["skipped"] += 1
+            return session.last_activity + interval
+
+        if session.pending:
+            # Requests in flight keep the link alive
+            self.keepalive_stats["skipped"] += 1
+            return current + interval
+
+        get_event_loop().call_soon_threadsafe(session.send_keepalive)
+        return current + interval
+
+    @property
+    def outstanding(self):
+        """Number of request PDUs waiting for a response"""
+        return len(self.session.pending) if self.session else 0
+
+    @property
+    def session_id(self):
+        """Last sequence number of the bind, logged with connection events"""
+        return self.session.sequence if self.session else None
+
+    @classmethod
+    def _send_across(cls, clients, sms_docs, intake=None):
+        """Spread submits over connected clients; each pulls work while its window has room"""
+        # Drained under the same locks, so a concurrent batch on these clients cannot take the results
+        with cls._hold_io_locks(clients):
+            cls._run_window(clients, PriorityLanes(clients[0]._build_batch_jobs(sms_docs)),
+                            cls._intake_jobs(clients, sms_docs, intake))
+
+            results = {}
+            for client in clients:
+                for sms_doc, result in client._drain_completed():
+                    results[sms_doc.name] = result
+
+        for client in clients:
+            client.process_delivery_receipts()
+
+        return results
+
+    @classmethod
+    def _run_window(cls, clients, jobs, intake=None):
+        """Let every connected client pull jobs on the event loop, applying the outcomes as they come in"""
+        outcomes = deque()
+        live = [client for client in clients if client.connected]
+
+        try:
+            # Held so health checks leave binds alone that this batch rebinds itself
+            with cls._hold_io_locks(live):
+                # Another round if intake added jobs just as the workers ran out
+                while live and jobs:
+                    future = asyncio.run_coroutine_threadsafe(
+                        _gather([client._submit_from(jobs, outcomes) for client in live]), get_event_loop())
+                    cls._wait_window(future, jobs, outcomes, intake)
+                    live = [client for client in live if client.connected]
+        except Exception as e:
+            clients[0].logger.error(f"Send SMS failed: {str(e)}")
+
+        cls._apply_outcomes(outcomes)
+
+        for job in jobs:
+            clients[0]._complete_part(job, "SYSTEM_ERROR", "Send SMS failed: no SMPP session available")
+
+    @classmethod
+    def _wait_window(cls, future, jobs, outcomes, intake):
+        """Wait for the workers, persisting outcomes meanwhile and handing them the jobs `intake` returns"""
+        while not concurrent.futures.wait([future], INTAKE_INTERVAL).done:
+            cls._apply_outcomes(outcomes)
+
+            taken = intake() if intake else None
+            if taken:
+                get_event_loop().call_soon_threadsafe(jobs.extend, taken)
+
+        return future.result()
+
+    @staticmethod
+    def _apply_outcomes(outcomes):
+        """Persist outcomes in this thread; the event loop never touches the database"""
+        while outcomes:
+            client, job, outcome = outcomes.popleft()
+            client._complete_part(job, **outcome)
+
+    async def _submit_from(self, jobs, outcomes):
+        """Run window_size workers that pull jobs until the queue is empty, rebinding with backoff if the bind dies"""
+        async def worker(urgent_only):
+            while jobs and self.session.bound:
+                job = jobs.pop_urgent() if urgent_only else jobs.popleft()
+                if job is None:
+                    # A reserved slot idles until an urgent job turns up or the batch is done
+                    await asyncio.sleep(URGENT_POLL_INTERVAL)
+                    continue
+
+                outcome = await self._submit_throttled(job)
+
+                # submit_multi the SMSC refused, split into one submit_sm per destination
+                if outcome.pop("multi_unsupported", False):
+                    self._disable_submit_multi()
+                    jobs.extend(self._split_multi(job))
+                    continue
+
+                # Unacknowledged when the session dropped; replayed by whichever bind is up next
+                if outcome.pop("connection_lost", False):
+                    job["replays"] = job.get("replays", 0) + 1
+                    if job["replays"] <= MAX_REPLAYS:
+                        jobs.appendleft(job)
+                        continue
+
+                outcomes.append((self, job, outcome))
+
+        # The top reserved_slots workers only take urgent jobs
+        shared_slots = self.window_size - self.reserved_slots
+
+        # Counts consecutive failed rebinds; every session that came back up starts it over
+        attempt = 0
+        while True:
+            if self.session.bound:
+                attempt = 0
+                await asyncio.gather(*[worker(slot >= shared_slots) for slot in range(self.window_size)])
+
+            if not jobs or attempt == RECONNECT_ATTEMPTS:
+                return
+
+            await asyncio.sleep(reconnect_delay(attempt))
+            attempt += 1
+
+            # Another bind may have finished the queue meanwhile
+            if not jobs:
+                return
+
+            try:
+                await self._bind_best()
+            except Exception as e:
+                self.logger.warning(f"Rebind failed: {str(e)}")
+
+    async def _submit_throttled(self, job):
+        """Submit within the configured TPS, backing off while the SMSC reports throttling"""
+        for _attempt in range(THROTTLE_RETRIES + 1):
+            if self.throttle:
+                wait = self.throttle.reserve()
+                while wait:
+                    await asyncio.sleep(wait)
+                    wait = self.throttle.reserve()
+
+            outcome = await self._submit_one(job)
+            if not outcome.get("throttled"):
+                return outcome
+
+            if self.throttle:
+                self.throttle.penalize()
+
+        return outcome
+
+    async def _submit_one(self, job):
+        """Submit one PDU and translate its response into _complete_part() arguments"""
+        multi = "members" in job
+        query = "query" in job
+        started = time.monotonic()
+
+        try:
+            if query:
+                resp = await self.session.request("query_sm", **job["query"])
+            else:
+                resp = await self.session.request("submit_multi" if multi else "submit_sm", **job["params"])
+        except asyncio.TimeoutError:
+            self._record_latency(started, failed=True)
+            return {
+                "error_code": "TIMEOUT",
+                "error_message": "No {} within {} seconds".format(
+                    "query_sm_resp" if query else "submit_sm_resp", self.session.response_timeout)
+            }
+        except Exception as e:
+            return {
+                "error_code": "SYSTEM_ERROR",
+                "error_message": f"Send SMS failed: {str(e)}",
+                "connection_lost": not self.session.bound
+            }
+
+        self._record_latency(started, failed=resp.status in SMSC_ERRORS)
+
+        if resp.is_error():
+            if multi and resp.status in SUBMIT_MULTI_UNSUPPORTED:
+                return {"multi_unsupported": True}
+
+            return {
+                "error_code": str(resp.status),
+                "error_message": "SMPP PDU Error: ({}) {}: {}".format(
+                    resp.status, resp.command,
+                    smpplib.consts.DESCRIPTIONS.get(resp.status, "Unknown status")),
+                "throttled": is_throttling_error(resp.status)
+            }
+
+        if query:
+            return {"response": resp}
+
+        message_id = resp.message_id
+        if isinstance(message_id, bytes):
+            message_id = message_id.decode("ascii", "ignore")
+
+        outcome = {"message_id": message_id or str(resp.sequence)}
+        if multi:
+            outcome["unsuccess"] = resp.unsuccess
+
+        return outcome
+
+    def _record_latency(self, started, failed=False):
+        latency = time.monotonic() - started
+        self.route_stats.record_response(latency, failed)
+        if self.endpoint:
+            self.endpoint.record_response(latency, failed)
+
+    def process_delivery_receipts(self):
+        """Persist deliver_sm PDUs collected by the reader task"""
+        if not self.session:
+            return
+
+        while self.session.received:
+            self._process_delivery_receipt(self.session.received.popleft())
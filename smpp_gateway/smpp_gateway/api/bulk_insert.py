@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Bulk Message Insert
+Creates the SMPP SMS Messages of a large recipient list without a document
+per row: numbers are validated as one batch, every configuration's sender ID
+and message statistics are resolved once, names are reserved from the
+naming series as one block and rows are written with multi-row INSERTs
+"""
+
+from __future__ import unicode_literals
+import frappe
+from frappe.model.naming import parse_naming_series
+from frappe.utils import cint, now
+from smpp_gateway.smpp_gateway.doctype.smpp_sms_message.smpp_sms_message import clean_phone_number
+
+
+# Recipients from which send_notification_sms inserts its messages in bulk
+BULK_INSERT_THRESHOLD = 100
+
+# Rows per multi-row INSERT
+BULK_INSERT_CHUNK_SIZE = 1000
+
+
+def insert_sms_messages(recipients, values):
+    """
+    Create one SMPP SMS Message per recipient with multi-row INSERTs
+
+    A single message per configuration runs the SMPP SMS Message validation;
+    its resolved fields are copied to every recipient of that configuration.
+
+    Args:
+        recipients: (phone number, SMPP Configuration name) pairs, numbers already cleaned
+        values: Field values shared by every message
+
+    Returns:
+        tuple: (inserted messages as frappe._dict rows, grouped by configuration; numbers that were rejected)
+    """
+    rejected = []
+    numbers_by_config = {}
+
+    for phone_number, config_name in recipients:
+        # The check SMPPSMSMessage.validate_phone_number runs, without a msgprint per rejected number
+        cleaned = clean_phone_number(phone_number)
+        if cleaned:
+            numbers_by_config.setdefault(config_name, []).append(cleaned)
+        else:
+            rejected.append(phone_number)
+
+    prototypes = {}
+    for config_name, numbers in list(numbers_by_config.items()):
+        try:
+            # new_doc applies the field defaults insert() would otherwise set
+            prototype = frappe.new_doc("SMPP SMS Message")
+            prototype.update(dict(values, recipient_number=numbers[0], smpp_configuration=config_name))
+            prototype.run_method("validate")
+            prototypes[config_name] = prototype
+        except Exception as e:
+            frappe.log_error(f"SMPP bulk insert failed for {config_name}: {str(e)}", "SMPP Notification Error")
+            rejected.extend(numbers_by_config.pop(config_name))
+
+    rows = []
+    for config_name, numbers in numbers_by_config.items():
+        base = prototypes[config_name].get_valid_dict(convert_dates_to_str=True)
+        for phone_number in numbers:
+            rows.append(dict(base, recipient_number=phone_number))
+
+    insert_rows("SMPP SMS Message", rows)
+    return [frappe._dict(row) for row in rows], rejected
+
+
+def insert_rows(doctype, rows):
+    """
+    Write rows of a naming series doctype with multi-row INSERTs, skipping its controller
+
+    Names and the standard fields are filled in on the rows themselves.
+
+    Args:
+        doctype: DocType named by a naming_series field
+        rows: Dicts of field values, all with the same keys
+    """
+    if not rows:
+        return
+
+    series = frappe.get_meta(doctype).get_field("naming_series").options.split("\n")[0]
+    names = iter(reserve_names(series, len(rows)))
+    timestamp = now()
+    user = frappe.session.user
+
+    for row in rows:
+        row.update(name=next(names), naming_series=row.get("naming_series") or series, creation=timestamp,
+                   modified=timestamp, owner=user, modified_by=user, docstatus=0, idx=0)
+
+    fields = list(rows[0])
+    frappe.db.bulk_insert(doctype, fields, [[row[field] for field in fields] for row in rows],
+                          chunk_size=BULK_INSERT_CHUNK_SIZE)
+
+
+def reserve_names(series, count):
+    """
+    Take `count` consecutive names from a naming series with one update of its counter
+
+    Args:
+        series: Naming series, e.g. SMS-.YYYY.-.MM.-.#####
+        count: Number of names
+
+    Returns:
+        list: Names in series order
+    """
+    digits = len(series) - len(series.rstrip("#"))
+    prefix = parse_naming_series(series.rstrip("#").rstrip("."))
+
+    current = frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE `name`=%s FOR UPDATE", (prefix,))
+    if current and current[0][0] is not None:
+        first = cint(current[0][0]) + 1
+        frappe.db.sql("UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name`=%s", (count, prefix))
+    else:
+        first = 1
+        frappe.db.sql("INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)", (prefix, count))
+
+    return [f"{prefix}{number:0{digits}d}" for number in range(first, first + count)]
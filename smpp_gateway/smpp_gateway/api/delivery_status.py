@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Delivery Status Queries
+Reconciles SMPP SMS Messages with the SMSC using query_sm: queries for a
+whole set of messages are pipelined over the configuration's binds and the
+resulting statuses are written back in batched UPDATE statements
+"""
+
+from __future__ import unicode_literals
+import frappe
+from frappe.utils import now
+
+from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+
+
+# Map SMPP message states to SMPP SMS Message status values
+MESSAGE_STATE_STATUS = {
+    "ENROUTE": "Sent",
+    "DELIVERED": "Delivered",
+    "EXPIRED": "Expired",
+    "DELETED": "Failed",
+    "UNDELIVERABLE": "Failed",
+    "ACCEPTED": "Delivered",
+    "UNKNOWN": "Failed",
+    "REJECTED": "Rejected"
+}
+
+QUERYABLE_STATUSES = ("Sent", "Delivered", "Failed", "Expired")
+
+# Rows written per UPDATE statement
+UPDATE_BATCH_SIZE = 500
+
+
+def query_delivery_statuses(sms_names):
+    """
+    Query the SMSC for the state of many messages and store the answers
+
+    Args:
+        sms_names: Names of SMPP SMS Message documents
+
+    Returns:
+        dict: Result per message name; successful results carry the new status
+    """
+    results = {}
+    batches = {}
+    default_config = None
+
+    rows = frappe.get_all("SMPP SMS Message",
+                          filters={"name": ["in", list(sms_names)]},
+                          fields=["name", "message_id", "sender_id", "status", "smpp_status",
+                                  "delivered_time", "smpp_configuration"])
+
+    for row in rows:
+        if not row.message_id:
+            results[row.name] = {
+                "success": False,
+                "message": "Message has not been sent yet or message ID is missing"
+            }
+            continue
+
+        if row.status not in QUERYABLE_STATUSES:
+            results[row.name] = {
+                "success": False,
+                "message": f"Cannot query status for message in '{row.status}' state"
+            }
+            continue
+
+        config_name = row.smpp_configuration
+        if not config_name:
+            # Get default configuration
+            default_config = default_config or frappe.db.get_value("SMPP Configuration",
+                                                                   {"is_default": 1, "is_active": 1},
+                                                                   "name")
+            config_name = default_config
+
+        if not config_name:
+            results[row.name] = {"success": False, "message": "No active SMPP Configuration found"}
+            continue
+
+        batches.setdefault(config_name, []).append(row)
+
+    updates = []
+
+    for config_name, batch in batches.items():
+        try:
+            responses = get_smpp_client(config_name).query_message_statuses(
+                [{"message_id": row.message_id, "source_addr": row.sender_id or ""} for row in batch])
+        except Exception as e:
+            frappe.log_error(f"Failed to query SMS delivery status: {str(e)}", "SMPP Query Status Error")
+            for row in batch:
+                results[row.name] = {"success": False, "message": str(e)}
+            continue
+
+        for row, response in zip(batch, responses):
+            if not response.get("success"):
+                results[row.name] = {
+                    "success": False,
+                    "message": f"Failed to query status: {response.get('error', 'Unknown error')}"
+                }
+                continue
+
+            message_state_text = response["message_state_text"]
+            new_status = MESSAGE_STATE_STATUS.get(message_state_text, row.status)
+            delivered_time = row.delivered_time
+
+            # Set delivered time if message was delivered
+            if new_status == "Delivered" and not delivered_time:
+                delivered_time = now()
+
+            if new_status != row.status or message_state_text != row.smpp_status:
+                updates.append((row.name, new_status, message_state_text, delivered_time))
+
+            results[row.name] = dict(response, success=True, status=new_status,
+                                     smpp_status=message_state_text, delivered_time=delivered_time)
+
+    apply_status_updates(updates)
+
+    return results
+
+
+def apply_status_updates(updates):
+    """
+    Write queried statuses with one UPDATE per UPDATE_BATCH_SIZE messages
+
+    Args:
+        updates: list of (name, status, smpp_status, delivered_time) tuples
+    """
+    modified = now()
+
+    for start in range(0, len(updates), UPDATE_BATCH_SIZE):
+        batch = updates[start:start + UPDATE_BATCH_SIZE]
+        cases = " ".join(["WHEN %s THEN %s"] * len(batch))
+        placeholders = ", ".join(["%s"] * len(batch))
+
+        values = []
+        for column in (1, 2, 3):
+            for update in batch:
+                values.extend((update[0], update[column]))
+        values.append(modified)
+        values.extend(update[0] for update in batch)
+
+        frappe.db.sql(f"""
+            UPDATE `tabSMPP SMS Message`
+            SET status = CASE name {cases} END,
+                smpp_status = CASE name {cases} END,
+                delivered_time = CASE name {cases} END,
+                modified = %s
+            WHERE name IN ({placeholders})
+        """, values)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+SMSC Endpoint Health
+Scores every SMSC endpoint of an SMPP Configuration from bind latency,
+response latency and error rate, so binds go to the healthiest endpoint and
+fail over within seconds when one turns slow or unreachable
+"""
+
+from __future__ import unicode_literals
+import threading
+import time
+
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.2
+
+# Seconds added to the score per unit of error rate
+ERROR_PENALTY = 10.0
+
+# An endpoint nobody talks to any more is forgiven: its error rate halves every this many seconds
+ERROR_HALF_LIFE = 60
+
+# Endpoints erroring more often or answering slower than this are only used
+# when nothing better is left
+MAX_ERROR_RATE = 0.5
+MAX_RESPONSE_LATENCY = 5.0
+
+# command_status values that blame the SMSC rather than the message
+SMSC_ERRORS = {
+    0x00000008,  # ESME_RSYSERR
+}
+
+# After consecutive failures an endpoint is skipped for FAILURE_COOLDOWN * 2^(failures - 1)
+# seconds, capped at MAX_COOLDOWN
+FAILURE_COOLDOWN = 5
+MAX_COOLDOWN = 300
+
+
+class ResponseHealth:
+    """Moving averages of response latency and error rate"""
+
+    def __init__(self):
+        self.response_latency = 0.0
+        self.samples = 0
+        self._error_rate = 0.0
+        self._error_updated = time.monotonic()
+
+    @property
+    def error_rate(self):
+        idle = time.monotonic() - self._error_updated
+        return self._error_rate * 0.5 ** (idle / ERROR_HALF_LIFE)
+
+    def _add_error_sample(self, failed):
+        self._error_rate = self.error_rate + EWMA_ALPHA * ((1.0 if failed else 0.0) - self.error_rate)
+        self._error_updated = time.monotonic()
+
+    @property
+    def healthy(self):
+        return self.error_rate < MAX_ERROR_RATE and self.response_latency < MAX_RESPONSE_LATENCY
+
+    @property
+    def score(self):
+        """Lower is better: expected seconds per response plus an error penalty"""
+        return self.response_latency + self.error_rate * ERROR_PENALTY
+
+    def record_response(self, latency, failed=False):
+        """A request was answered (or timed out, or failed on the SMSC side) after `latency` seconds"""
+        self.response_latency += EWMA_ALPHA * (latency - self.response_latency)
+        self.samples += 1
+        self._add_error_sample(failed)
+
+    def record_error(self):
+        """A request failed before any response could be timed"""
+        self._add_error_sample(True)
+
+
+class EndpointHealth(ResponseHealth):
+    """Moving averages and failure state of one SMSC host:port"""
+
+    def __init__(self, host, port, priority=0):
+        super(EndpointHealth, self).__init__()
+        self.host = host
+        self.port = int(port)
+        self.priority = priority
+        self.bind_latency = 0.0
+        self.failures = 0
+        self.down_until = 0
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def available(self):
+        """False while the endpoint sits out its cooldown"""
+        return time.monotonic() >= self.down_until
+
+    @property
+    def healthy(self):
+        return self.available and super(EndpointHealth, self).healthy
+
+    @property
+    def score(self):
+        """Lower is better: expected seconds per bind and response plus an error penalty"""
+        return self.bind_latency + super(EndpointHealth, self).score
+
+    def record_bind(self, latency):
+        """A bind succeeded after `latency` seconds"""
+        self.bind_latency += EWMA_ALPHA * (latency - self.bind_latency)
+        self.failures = 0
+        self.down_until = 0
+
+    def record_failure(self):
+        """Connect or bind failed, or a bound session was lost"""
+        self.failures += 1
+        self._add_error_sample(True)
+        self.down_until = time.monotonic() + min(MAX_COOLDOWN, FAILURE_COOLDOWN * 2 ** (self.failures - 1))
+
+    def as_dict(self):
+        return {
+            "address": self.address,
+            "priority": self.priority,
+            "healthy": self.healthy,
+            "score": round(self.score, 3),
+            "bind_latency": round(self.bind_latency, 3),
+            "response_latency": round(self.response_latency, 3),
+            "error_rate": round(self.error_rate, 3),
+            "failures": self.failures
+        }
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoints(config):
+    """
+    Get the health records of every enabled endpoint of a configuration
+
+    The configuration's own SMSC Host comes first with priority 0, followed by
+    the rows of its Failover Endpoints table.
+
+    Args:
+        config: SMPP Configuration document
+
+    Returns:
+        list: EndpointHealth per endpoint, shared by every session of the process
+    """
+    addresses = [(config.smsc_host, int(config.smsc_port or 2775), 0)]
+    for row in config.get("smsc_endpoints") or []:
+        if not row.disabled and row.smsc_host:
+            addresses.append((row.smsc_host, int(row.smsc_port or 2775), int(row.priority or 0)))
+
+    endpoints = []
+    with _endpoints_lock:
+        for host, port, priority in addresses:
+            key = (config.name, host, port)
+            endpoint = _endpoints.get(key)
+            if not endpoint:
+                endpoint = _endpoints[key] = EndpointHealth(host, port, priority)
+
+            if endpoint not in endpoints:
+                endpoint.priority = priority
+                endpoints.append(endpoint)
+
+    return endpoints
+
+
+def rank_endpoints(config):
+    """
+    Order the endpoints of a configuration for binding
+
+    Endpoints out of cooldown come before those still cooling down, healthy ones
+    before unhealthy ones, then lower priority numbers and lower scores.
+
+    Returns:
+        list: EndpointHealth, best first
+    """
+    return sorted(get_endpoints(config),
+                  key=lambda endpoint: (not endpoint.available, not endpoint.healthy,
+                                        endpoint.priority, endpoint.score))
+
+
+def should_fail_over(config, endpoint):
+    """Check whether a session bound to `endpoint` should move to a healthier one"""
+    if endpoint is None or endpoint.healthy:
+        return False
+
+    best = rank_endpoints(config)[0]
+    return best is not endpoint and best.healthy
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Gateway Handoff
+Web workers and scheduler jobs hand outbound SMPP SMS Messages to the
+gateway daemon (`bench --site [site] smpp-gateway start`) through a Redis
+list instead of opening binds of their own
+"""
+
+from __future__ import unicode_literals
+import time
+import frappe
+from frappe.utils import cint
+
+from smpp_gateway.smpp_gateway.api.priority_lanes import LANE_WEIGHTS, URGENT_LANE
+from smpp_gateway.smpp_gateway.api.status_buffer import OPEN_QUEUE_STATUSES
+
+
+GATEWAY_QUEUE_KEY = "smpp_gateway:outbound"
+GATEWAY_STATE_KEY = "smpp_gateway:state"
+
+# The daemon refreshes its state every few seconds; older state means it is gone
+GATEWAY_HEARTBEAT_TIMEOUT = 15
+
+# Names pushed per RPUSH when handing off a large send
+HANDOFF_CHUNK_SIZE = 1000
+
+def get_gateway_state():
+    """
+    Get the state last published by the gateway daemon
+
+    Returns:
+        dict: Daemon state, or None if no daemon has reported recently
+    """
+    state = frappe.cache().get_value(GATEWAY_STATE_KEY)
+
+    if not state or time.time() - state.get("heartbeat", 0) > GATEWAY_HEARTBEAT_TIMEOUT:
+        return None
+
+    return state
+
+
+def is_gateway_running():
+    """Check whether a gateway daemon currently owns the SMPP binds for this site"""
+    return get_gateway_state() is not None
+
+
+def get_lane_key(lane):
+    """Redis list of one priority lane; lane 0 keeps the key used before there were lanes"""
+    return f"{GATEWAY_QUEUE_KEY}:{lane}" if lane else GATEWAY_QUEUE_KEY
+
+
+def hand_off(sms_names, priority=0):
+    """
+    Queue SMPP SMS Messages for the gateway daemon
+
+    The caller's transaction is committed first so the daemon can read the rows.
+
+    Args:
+        sms_names: Names of SMPP SMS Message documents to send
+        priority: SMPP priority (0-3) of the messages, selecting their lane
+    """
+    if not sms_names:
+        return
+
+    frappe.db.commit()
+
+    cache = frappe.cache()
+    key = cache.make_key(get_lane_key(max(0, min(URGENT_LANE, priority))))
+
+    # One round trip for the whole send instead of one per message
+    pipeline = cache.pipeline()
+    for offset in range(0, len(sms_names), HANDOFF_CHUNK_SIZE):
+        pipeline.rpush(key, *sms_names[offset:offset + HANDOFF_CHUNK_SIZE])
+    pipeline.execute()
+
+
+def take_handoff(max_items, timeout=1):
+    """
+    Take queued message names, waiting up to `timeout` seconds for the first one
+
+    Every lane first gets its weighted share of the batch, urgent first; room
+    left over goes to whichever lanes still have names, again urgent first.
+
+    Args:
+        max_items: Maximum number of names to return
+        timeout: Seconds to block while the queue is empty
+
+    Returns:
+        list: SMPP SMS Message names
+    """
+    cache = frappe.cache()
+    lanes = range(URGENT_LANE, -1, -1)
+    first = cache.blpop([cache.make_key(get_lane_key(lane)) for lane in lanes], timeout=timeout)
+
+    if not first:
+        return []
+
+    names = [frappe.safe_decode(first[1])]
+
+    total = sum(LANE_WEIGHTS)
+    for lane in lanes:
+        share = -(-max_items * LANE_WEIGHTS[lane] // total)
+        names.extend(_pop_lane(cache, lane, min(share, max_items - len(names))))
+
+    for lane in lanes:
+        names.extend(_pop_lane(cache, lane, max_items - len(names)))
+
+    return names
+
+
+def take_urgent_handoff(max_items):
+    """Take urgent message names without waiting, for a batch already in flight"""
+    return _pop_lane(frappe.cache(), URGENT_LANE, max_items)
+
+
+def _pop_lane(cache, lane, count):
+    names = []
+    while len(names) < count:
+        name = cache.lpop(get_lane_key(lane))
+        if not name:
+            break
+        names.append(frappe.safe_decode(name))
+
+    return names
+
+
+def get_handoff_length():
+    """Number of message names waiting for the daemon"""
+    return sum(frappe.cache().llen(get_lane_key(lane)) for lane in range(URGENT_LANE + 1))
+
+
+def requeue_stranded_handoffs():
+    """
+    Hand off Queued messages again that no daemon took, e.g. names pushed just before the last one stopped
+
+    Messages waiting in an SMPP SMS Queue item or still in a lane are left alone.
+
+    Returns:
+        int: Number of messages handed off
+    """
+    cache = frappe.cache()
+    waiting = {
+        frappe.safe_decode(name)
+        for lane in range(URGENT_LANE + 1)
+        for name in cache.lrange(get_lane_key(lane), 0, -1) or []
+    }
+
+    stranded = frappe.db.sql("""
+        SELECT `name`, `priority`
+        FROM `tabSMPP SMS Message` message
+        WHERE `status` = 'Queued'
+            AND NOT EXISTS (
+                SELECT 1 FROM `tabSMPP SMS Queue` queue
+                WHERE queue.`sms_message` = message.`name` AND queue.`status` IN %(open)s
+            )
+        ORDER BY `creation`
+    """, {"open": OPEN_QUEUE_STATUSES}, as_dict=True)
+
+    by_priority = {}
+    for message in stranded:
+        if message.name not in waiting:
+            by_priority.setdefault(cint(message.priority), []).append(message.name)
+
+    for priority, names in by_priority.items():
+        hand_off(names, priority)
+
+    return sum(len(names) for names in by_priority.values())
+
+
+@frappe.whitelist()
+def get_gateway_status():
+    """
+    Get gateway daemon status for the current site
+
+    Returns:
+        dict: Daemon state with `running` flag
+    """
+    state = get_gateway_state()
+
+    if not state:
+        return {
+            "running": False,
+            "queue_length": get_handoff_length(),
+            "message": "SMPP gateway daemon is not running"
+        }
+
+    state["running"] = True
+    return state
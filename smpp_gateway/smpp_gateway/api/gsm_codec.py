@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+GSM 03.38 Codec
+Encodes text to the GSM 7-bit default alphabet and its extension table
+with precomputed str.translate tables, and picks the cheapest data_coding
+that can carry a message
+"""
+
+from __future__ import unicode_literals
+import unicodedata
+
+from smpp_gateway.smpp_gateway.api.segmentation import count_encoded_parts
+
+
+DATA_CODING_GSM7 = 0
+DATA_CODING_UCS2 = 8
+
+GSM7_ESCAPE = "\x1b"
+
+# GSM 03.38 basic character set, indexed by septet value
+GSM7_BASIC = (
+    "@£$¥èéùìòÇ\nØø\rÅå"
+    "Δ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ"
+    " !\"#¤%&'()*+,-./"
+    "0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNO"
+    "PQRSTUVWXYZÄÖÑÜ§"
+    "¿abcdefghijklmno"
+    "pqrstuvwxyzäöñüà"
+)
+
+# GSM 03.38 extension table, reached through the escape septet
+GSM7_EXTENSION = {
+    0x0A: "\f",
+    0x14: "^",
+    0x28: "{",
+    0x29: "}",
+    0x2F: "\\",
+    0x3C: "[",
+    0x3D: "~",
+    0x3E: "]",
+    0x40: "|",
+    0x65: "€",
+}
+
+# Characters outside both tables are mapped here so a single isascii()
+# check tells whether the whole text is representable
+_UNREPRESENTABLE = "\ufffd"
+
+
+def _build_encode_table():
+    table = {code: _UNREPRESENTABLE for code in range(0x80)}
+
+    for septet, char in enumerate(GSM7_BASIC):
+        if septet != 0x1B:
+            table[ord(char)] = chr(septet)
+
+    for septet, char in GSM7_EXTENSION.items():
+        table[ord(char)] = GSM7_ESCAPE + chr(septet)
+
+    return table
+
+
+_ENCODE_TABLE = _build_encode_table()
+
+# Look-alikes for characters outside GSM 03.38 that usually arrive pasted
+# from word processors
+GSM7_TRANSLITERATION = {
+    "\u00a0": " ",    # no-break space
+    "\u2002": " ",    # en space
+    "\u2003": " ",    # em space
+    "\u2007": " ",    # figure space
+    "\u2009": " ",    # thin space
+    "\u200a": " ",    # hair space
+    "\u202f": " ",    # narrow no-break space
+    "\u200b": "",     # zero width space
+    "\u200c": "",     # zero width non-joiner
+    "\u200d": "",     # zero width joiner
+    "\ufeff": "",     # byte order mark
+    "\u00ad": "",     # soft hyphen
+    "\u2010": "-",    # hyphen
+    "\u2011": "-",    # non-breaking hyphen
+    "\u2012": "-",    # figure dash
+    "\u2013": "-",    # en dash
+    "\u2014": "-",    # em dash
+    "\u2015": "-",    # horizontal bar
+    "\u2212": "-",    # minus sign
+    "\u2018": "'",    # left single quotation mark
+    "\u2019": "'",    # right single quotation mark
+    "\u201a": "'",    # single low-9 quotation mark
+    "\u201b": "'",    # single high-reversed-9 quotation mark
+    "\u2032": "'",    # prime
+    "\u00b4": "'",    # acute accent
+    "`": "'",
+    "\u201c": '"',    # left double quotation mark
+    "\u201d": '"',    # right double quotation mark
+    "\u201e": '"',    # double low-9 quotation mark
+    "\u201f": '"',    # double high-reversed-9 quotation mark
+    "\u2033": '"',    # double prime
+    "\u00ab": '"',    # left-pointing double angle quotation mark
+    "\u00bb": '"',    # right-pointing double angle quotation mark
+    "\u2039": "'",    # single left-pointing angle quotation mark
+    "\u203a": "'",    # single right-pointing angle quotation mark
+    "\u2026": "...",  # horizontal ellipsis
+    "\u2022": "-",    # bullet
+    "\u00b7": ".",    # middle dot
+    "\u2122": "TM",   # trade mark sign
+    "\u00a9": "(c)",  # copyright sign
+    "\u00ae": "(R)",  # registered sign
+    "\u00d7": "x",    # multiplication sign
+    "\u00f7": "/",    # division sign
+    "\u02c6": "^",    # modifier letter circumflex accent
+    "\u02dc": "~",    # small tilde
+    "\t": " ",
+    "\u0141": "L",    # L with stroke
+    "\u0142": "l",    # l with stroke
+    "\u0110": "D",    # D with stroke
+    "\u0111": "d",    # d with stroke
+    "\u0152": "OE",   # ligature OE
+    "\u0153": "oe",   # ligature oe
+    "\u0131": "i",    # dotless i
+}
+
+
+def _build_transliteration_table():
+    table = {ord(char): replacement for char, replacement in GSM7_TRANSLITERATION.items()}
+
+    # Accented Latin letters missing from GSM 03.38 lose their accent
+    for code in range(0xC0, 0x250):
+        char = chr(code)
+        if ord(char) in table or char in GSM7_BASIC:
+            continue
+
+        base = unicodedata.normalize("NFKD", char)[:1]
+        if base.isascii() and base.isalpha():
+            table[code] = base
+
+    return table
+
+
+_TRANSLITERATION_TABLE = _build_transliteration_table()
+
+
+def to_septets(text):
+    """
+    Translate text to GSM septet values, one character per septet
+
+    Returns:
+        str: Septets as characters U+0000..U+007F, or None if text has characters outside GSM 03.38
+    """
+    septets = (text or "").translate(_ENCODE_TABLE)
+
+    if not septets.isascii():
+        return None
+
+    return septets
+
+
+def is_gsm7(text):
+    """Check whether text can be sent in the GSM 7-bit default alphabet"""
+    return to_septets(text) is not None
+
+
+def gsm7_length(text):
+    """Length of text in septets, counting extension characters twice; None if not representable"""
+    septets = to_septets(text)
+    return len(septets) if septets is not None else None
+
+
+def encode_gsm7(text, replacement="?"):
+    """
+    Encode text to unpacked GSM 7-bit, one septet per octet
+
+    Args:
+        text: Text to encode
+        replacement: Substitute for characters outside GSM 03.38, or None to raise
+
+    Returns:
+        bytes: Septet values
+    """
+    septets = to_septets(text)
+
+    if septets is None:
+        if replacement is None:
+            raise ValueError("Text contains characters outside the GSM 03.38 alphabet")
+
+        replacement = replacement.translate(_ENCODE_TABLE)
+        septets = "".join(char if char.isascii() else replacement
+                          for char in text.translate(_ENCODE_TABLE))
+
+    return septets.encode("ascii")
+
+
+def decode_gsm7(septets):
+    """Decode unpacked GSM 7-bit septets to text"""
+    chars = []
+    escaped = False
+
+    for septet in bytes(septets):
+        septet &= 0x7F
+
+        if escaped:
+            chars.append(GSM7_EXTENSION.get(septet, GSM7_BASIC[septet]))
+            escaped = False
+        elif septet == 0x1B:
+            escaped = True
+        else:
+            chars.append(GSM7_BASIC[septet])
+
+    return "".join(chars)
+
+
+def transliterate(text):
+    """Replace look-alike characters outside GSM 03.38 with their GSM equivalents"""
+    return (text or "").translate(_TRANSLITERATION_TABLE)
+
+
+def ucs2_length(text):
+    """Length of text in UTF-16 code units; characters outside the BMP take two"""
+    return len((text or "").encode("utf-16-be")) // 2
+
+
+def encode_message(text, data_coding):
+    """
+    Encode message text for an SMPP data_coding
+
+    Returns:
+        bytes: short_message payload, one septet per octet for GSM 7-bit
+    """
+    data_coding = int(data_coding or 0)
+
+    if data_coding == DATA_CODING_GSM7:
+        return encode_gsm7(text)
+    if data_coding == DATA_CODING_UCS2:
+        return text.encode("utf-16-be")
+    if data_coding == 1:  # IA5 / ASCII
+        return text.encode("ascii", "replace")
+    if data_coding == 3:  # Latin-1
+        return text.encode("latin-1", "replace")
+
+    return text.encode("utf-8")
+
+
+def get_message_stats(text, reference_bits=8, transliterate_text=False):
+    """
+    Choose the cheapest data_coding for a message and count its parts
+
+    Args:
+        text: Message text
+        reference_bits: 8 or 16 bit concatenation reference
+        transliterate_text: Replace look-alikes when that lets the text go out as GSM 7-bit
+
+    Returns:
+        dict: text to send, data_coding, encoding, length (in characters of that encoding),
+            sms_parts and segments_saved by transliteration
+    """
+    stats = _get_stats(text, reference_bits)
+
+    if transliterate_text and stats["data_coding"] == DATA_CODING_UCS2:
+        transliterated = _get_stats(transliterate(text), reference_bits)
+
+        # Only worth it when nothing is left that needs UCS2
+        if transliterated["data_coding"] == DATA_CODING_GSM7:
+            transliterated["segments_saved"] = stats["sms_parts"] - transliterated["sms_parts"]
+            return transliterated
+
+    return stats
+
+
+def _get_stats(text, reference_bits):
+    septets = to_septets(text)
+
+    if septets is not None:
+        data_coding, encoding = DATA_CODING_GSM7, "GSM 7-bit"
+        encoded = septets.encode("ascii")
+        length = len(encoded)
+    else:
+        data_coding, encoding = DATA_CODING_UCS2, "UCS2"
+        encoded = (text or "").encode("utf-16-be")
+        length = len(encoded) // 2
+
+    return {
+        "text": text,
+        "data_coding": data_coding,
+        "encoding": encoding,
+        "length": length,
+        # Counted the way the message is split, so an escape or surrogate pair on a boundary is included
+        "sms_parts": count_encoded_parts(encoded, data_coding, reference_bits),
+        "segments_saved": 0
+    }
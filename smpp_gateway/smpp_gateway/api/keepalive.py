@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Keepalive Scheduler
+One thread per process keeps a timer heap over every bound session and
+sends enquire_link only to sessions that have been idle for a full
+enquire_link_timer; sessions carrying traffic are skipped
+"""
+
+from __future__ import unicode_literals
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+
+def new_keepalive_stats():
+    """Counters kept per session instead of an SMPP Connection Log row per keepalive"""
+    return {
+        "sent": 0,          # enquire_link written by the scheduler
+        "skipped": 0,       # timer fired while traffic kept the link alive
+        "acknowledged": 0,  # enquire_link_resp received
+        "answered": 0,      # SMSC-initiated enquire_link answered
+        "failed": 0         # enquire_link could not be written
+    }
+
+
+class KeepaliveScheduler:
+    """Timer heap of (due, order, client, token); clients are held weakly"""
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def register(self, client, interval):
+        """
+        Schedule keepalives for a freshly bound client
+
+        The client's `keepalive()` is called when due and returns the monotonic
+        time of its next call, or None to drop out of the schedule. Registering
+        again replaces the previous schedule.
+        """
+        token = client._keepalive_token = object()
+
+        with self._condition:
+            heapq.heappush(self._heap, (time.monotonic() + interval, next(self._order),
+                                        weakref.ref(client), token))
+            self._start()
+            self._condition.notify()
+
+    def unregister(self, client):
+        """Stop keepalives for a client; its heap entry is dropped when it comes due"""
+        client._keepalive_token = None
+
+    @property
+    def scheduled(self):
+        return len(self._heap)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="smpp-keepalive", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due, _order, ref, token = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+
+            client = ref()
+            if client is None or client._keepalive_token is not token:
+                continue
+
+            try:
+                next_due = client.keepalive()
+            except Exception as e:
+                client.logger.error(f"Keepalive failed: {str(e)}")
+                next_due = None
+
+            if next_due is not None:
+                with self._condition:
+                    heapq.heappush(self._heap, (next_due, next(self._order), ref, token))
+
+
+_scheduler = KeepaliveScheduler()
+
+
+def get_keepalive_scheduler():
+    """The keepalive scheduler of this process"""
+    return _scheduler
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP PDU Codec
+Writes submit_sm, submit_multi and query_sm straight into a reusable buffer
+with precompiled struct layouts and decodes their responses and deliver_sm
+from the receive buffer, keeping smpplib's per-field PDU objects off the hot path
+"""
+
+from __future__ import unicode_literals
+import struct
+
+
+GENERIC_NACK = 0x80000000
+QUERY_SM = 0x00000003
+QUERY_SM_RESP = 0x80000003
+SUBMIT_SM = 0x00000004
+SUBMIT_SM_RESP = 0x80000004
+DELIVER_SM = 0x00000005
+DELIVER_SM_RESP = 0x80000005
+UNBIND = 0x00000006
+UNBIND_RESP = 0x80000006
+ENQUIRE_LINK = 0x00000015
+ENQUIRE_LINK_RESP = 0x80000015
+SUBMIT_MULTI = 0x00000021
+SUBMIT_MULTI_RESP = 0x80000021
+
+# message_state of query_sm_resp
+MESSAGE_STATES = {
+    1: "ENROUTE",
+    2: "DELIVERED",
+    3: "EXPIRED",
+    4: "DELETED",
+    5: "UNDELIVERABLE",
+    6: "ACCEPTED",
+    7: "UNKNOWN",
+    8: "REJECTED",
+}
+
+# Optional parameter carrying message text longer than short_message allows
+TAG_MESSAGE_PAYLOAD = 0x0424
+
+# dest_flag of an SME address in submit_multi
+DEST_FLAG_SME_ADDRESS = 1
+
+# number_of_dests is one octet; 254 is the usual SMSC limit
+MAX_MULTI_DESTINATIONS = 254
+
+# command_length, command_id, command_status, sequence_number
+HEADER = struct.Struct(">IIII")
+HEADER_SIZE = HEADER.size
+
+_COMMAND_LENGTH = struct.Struct(">I")
+_COMMAND_ID = struct.Struct(">I")
+# addr_ton, addr_npi
+_ADDRESS = struct.Struct(">BB")
+# esm_class, protocol_id, priority_flag
+_SUBMIT_FLAGS = struct.Struct(">BBB")
+# registered_delivery, replace_if_present_flag, data_coding, sm_default_msg_id
+_SUBMIT_OPTIONS = struct.Struct(">BBBB")
+# the options followed by sm_length
+_SUBMIT_TAIL = struct.Struct(">BBBBB")
+# tag, length
+_TLV = struct.Struct(">HH")
+# dest_flag, dest_addr_ton, dest_addr_npi
+_MULTI_ADDRESS = struct.Struct(">BBB")
+# error_status_code of an unsuccessful submit_multi destination
+_ERROR_STATUS = struct.Struct(">I")
+# message_state, error_code of query_sm_resp
+_QUERY_STATE = struct.Struct(">BB")
+
+# short_message is limited to 254 octets; longer payloads need message_payload
+MAX_SHORT_MESSAGE = 254
+
+# Anything larger is a framing error, not a PDU
+MAX_PDU_LENGTH = 64 * 1024
+
+
+def _cstring(value):
+    if not value:
+        return b""
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode("utf-8")
+
+
+def _put_cstring(buffer, offset, value):
+    end = offset + len(value)
+    buffer[offset:end] = value
+    buffer[end] = 0
+    return end + 1
+
+
+def _get_cstring(buffer, offset, end):
+    """Return (text, offset after the terminating NUL) of a C-Octet String"""
+    stop = buffer.index(0, offset, end)
+    return str(memoryview(buffer)[offset:stop], "ascii", "replace"), stop + 1
+
+
+class SubmitSMSkeleton:
+    """The fixed fields of a submit_sm, encoded once and reused for every destination and body"""
+
+    __slots__ = ("params", "source", "dest_ton_npi", "prefix", "middle")
+
+    def __init__(self, params):
+        self.params = params
+
+        service_type = _cstring(params.get("service_type"))
+        source_addr = _cstring(params.get("source_addr"))
+        schedule_delivery_time = _cstring(params.get("schedule_delivery_time"))
+        validity_period = _cstring(params.get("validity_period"))
+
+        # service_type up to source_addr
+        self.source = b"".join([
+            service_type, b"\0",
+            _ADDRESS.pack(params.get("source_addr_ton") or 0, params.get("source_addr_npi") or 0),
+            source_addr, b"\0"
+        ])
+        self.dest_ton_npi = (params.get("dest_addr_ton") or 0, params.get("dest_addr_npi") or 0)
+        self.prefix = self.source + _ADDRESS.pack(*self.dest_ton_npi)
+
+        # esm_class up to sm_default_msg_id
+        self.middle = b"".join([
+            _SUBMIT_FLAGS.pack(params.get("esm_class") or 0,
+                               params.get("protocol_id") or 0,
+                               params.get("priority_flag") or 0),
+            schedule_delivery_time, b"\0",
+            validity_period, b"\0",
+            _SUBMIT_OPTIONS.pack(params.get("registered_delivery") or 0,
+                                 params.get("replace_if_present_flag") or 0,
+                                 params.get("data_coding") or 0,
+                                 params.get("sm_default_msg_id") or 0)
+        ])
+
+
+class PDUEncoder:
+    """Writes outgoing PDUs into one reusable buffer; each result is only valid until the next call"""
+
+    def __init__(self, size=512):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def _reserve(self, length):
+        if length > len(self.buffer):
+            self.view.release()
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+    def submit_sm(self, sequence, params):
+        """
+        Encode a submit_sm
+
+        Only the sequence, destination_addr, short_message and TLVs are written per
+        call; everything else is copied from the precompiled skeleton.
+
+        Args:
+            sequence: sequence_number of the PDU
+            params: `skeleton`, `destination_addr`, `short_message` and optional `tlvs` as
+                (tag, bytes) pairs; without a skeleton, the full submit_sm parameters
+
+        Returns:
+            memoryview: The encoded PDU
+        """
+        skeleton = params.get("skeleton") or SubmitSMSkeleton(params)
+        destination_addr = _cstring(params.get("destination_addr"))
+        short_message = params.get("short_message") or b""
+        tlvs = params.get("tlvs") or ()
+
+        prefix = skeleton.prefix
+        length = (HEADER_SIZE + len(prefix) + len(destination_addr) + 1
+                  + self._body_length(skeleton, short_message, tlvs))
+
+        self._reserve(length)
+        buffer = self.buffer
+
+        HEADER.pack_into(buffer, 0, length, SUBMIT_SM, 0, sequence)
+
+        end = HEADER_SIZE + len(prefix)
+        buffer[HEADER_SIZE:end] = prefix
+        offset = _put_cstring(buffer, end, destination_addr)
+
+        self._write_body(offset, skeleton, short_message, tlvs)
+        return self.view[:length]
+
+    def submit_multi(self, sequence, params):
+        """
+        Encode a submit_multi carrying one body to many SME addresses
+
+        Args:
+            sequence: sequence_number of the PDU
+            params: `skeleton`, `destinations` (list of addresses), `short_message` and optional `tlvs`
+
+        Returns:
+            memoryview: The encoded PDU
+        """
+        skeleton = params["skeleton"]
+        destinations = [_cstring(address) for address in params["destinations"]]
+        short_message = params.get("short_message") or b""
+        tlvs = params.get("tlvs") or ()
+
+        if not 0 < len(destinations) <= MAX_MULTI_DESTINATIONS:
+            raise ValueError(f"submit_multi takes 1 to {MAX_MULTI_DESTINATIONS} destinations, got {len(destinations)}")
+
+        source = skeleton.source
+        length = (HEADER_SIZE + len(source) + 1
+                  + sum(_MULTI_ADDRESS.size + len(address) + 1 for address in destinations)
+                  + self._body_length(skeleton, short_message, tlvs))
+
+        self._reserve(length)
+        buffer = self.buffer
+
+        HEADER.pack_into(buffer, 0, length, SUBMIT_MULTI, 0, sequence)
+
+        offset = HEADER_SIZE + len(source)
+        buffer[HEADER_SIZE:offset] = source
+        buffer[offset] = len(destinations)
+        offset += 1
+
+        dest_addr_ton, dest_addr_npi = skeleton.dest_ton_npi
+        for address in destinations:
+            _MULTI_ADDRESS.pack_into(buffer, offset, DEST_FLAG_SME_ADDRESS, dest_addr_ton, dest_addr_npi)
+            offset = _put_cstring(buffer, offset + _MULTI_ADDRESS.size, address)
+
+        self._write_body(offset, skeleton, short_message, tlvs)
+        return self.view[:length]
+
+    def query_sm(self, sequence, params):
+        """
+        Encode a query_sm
+
+        Args:
+            sequence: sequence_number of the PDU
+            params: `message_id`, `source_addr_ton`, `source_addr_npi` and `source_addr`
+
+        Returns:
+            memoryview: The encoded PDU
+        """
+        message_id = _cstring(params.get("message_id"))
+        source_addr = _cstring(params.get("source_addr"))
+        length = HEADER_SIZE + len(message_id) + 1 + _ADDRESS.size + len(source_addr) + 1
+
+        self._reserve(length)
+        buffer = self.buffer
+
+        HEADER.pack_into(buffer, 0, length, QUERY_SM, 0, sequence)
+
+        offset = _put_cstring(buffer, HEADER_SIZE, message_id)
+        _ADDRESS.pack_into(buffer, offset, int(params.get("source_addr_ton") or 0),
+                           int(params.get("source_addr_npi") or 0))
+        _put_cstring(buffer, offset + _ADDRESS.size, source_addr)
+
+        return self.view[:length]
+
+    def _body_length(self, skeleton, short_message, tlvs):
+        if len(short_message) > MAX_SHORT_MESSAGE:
+            raise ValueError(f"short_message is {len(short_message)} octets, at most {MAX_SHORT_MESSAGE} are allowed")
+
+        return (len(skeleton.middle) + 1 + len(short_message)
+                + sum(_TLV.size + len(value) for _tag, value in tlvs))
+
+    def _write_body(self, offset, skeleton, short_message, tlvs):
+        """Write esm_class through the optional parameters"""
+        buffer = self.buffer
+        middle = skeleton.middle
+
+        end = offset + len(middle)
+        buffer[offset:end] = middle
+        buffer[end] = len(short_message)
+        offset = end + 1
+
+        buffer[offset:offset + len(short_message)] = short_message
+        offset += len(short_message)
+
+        for tag, value in tlvs:
+            _TLV.pack_into(buffer, offset, tag, len(value))
+            offset += _TLV.size
+            buffer[offset:offset + len(value)] = value
+            offset += len(value)
+
+    def response(self, command_id, sequence, status=0):
+        """Encode a response without parameters; deliver_sm_resp carries an empty message_id"""
+        length = HEADER_SIZE + (1 if command_id == DELIVER_SM_RESP else 0)
+
+        self._reserve(length)
+        HEADER.pack_into(self.buffer, 0, length, command_id, status, sequence)
+
+        if command_id == DELIVER_SM_RESP:
+            self.buffer[HEADER_SIZE] = 0
+
+        return self.view[:length]
+
+
+class PDUReader:
+    """Reads whole PDUs from a blocking socket into one reusable receive buffer"""
+
+    def __init__(self, size=1024):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+    def read(self, sock):
+        """
+        Read the next PDU into `buffer`
+
+        Returns:
+            int: command_length of the PDU now at the start of the buffer
+        """
+        self._fill(sock, 0, 4)
+        length = _COMMAND_LENGTH.unpack_from(self.buffer, 0)[0]
+
+        if length < HEADER_SIZE or length > MAX_PDU_LENGTH:
+            raise ConnectionError(f"Broken PDU: command_length {length}")
+
+        if length > len(self.buffer):
+            self.view.release()
+            self.buffer = bytearray(self.buffer[:4]) + bytearray(length - 4)
+            self.view = memoryview(self.buffer)
+
+        self._fill(sock, 4, length)
+        return length
+
+    def _fill(self, sock, start, end):
+        while start < end:
+            received = sock.recv_into(self.view[start:end])
+            if not received:
+                raise ConnectionError("Connection closed by SMSC")
+            start += received
+
+
+class SubmitSMResp:
+    """submit_sm_resp decoded without smpplib; quacks like the smpplib PDU where callers look"""
+
+    __slots__ = ("sequence", "status", "message_id")
+
+    command = "submit_sm_resp"
+
+    def __init__(self, sequence, status, message_id):
+        self.sequence = sequence
+        self.status = status
+        self.message_id = message_id
+
+    def is_error(self):
+        return self.status != 0
+
+
+class SubmitMultiResp(SubmitSMResp):
+    """submit_multi_resp with the destinations the SMSC refused, as {address: error_status_code}"""
+
+    __slots__ = ("unsuccess",)
+
+    command = "submit_multi_resp"
+
+    def __init__(self, sequence, status, message_id, unsuccess):
+        super(SubmitMultiResp, self).__init__(sequence, status, message_id)
+        self.unsuccess = unsuccess
+
+
+class QuerySMResp(SubmitSMResp):
+    """query_sm_resp with the state of the queried message"""
+
+    __slots__ = ("final_date", "message_state", "error_code")
+
+    command = "query_sm_resp"
+
+    def __init__(self, sequence, status, message_id, final_date, message_state, error_code):
+        super(QuerySMResp, self).__init__(sequence, status, message_id)
+        self.final_date = final_date
+        self.message_state = message_state
+        self.error_code = error_code
+
+
+class GenericNack(SubmitSMResp):
+    """generic_nack: the SMSC could not make sense of the request with this sequence number"""
+
+    __slots__ = ()
+
+    command = "generic_nack"
+
+    def __init__(self, sequence, status):
+        super(GenericNack, self).__init__(sequence, status, "")
+
+    def is_error(self):
+        return True
+
+
+class DeliverSM:
+    """deliver_sm decoded without smpplib"""
+
+    __slots__ = ("sequence", "service_type", "source_addr_ton", "source_addr_npi", "source_addr",
+                 "dest_addr_ton", "dest_addr_npi", "destination_addr", "esm_class", "protocol_id",
+                 "priority_flag", "data_coding", "short_message", "optional_params")
+
+    command = "deliver_sm"
+
+    def is_error(self):
+        return False
+
+
+def encode_enquire_link(sequence):
+    """enquire_link as new bytes, for writers that must not share the encoder buffer"""
+    return HEADER.pack(HEADER_SIZE, ENQUIRE_LINK, 0, sequence)
+
+
+def get_command_id(buffer):
+    """command_id of the PDU at the start of a buffer"""
+    return _COMMAND_ID.unpack_from(buffer, 4)[0]
+
+
+def decode_header(buffer):
+    """Return (command_length, command_id, command_status, sequence_number)"""
+    return HEADER.unpack_from(buffer, 0)
+
+
+def decode_generic_nack(buffer):
+    """Decode a generic_nack, which is a bare header"""
+    _length, _command_id, status, sequence = HEADER.unpack_from(buffer, 0)
+    return GenericNack(sequence, status)
+
+
+def decode_submit_sm_resp(buffer, length):
+    """Decode a submit_sm_resp; error responses may omit the message_id"""
+    _length, _command_id, status, sequence = HEADER.unpack_from(buffer, 0)
+
+    message_id = ""
+    if length > HEADER_SIZE:
+        message_id = _get_cstring(buffer, HEADER_SIZE, length)[0]
+
+    return SubmitSMResp(sequence, status, message_id)
+
+
+def decode_submit_multi_resp(buffer, length):
+    """Decode a submit_multi_resp with its unsuccess_sme list"""
+    _length, _command_id, status, sequence = HEADER.unpack_from(buffer, 0)
+
+    message_id = ""
+    unsuccess = {}
+
+    if length > HEADER_SIZE:
+        message_id, offset = _get_cstring(buffer, HEADER_SIZE, length)
+
+        no_unsuccess = buffer[offset] if offset < length else 0
+        offset += 1
+
+        for _index in range(no_unsuccess):
+            address, offset = _get_cstring(buffer, offset + _ADDRESS.size, length)
+            unsuccess[address] = _ERROR_STATUS.unpack_from(buffer, offset)[0]
+            offset += _ERROR_STATUS.size
+
+    return SubmitMultiResp(sequence, status, message_id, unsuccess)
+
+
+def decode_query_sm_resp(buffer, length):
+    """Decode a query_sm_resp; error responses may carry no body"""
+    _length, _command_id, status, sequence = HEADER.unpack_from(buffer, 0)
+
+    message_id = final_date = ""
+    message_state = error_code = 0
+
+    if length > HEADER_SIZE:
+        message_id, offset = _get_cstring(buffer, HEADER_SIZE, length)
+        final_date, offset = _get_cstring(buffer, offset, length)
+
+        if offset + _QUERY_STATE.size <= length:
+            message_state, error_code = _QUERY_STATE.unpack_from(buffer, offset)
+
+    return QuerySMResp(sequence, status, message_id, final_date, message_state, error_code)
+
+
+def decode_deliver_sm(buffer, length):
+    """Decode a deliver_sm, optional parameters included, as a DeliverSM"""
+    pdu = DeliverSM()
+    pdu.sequence = HEADER.unpack_from(buffer, 0)[3]
+
+    pdu.service_type, offset = _get_cstring(buffer, HEADER_SIZE, length)
+
+    pdu.source_addr_ton, pdu.source_addr_npi = _ADDRESS.unpack_from(buffer, offset)
+    pdu.source_addr, offset = _get_cstring(buffer, offset + _ADDRESS.size, length)
+
+    pdu.dest_addr_ton, pdu.dest_addr_npi = _ADDRESS.unpack_from(buffer, offset)
+    pdu.destination_addr, offset = _get_cstring(buffer, offset + _ADDRESS.size, length)
+
+    pdu.esm_class, pdu.protocol_id, pdu.priority_flag = _SUBMIT_FLAGS.unpack_from(buffer, offset)
+
+    # schedule_delivery_time and validity_period are always empty in deliver_sm
+    offset = _get_cstring(buffer, offset + _SUBMIT_FLAGS.size, length)[1]
+    offset = _get_cstring(buffer, offset, length)[1]
+
+    _registered, _replace, pdu.data_coding, _default_msg_id, sm_length = _SUBMIT_TAIL.unpack_from(buffer, offset)
+    offset += _SUBMIT_TAIL.size
+
+    pdu.short_message = bytes(buffer[offset:offset + sm_length])
+    offset += sm_length
+
+    pdu.optional_params = {}
+    while offset + _TLV.size <= length:
+        tag, tlv_length = _TLV.unpack_from(buffer, offset)
+        offset += _TLV.size
+        pdu.optional_params[tag] = bytes(buffer[offset:offset + tlv_length])
+        offset += tlv_length
+
+    return pdu
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Priority Lanes
+Keeps pending submits in one FIFO lane per SMPP priority_flag (0-3) and
+dequeues them by weighted fair share, so an urgent OTP overtakes a bulk
+send without starving it
+"""
+
+from __future__ import unicode_literals
+from collections import deque
+from frappe.utils import cint
+
+
+URGENT_LANE = 3
+
+# Jobs taken from each lane, lowest priority first, per round of the weighted fair dequeue
+LANE_WEIGHTS = (1, 2, 4, 8)
+
+# Default share of the submit window only urgent jobs may use
+URGENT_WINDOW_SHARE = 10
+
+
+def get_lane(sms_doc):
+    """Lane of a message: its priority clamped to 0-3"""
+    return max(0, min(URGENT_LANE, cint(sms_doc.priority)))
+
+
+def get_reserved_slots(config, window_size):
+    """
+    Number of window slots kept for urgent jobs
+
+    At least one slot is always left for other traffic.
+
+    Args:
+        config: SMPP Configuration document
+        window_size: Submit window size of one bind
+
+    Returns:
+        int: Slots at the top of the window only the urgent lane may fill
+    """
+    share = config.get("urgent_window_share")
+    if share is None:
+        share = URGENT_WINDOW_SHARE
+
+    if not share or window_size < 2:
+        return 0
+
+    return min(window_size - 1, max(1, int(window_size * share / 100.0 + 0.5)))
+
+
+class PriorityLanes:
+    """Pending jobs in one deque per lane; the lane of a job is job["lane"], 0 if missing"""
+
+    def __init__(self, jobs=(), weights=LANE_WEIGHTS):
+        self._weights = weights
+        self._lanes = [deque() for _weight in weights]
+        self._credits = list(weights)
+        self.extend(jobs)
+
+    def __len__(self):
+        return sum(len(lane) for lane in self._lanes)
+
+    def __bool__(self):
+        return any(self._lanes)
+
+    def __iter__(self):
+        for lane in reversed(self._lanes):
+            yield from lane
+
+    def append(self, job):
+        self._lanes[job.get("lane", 0)].append(job)
+
+    def appendleft(self, job):
+        """Put a job back at the head of its lane, e.g. to replay it"""
+        self._lanes[job.get("lane", 0)].appendleft(job)
+
+    def extend(self, jobs):
+        for job in jobs:
+            self.append(job)
+
+    def extendleft(self, jobs):
+        for job in jobs:
+            self.appendleft(job)
+
+    def has_urgent(self):
+        return bool(self._lanes[URGENT_LANE])
+
+    def popleft(self):
+        """
+        Take the next job by weighted round robin
+
+        Every lane may give up to its weight in jobs per round, higher lanes
+        first; a new round starts once no lane with jobs has credit left.
+        """
+        for _round in range(2):
+            for index in range(len(self._lanes) - 1, -1, -1):
+                if self._lanes[index] and self._credits[index] > 0:
+                    self._credits[index] -= 1
+                    return self._lanes[index].popleft()
+
+            self._credits = list(self._weights)
+
+        raise IndexError("pop from empty PriorityLanes")
+
+    def pop_urgent(self):
+        """Take the next urgent job, or None if there is none"""
+        lane = self._lanes[URGENT_LANE]
+        return lane.popleft() if lane else None
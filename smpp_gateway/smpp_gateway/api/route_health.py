@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Route Health
+Tracks submit_sm_resp latency and error rate per SMPP Configuration, shares
+the averages of every process through Redis and steers traffic between the
+routes of one prefix toward the fastest healthy configuration
+"""
+
+from __future__ import unicode_literals
+import os
+import random
+import socket
+import threading
+import time
+import frappe
+
+from smpp_gateway.smpp_gateway.api.endpoint_health import (
+    ERROR_PENALTY, MAX_ERROR_RATE, MAX_RESPONSE_LATENCY, ResponseHealth
+)
+
+
+ROUTE_HEALTH_KEY = "smpp_gateway:route_health"
+
+# Seconds between two writes of this process's averages to Redis
+PUBLISH_INTERVAL = 5
+
+# Seconds a process trusts its merged view before reading Redis again
+SNAPSHOT_INTERVAL = 5
+
+# Averages a process has not refreshed for this long are dropped, so a configuration
+# that stopped getting traffic because it was unhealthy is tried again
+STALE_AFTER = 60
+
+# Added to every score before weighting, so an unmeasured configuration does not take all traffic
+SCORE_FLOOR = 0.05
+
+_PROCESS = f"{socket.gethostname()}:{os.getpid()}"
+
+# (site, configuration name) -> ResponseHealth fed by every session of this process
+_stats = {}
+_stats_lock = threading.Lock()
+
+# site -> monotonic time of the last publish
+_published_at = {}
+
+# site -> (monotonic time, merged averages)
+_snapshots = {}
+
+
+def get_route_stats(config_name):
+    """Process-local response averages of a configuration, shared by all its sessions"""
+    key = (frappe.local.site, config_name)
+    with _stats_lock:
+        if key not in _stats:
+            _stats[key] = ResponseHealth()
+
+        return _stats[key]
+
+
+def publish_route_health(force=False):
+    """Write this process's averages of the current site to Redis, at most every PUBLISH_INTERVAL seconds"""
+    site = frappe.local.site
+    current = time.monotonic()
+    if not force and current - _published_at.get(site, 0) < PUBLISH_INTERVAL:
+        return
+
+    _published_at[site] = current
+    with _stats_lock:
+        measured = [(config_name, stats) for (stats_site, config_name), stats in _stats.items()
+                    if stats_site == site and stats.samples]
+
+    cache = frappe.cache()
+    for config_name, stats in measured:
+        cache.hset(ROUTE_HEALTH_KEY, f"{config_name}|{_PROCESS}", {
+            "smpp_configuration": config_name,
+            "response_latency": stats.response_latency,
+            "error_rate": stats.error_rate,
+            "samples": stats.samples,
+            "updated": time.time()
+        })
+
+
+def get_route_health():
+    """
+    Get the averages of every SMPP Configuration merged over all processes
+
+    Each process's entry is weighted by its number of samples.
+
+    Returns:
+        dict: Configuration name -> dict with response_latency, error_rate, healthy and score
+    """
+    site = frappe.local.site
+    current = time.monotonic()
+    snapshot = _snapshots.get(site)
+    if snapshot and current - snapshot[0] < SNAPSHOT_INTERVAL:
+        return snapshot[1]
+
+    cache = frappe.cache()
+    totals = {}
+    for field, entry in (cache.hgetall(ROUTE_HEALTH_KEY) or {}).items():
+        if not entry or time.time() - entry["updated"] > STALE_AFTER:
+            cache.hdel(ROUTE_HEALTH_KEY, field)
+            continue
+
+        weight = max(1, entry["samples"])
+        total = totals.setdefault(entry["smpp_configuration"], [0.0, 0.0, 0])
+        total[0] += entry["response_latency"] * weight
+        total[1] += entry["error_rate"] * weight
+        total[2] += weight
+
+    health = {}
+    for config_name, (latency, error_rate, weight) in totals.items():
+        latency, error_rate = latency / weight, error_rate / weight
+        health[config_name] = {
+            "response_latency": round(latency, 3),
+            "error_rate": round(error_rate, 3),
+            "healthy": error_rate < MAX_ERROR_RATE and latency < MAX_RESPONSE_LATENCY,
+            "score": latency + error_rate * ERROR_PENALTY
+        }
+
+    _snapshots[site] = (current, health)
+    return health
+
+
+def pick_route(routes, exclude=None):
+    """
+    Choose a configuration among the routes of one prefix
+
+    Healthy routes of the best priority that has any share the traffic in
+    inverse proportion to the square of their score, so the fastest gets most of it.
+    Configurations without measurements count as healthy.
+
+    Args:
+        routes: Route dicts, best priority first
+        exclude: Configuration name to leave out
+
+    Returns:
+        str: SMPP Configuration name, or None if no route is healthy
+    """
+    health = get_route_health()
+    priority = None
+    choices = []
+    weights = []
+
+    for route in routes:
+        config_name = route["smpp_configuration"]
+        entry = health.get(config_name)
+        if config_name == exclude or (entry and not entry["healthy"]):
+            continue
+
+        if priority is not None and route["priority"] != priority:
+            break
+
+        priority = route["priority"]
+        choices.append(config_name)
+        weights.append((SCORE_FLOOR + (entry["score"] if entry else 0)) ** -2)
+
+    if len(choices) < 2:
+        return choices[0] if choices else None
+
+    return random.choices(choices, weights)[0]
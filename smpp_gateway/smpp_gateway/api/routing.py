@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Destination Routing
+Compiles the enabled SMPP Routes into a digit trie, so every recipient is
+sent through the SMPP Configuration of its longest matching number prefix
+"""
+
+from __future__ import unicode_literals
+import re
+import threading
+import time
+import frappe
+
+from smpp_gateway.smpp_gateway.api.route_health import get_route_health, pick_route
+
+
+ROUTES_VERSION_KEY = "smpp_gateway:routes_version"
+
+# Seconds a process trusts its trie before checking whether another process changed the routes
+ROUTES_CHECK_INTERVAL = 5
+
+_NON_DIGITS = re.compile(r"\D")
+
+# Key of the routes stored at a trie node; digits are single characters, so it cannot clash
+_ROUTES = ""
+
+
+class PrefixTrie:
+    """Digit trie of number prefixes; every node is a dict of child digits"""
+
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, prefix, route):
+        """Add a route for a prefix; routes of one prefix are kept best first"""
+        node = self._root
+        for digit in prefix:
+            node = node.setdefault(digit, {})
+
+        routes = node.setdefault(_ROUTES, [])
+        routes.append(route)
+        routes.sort(key=lambda route: route["priority"])
+        self._size += 1
+
+    def remove(self, prefix, name):
+        """Drop the route called `name` from a prefix and prune nodes left empty"""
+        path = [self._root]
+        for digit in prefix:
+            node = path[-1].get(digit)
+            if node is None:
+                return False
+            path.append(node)
+
+        routes = path[-1].get(_ROUTES) or []
+        kept = [route for route in routes if route["name"] != name]
+        if len(kept) == len(routes):
+            return False
+
+        self._size -= 1
+        if kept:
+            path[-1][_ROUTES] = kept
+            return True
+
+        del path[-1][_ROUTES]
+        for depth in range(len(prefix), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][prefix[depth - 1]]
+
+        return True
+
+    def longest_match(self, number):
+        """
+        Find the routes of the longest prefix of a number
+
+        Returns:
+            list: Route dicts, best first; empty if no prefix matches
+        """
+        node = self._root
+        match = node.get(_ROUTES)
+
+        for digit in number:
+            node = node.get(digit)
+            if node is None:
+                break
+            match = node.get(_ROUTES, match)
+
+        return match or []
+
+
+class Router:
+    """Prefix routes of the site, reloaded when another process changes them"""
+
+    def __init__(self):
+        # Held while the trie is read, patched or reloaded; reentrant because _refresh loads under it
+        self.lock = threading.RLock()
+        self.trie = PrefixTrie()
+        self.routes = {}
+        self.version = None
+        self.loaded = False
+        self.checked_at = 0
+
+    def route(self, number):
+        """
+        Pick the SMPP Configuration for a recipient
+
+        When several routes share the longest prefix, traffic is steered toward
+        the fastest healthy configuration; if none is healthy the best priority wins.
+
+        Args:
+            number: Recipient number, with or without a leading +
+
+        Returns:
+            str: SMPP Configuration name, or None if no route matches
+        """
+        routes = self.candidates(number)
+        if len(routes) > 1:
+            return pick_route(routes) or routes[0]["smpp_configuration"]
+
+        return routes[0]["smpp_configuration"] if routes else None
+
+    def reroute(self, number, current):
+        """Move a retry off `current` when it turned unhealthy and another route serves the number"""
+        routes = self.candidates(number)
+        if len(routes) < 2 or current not in [route["smpp_configuration"] for route in routes]:
+            return current
+
+        entry = get_route_health().get(current)
+        if not entry or entry["healthy"]:
+            return current
+
+        return pick_route(routes, exclude=current) or current
+
+    def has_routes(self):
+        with self.lock:
+            self._refresh()
+            return len(self.trie) > 0
+
+    def candidates(self, number):
+        """Routes of the longest matching prefix, best first"""
+        with self.lock:
+            self._refresh()
+            # A copy, since _apply sorts the list of a prefix in place
+            return list(self.trie.longest_match(normalize_prefix(number)))
+
+    def load(self):
+        """Compile every enabled route to an active configuration into a new trie"""
+        # Read before the rows, so a change committed in between is picked up by the next check
+        version = frappe.cache().get_value(ROUTES_VERSION_KEY)
+
+        rows = frappe.get_all("SMPP Route",
+                              filters={"disabled": 0},
+                              fields=["name", "prefix", "smpp_configuration", "priority"])
+        active = _get_active_configurations()
+
+        trie = PrefixTrie()
+        routes = {}
+        for row in rows:
+            if row.smpp_configuration not in active:
+                continue
+
+            route = self._make_route(row)
+            trie.insert(route["prefix"], route)
+            routes[route["name"]] = route
+
+        with self.lock:
+            self.trie, self.routes = trie, routes
+            self.version = version
+            self.loaded = True
+            self.checked_at = time.monotonic()
+
+    def update(self, doc, deleted=False):
+        """
+        Apply one saved or deleted SMPP Route to the trie and tell other processes
+
+        Both happen once the transaction commits, so no process compiles rows
+        that are not committed yet or are rolled back.
+        """
+        route = None
+        if not deleted and not doc.disabled and doc.smpp_configuration in _get_active_configurations():
+            route = self._make_route(doc)
+
+        frappe.db.after_commit.add(lambda: self._apply(doc.name, route))
+
+    def invalidate(self):
+        """Recompile the trie in every process, e.g. after a configuration was switched off"""
+        frappe.db.after_commit.add(self._invalidate)
+
+    def _apply(self, name, route):
+        with self.lock:
+            # Patching a trie another process changed since it was loaded would hide that change
+            if self.loaded and frappe.cache().get_value(ROUTES_VERSION_KEY) != self.version:
+                self.loaded = False
+
+            # A trie that was never loaded picks the change up when it is
+            if self.loaded:
+                old = self.routes.pop(name, None)
+                if old:
+                    self.trie.remove(old["prefix"], old["name"])
+
+                if route:
+                    self.routes[name] = route
+                    self.trie.insert(route["prefix"], route)
+
+            self._publish()
+
+    def _invalidate(self):
+        with self.lock:
+            self.loaded = False
+            self._publish()
+
+    def _publish(self):
+        self.version = frappe.generate_hash(length=10)
+        frappe.cache().set_value(ROUTES_VERSION_KEY, self.version)
+
+    def _refresh(self):
+        """Reload the trie if it is missing or another process changed the routes; called with the lock held"""
+        current = time.monotonic()
+        if self.loaded and current - self.checked_at < ROUTES_CHECK_INTERVAL:
+            return
+
+        self.checked_at = current
+        if not self.loaded or frappe.cache().get_value(ROUTES_VERSION_KEY) != self.version:
+            self.load()
+
+    def _make_route(self, row):
+        return {
+            "name": row.name,
+            "prefix": normalize_prefix(row.prefix),
+            "smpp_configuration": row.smpp_configuration,
+            "priority": row.priority or 0
+        }
+
+
+def _get_active_configurations():
+    return set(frappe.get_all("SMPP Configuration", filters={"is_active": 1}, pluck="name"))
+
+
+def normalize_prefix(number):
+    """Digits of a number or prefix, without + or separators"""
+    return _NON_DIGITS.sub("", number or "")
+
+
+# One router per site served by this process
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router():
+    """The prefix router of the current site"""
+    site = frappe.local.site
+    with _routers_lock:
+        if site not in _routers:
+            _routers[site] = Router()
+
+        return _routers[site]
+
+
+def route_number(number, default=None):
+    """SMPP Configuration for a recipient, falling back to `default` when no route matches"""
+    return get_router().route(number) or default
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+SMS Segmentation
+Splits encoded message text into concatenated SMS parts with a User Data
+Header (3GPP TS 23.040) and packs GSM 7-bit text into septets
+"""
+
+from __future__ import unicode_literals
+import random
+import threading
+
+
+# esm_class bit telling the SMSC that short_message starts with a UDH
+ESM_CLASS_UDHI = 0x40
+
+# Information Element Identifiers for concatenated short messages
+IEI_CONCAT_8BIT = 0x00
+IEI_CONCAT_16BIT = 0x08
+
+GSM7_ESCAPE = 0x1B
+
+# Characters per message as (single part, part with 8-bit ref, part with 16-bit ref)
+GSM7_LIMITS = (160, 153, 152)
+UCS2_LIMITS = (70, 67, 66)
+OCTET_LIMITS = (140, 134, 133)
+
+# The UDH concatenation counters are one octet wide
+MAX_PARTS = 255
+
+_reference = random.randrange(0x10000)
+_reference_lock = threading.Lock()
+
+
+def is_gsm7_coding(data_coding):
+    """SMSC default alphabet and IA5 are both counted in 7-bit characters"""
+    return int(data_coding or 0) in (0, 1)
+
+
+def is_ucs2(data_coding):
+    return int(data_coding or 0) == 8
+
+
+def get_limits(data_coding):
+    """Return the (single, 8-bit ref, 16-bit ref) part limits in characters"""
+    if is_ucs2(data_coding):
+        return UCS2_LIMITS
+    if is_gsm7_coding(data_coding):
+        return GSM7_LIMITS
+    return OCTET_LIMITS
+
+
+def count_parts(length, data_coding, reference_bits=8):
+    """
+    Estimate the SMS parts of a message from its length alone
+
+    For text that is not known yet, e.g. a template before its variables are
+    filled in. Parts are never split inside an escape or surrogate pair, so
+    known text is counted with count_encoded_parts, which can need one more.
+
+    Args:
+        length: Message length in characters (septets for GSM 7-bit, UTF-16 code units for UCS2)
+        data_coding: SMPP data_coding of the message
+        reference_bits: 8 or 16 bit concatenation reference
+
+    Returns:
+        int: Number of parts
+    """
+    single, ref8, ref16 = get_limits(data_coding)
+
+    if length <= single:
+        return 1
+
+    per_part = ref16 if int(reference_bits or 8) == 16 else ref8
+    return (length - 1) // per_part + 1
+
+
+def count_encoded_parts(encoded, data_coding, reference_bits=8):
+    """
+    Count the SMS parts split_units cuts encoded text into, without the MAX_PARTS check
+
+    Args:
+        encoded: Message bytes in the message's data_coding (one septet per octet for GSM 7-bit)
+        data_coding: SMPP data_coding of the message
+        reference_bits: 8 or 16 bit concatenation reference
+
+    Returns:
+        int: Number of parts
+    """
+    if fits_one_part(encoded, data_coding):
+        return 1
+
+    return sum(1 for _end in _part_ends(encoded, data_coding, reference_bits))
+
+
+def next_reference(reference_bits=8):
+    """Concatenation reference for a new multipart message"""
+    global _reference
+
+    with _reference_lock:
+        _reference = (_reference + 1) & 0xFFFF
+        return _reference if int(reference_bits or 8) == 16 else _reference & 0xFF
+
+
+def build_udh(reference, total, sequence, reference_bits=8):
+    """Build the concatenation User Data Header for one part"""
+    if int(reference_bits or 8) == 16:
+        return bytes([6, IEI_CONCAT_16BIT, 4, (reference >> 8) & 0xFF, reference & 0xFF, total, sequence])
+
+    return bytes([5, IEI_CONCAT_8BIT, 3, reference & 0xFF, total, sequence])
+
+
+def pack_septets(septets, fill_bits=0):
+    """
+    Pack 7-bit values into octets, least significant bit first
+
+    Args:
+        septets: bytes of GSM 7-bit values, one per octet
+        fill_bits: Zero bits placed before the first septet to align it after a UDH
+
+    Returns:
+        bytes: Packed user data
+    """
+    packed = bytearray()
+    accumulator = 0
+    bits = fill_bits
+
+    for septet in septets:
+        accumulator |= (septet & 0x7F) << bits
+        bits += 7
+
+        while bits >= 8:
+            packed.append(accumulator & 0xFF)
+            accumulator >>= 8
+            bits -= 8
+
+    if bits:
+        packed.append(accumulator & 0xFF)
+
+    return bytes(packed)
+
+
+def unpack_septets(packed, count, fill_bits=0):
+    """Unpack `count` septets from packed user data"""
+    septets = bytearray()
+    accumulator = 0
+    bits = -fill_bits
+
+    for octet in packed:
+        if bits < 0:
+            # Drop the fill bits in front of the first septet
+            octet >>= fill_bits
+            bits = 8 - fill_bits
+            accumulator = octet
+        else:
+            accumulator |= octet << bits
+            bits += 8
+
+        while bits >= 7 and len(septets) < count:
+            septets.append(accumulator & 0x7F)
+            accumulator >>= 7
+            bits -= 7
+
+    return bytes(septets)
+
+
+def fits_one_part(encoded, data_coding):
+    """Check whether encoded text goes out as a single SMS without concatenation"""
+    single = get_limits(data_coding)[0]
+    unit = 2 if is_ucs2(data_coding) else 1
+
+    return len(encoded) <= single * unit
+
+
+def split_units(encoded, data_coding, reference_bits=8):
+    """
+    Split encoded text into part payloads without breaking characters
+
+    UCS2 parts never end on a high surrogate and GSM 7-bit parts never end on
+    an escape, so a character is always carried whole by one part.
+
+    Args:
+        encoded: Message bytes in the message's data_coding (one septet per octet for GSM 7-bit)
+        data_coding: SMPP data_coding of the message
+        reference_bits: 8 or 16 bit concatenation reference
+
+    Returns:
+        list: bytes of each part, a single item if no concatenation is needed
+    """
+    if fits_one_part(encoded, data_coding):
+        return [encoded]
+
+    parts = []
+    start = 0
+
+    for end in _part_ends(encoded, data_coding, reference_bits):
+        parts.append(encoded[start:end])
+        start = end
+
+    if len(parts) > MAX_PARTS:
+        raise ValueError(f"Message needs {len(parts)} parts, at most {MAX_PARTS} are allowed")
+
+    return parts
+
+
+def _part_ends(encoded, data_coding, reference_bits):
+    """Offsets where the concatenated parts of encoded text end; shared by split_units and count_encoded_parts"""
+    _single, ref8, ref16 = get_limits(data_coding)
+    unit = 2 if is_ucs2(data_coding) else 1
+
+    per_part = (ref16 if int(reference_bits or 8) == 16 else ref8) * unit
+    start = 0
+
+    while start < len(encoded):
+        end = min(start + per_part, len(encoded))
+
+        if end < len(encoded):
+            if unit == 2 and 0xD8 <= encoded[end - 2] <= 0xDB:
+                end -= 2
+            elif unit == 1 and is_gsm7_coding(data_coding) and encoded[end - 1] == GSM7_ESCAPE:
+                end -= 1
+
+        yield end
+        start = end
+
+
+def segment_message(encoded, data_coding, reference_bits=8, pack=False):
+    """
+    Build the short_message of every part of a message
+
+    Args:
+        encoded: Message bytes in the message's data_coding (one septet per octet for GSM 7-bit)
+        data_coding: SMPP data_coding of the message
+        reference_bits: 8 or 16 bit concatenation reference
+        pack: Pack GSM 7-bit septets instead of sending one per octet
+
+    Returns:
+        tuple: (list of short_message bytes, True if they carry a UDH)
+    """
+    parts = split_units(encoded, data_coding, reference_bits)
+    pack = pack and is_gsm7_coding(data_coding)
+
+    if len(parts) == 1:
+        return [pack_septets(parts[0]) if pack else parts[0]], False
+
+    reference = next_reference(reference_bits)
+    short_messages = []
+
+    for sequence, part in enumerate(parts, 1):
+        udh = build_udh(reference, len(parts), sequence, reference_bits)
+
+        if pack:
+            # Septets start on the first septet boundary after the header
+            fill_bits = (7 - (len(udh) * 8) % 7) % 7
+            part = pack_septets(part, fill_bits)
+
+        short_messages.append(udh + part)
+
+    return short_messages, True
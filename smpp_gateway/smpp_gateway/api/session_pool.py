@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Session Pool
+Keeps up to max_binds sessions open for one SMPP Configuration and spreads
+traffic over them by least outstanding submit window
+"""
+
+from __future__ import unicode_literals
+import threading
+import time
+import frappe
+from frappe.utils import cint
+
+from smpp_gateway.smpp_gateway.api.endpoint_health import get_endpoints, should_fail_over
+from smpp_gateway.smpp_gateway.api.route_health import publish_route_health
+from smpp_gateway.smpp_gateway.api.smpp_client import create_client, reconnect_delay
+from smpp_gateway.smpp_gateway.api.status_buffer import flush_status_buffer
+
+
+class SMPPSessionPool:
+    def __init__(self, config_name=None):
+        self.config_name = config_name
+        self.lock = threading.Lock()
+
+        first = create_client(config_name)
+        self.config = first.config
+        self.logger = first.logger
+        self.max_binds = max(1, cint(self.config.get("max_binds") or 1))
+
+        self.sessions = [first] + [create_client(config_name) for _i in range(self.max_binds - 1)]
+
+        # Backoff of the rebinds attempted between batches
+        self._reconnect_attempt = 0
+        self._reconnect_at = 0
+
+    @property
+    def connected(self):
+        """True while at least one bind is up"""
+        return any(session.connected for session in self.sessions)
+
+    @property
+    def outstanding(self):
+        """Submits waiting for a response across all binds"""
+        return sum(session.outstanding for session in self.sessions)
+
+    @property
+    def keepalive_stats(self):
+        """enquire_link counters summed over all binds"""
+        totals = {}
+        for session in self.sessions:
+            for key, value in session.keepalive_stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def connect(self):
+        """Open every bind that is not up, replacing dead sessions"""
+        self.check_health(probe=False)
+
+        if not self.connected:
+            raise frappe.ValidationError(
+                f"Failed to connect to SMSC: no bind could be opened for {self.config.name}")
+
+        return True
+
+    def disconnect(self):
+        """Disconnect every bind"""
+        with self.lock:
+            for session in self.sessions:
+                session.disconnect()
+
+    def check_health(self, probe=True):
+        """Replace dead sessions with fresh ones and bind them; live sessions on a healthy endpoint are left alone"""
+        with self.lock:
+            replaced = 0
+            failed_over = 0
+
+            for index, session in enumerate(self.sessions):
+                if not session.io_lock.acquire(blocking=False):
+                    # A batch is using this bind and rebinds it itself if it drops
+                    continue
+                session.io_lock.release()
+
+                if session.connected and (not probe or session.ping()):
+                    if not should_fail_over(self.config, session.endpoint):
+                        continue
+
+                    # A healthier endpoint is available; move this bind there
+                    self.logger.warning(f"Bind {index + 1}/{self.max_binds} leaves unhealthy endpoint "
+                                        f"{session.endpoint.address}")
+                    session.disconnect()
+                    failed_over += 1
+
+                if getattr(session, "client", None) is not None or getattr(session, "session", None) is not None:
+                    # The old session held a socket that died; start from a clean client
+                    session = self.sessions[index] = create_client(self.config_name)
+                    replaced += 1
+
+                try:
+                    session.connect()
+                except Exception as e:
+                    self.logger.error(f"Bind {index + 1}/{self.max_binds} failed: {str(e)}")
+
+            return {
+                "binds": self.max_binds,
+                "connected": sum(1 for session in self.sessions if session.connected),
+                "replaced": replaced,
+                "failed_over": failed_over
+            }
+
+    def get_endpoint_health(self):
+        """Health scores of the SMSC endpoints of this configuration"""
+        return [endpoint.as_dict() for endpoint in get_endpoints(self.config)]
+
+    def send_sms(self, sms_doc):
+        """Send SMS message over the least busy bind"""
+        return self.send_sms_batch([sms_doc])[0]
+
+    def refresh_config(self):
+        """Pick up a configuration saved since the sessions were created"""
+        modified = frappe.db.get_value("SMPP Configuration", self.config.name, "modified")
+        if not modified or str(modified) == str(self.config.modified):
+            return False
+
+        self.config = frappe.get_doc("SMPP Configuration", self.config.name)
+        for session in self.sessions:
+            session.reload_config(self.config)
+
+        return True
+
+    def send_sms_batch(self, sms_docs, intake=None):
+        """Send SMS messages spread across all binds; see SMPPClient._send_across for `intake`"""
+        self.refresh_config()
+        self._ensure_binds()
+
+        live = [session for session in self.sessions if session.connected]
+        if not live:
+            return self.sessions[0].send_sms_batch(sms_docs, intake)
+
+        results = type(live[0])._send_across(live, sms_docs, intake)
+        flush_status_buffer()
+        publish_route_health()
+        return [results[sms_doc.name] for sms_doc in sms_docs]
+
+    def query_message_status(self, message_id, source_addr=""):
+        """Query message status over the least busy bind"""
+        return self.query_message_statuses([{"message_id": message_id, "source_addr": source_addr}])[0]
+
+    def query_message_statuses(self, queries):
+        """Pipeline query_sm PDUs for many messages across all binds"""
+        self.refresh_config()
+        self._ensure_binds()
+
+        live = [session for session in self.sessions if session.connected]
+        if not live:
+            return self.sessions[0].query_message_statuses(queries)
+
+        return type(live[0])._query_across(live, queries)
+
+    def process_delivery_receipts(self):
+        """Process incoming delivery receipts on every bind"""
+        for session in self.sessions:
+            session.process_delivery_receipts()
+
+        self._reconnect_lost()
+
+    def _reconnect_lost(self):
+        """Rebind dropped sessions as soon as they are noticed, with jittered exponential backoff"""
+        if all(session.connected for session in self.sessions):
+            self._reconnect_attempt = 0
+            return
+
+        if time.monotonic() < self._reconnect_at:
+            return
+
+        self.check_health(probe=False)
+
+        if all(session.connected for session in self.sessions):
+            self._reconnect_attempt = 0
+        else:
+            self._reconnect_at = time.monotonic() + reconnect_delay(self._reconnect_attempt)
+            self._reconnect_attempt += 1
+
+    def _ensure_binds(self):
+        """Rebind dead sessions and move sessions off endpoints that turned unhealthy"""
+        if not all(session.connected and not should_fail_over(self.config, session.endpoint)
+                   for session in self.sessions):
+            self.check_health(probe=False)
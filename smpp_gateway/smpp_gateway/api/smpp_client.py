@@ -4,21 +4,99 @@ from __future__ import unicode_literals
 import frappe
 import smpplib.client
 import smpplib.command
+import smpplib.consts
+import smpplib.exceptions
+import smpplib.smpp
+import random
+import select
+import socket
 import threading
 import time
 import logging
-from frappe.utils import now, add_to_date, get_datetime, cstr
+from collections import deque
+from contextlib import ExitStack
+from frappe.utils import now, add_to_date, get_datetime, cstr, cint
 from datetime import datetime
 import json
+from smpp_gateway.smpp_gateway.api.endpoint_health import SMSC_ERRORS, rank_endpoints
+from smpp_gateway.smpp_gateway.api.gsm_codec import encode_message
+from smpp_gateway.smpp_gateway.api.keepalive import get_keepalive_scheduler, new_keepalive_stats
+from smpp_gateway.smpp_gateway.api.pdu_codec import (
+    DELIVER_SM,
+    DELIVER_SM_RESP,
+    ENQUIRE_LINK,
+    ENQUIRE_LINK_RESP,
+    GENERIC_NACK,
+    MAX_MULTI_DESTINATIONS,
+    MESSAGE_STATES,
+    QUERY_SM_RESP,
+    SUBMIT_MULTI_RESP,
+    SUBMIT_SM_RESP,
+    TAG_MESSAGE_PAYLOAD,
+    UNBIND,
+    UNBIND_RESP,
+    PDUEncoder,
+    PDUReader,
+    SubmitSMSkeleton,
+    decode_deliver_sm,
+    decode_generic_nack,
+    decode_header,
+    decode_query_sm_resp,
+    decode_submit_multi_resp,
+    decode_submit_sm_resp,
+    encode_enquire_link,
+    get_command_id
+)
+from smpp_gateway.smpp_gateway.api.priority_lanes import PriorityLanes, get_lane, get_reserved_slots
+from smpp_gateway.smpp_gateway.api.route_health import get_route_stats, publish_route_health
+from smpp_gateway.smpp_gateway.api.routing import normalize_prefix
+from smpp_gateway.smpp_gateway.api.segmentation import ESM_CLASS_UDHI, fits_one_part, segment_message
+from smpp_gateway.smpp_gateway.api.status_buffer import flush_status_buffer, get_status_buffer
+from smpp_gateway.smpp_gateway.api.throttle import (
+    THROTTLE_REQUEUE_DELAY,
+    THROTTLE_RETRIES,
+    get_throttle,
+    is_throttling_error
+)
+
+class BaseSMPPClient:
+    """
+    Configuration, job building, outcome and receipt handling shared by the session engines
+
+    An engine binds and sends: it implements connect, disconnect, ping, keepalive,
+    outstanding, session_id, process_delivery_receipts, _send_across and _run_window.
+    """
 
-class SMPPClient:
     def __init__(self, config_name=None):
         self.config = self._get_config(config_name)
-        self.client = None
+        self.endpoint = None
+        # Response averages of the configuration, shared with its other sessions and processes
+        self.route_stats = get_route_stats(self.config.name)
         self.connected = False
         self.lock = threading.Lock()
+        # Held while a thread reads or writes the socket; the keepalive scheduler only tries it
+        self.io_lock = threading.RLock()
+        self.last_activity = 0
+        self.keepalive_stats = new_keepalive_stats()
         self.logger = self._setup_logger()
-        
+        self._apply_config()
+        self._completed = []
+
+    def _apply_config(self):
+        """Derive the send settings from self.config"""
+        self.window_size = max(1, cint(self.config.get("submit_window_size") or 1))
+        self.reserved_slots = get_reserved_slots(self.config, self.window_size)
+        self.throttle = get_throttle(self.config)
+        self.use_submit_multi = (bool(self.config.get("use_submit_multi"))
+                                 and self.config.name not in _submit_multi_unsupported)
+        self.coalesce_bytes = max(0, cint(self.config.get("write_coalesce_bytes")))
+        self.use_message_payload = self.config.get("long_message_mode") == "message_payload"
+
+    def reload_config(self, config):
+        """Switch to a newer copy of the configuration; binds are kept as they are"""
+        self.config = config
+        self._apply_config()
+
     def _get_config(self, config_name=None):
         """Get SMPP configuration"""
         if config_name:
@@ -32,7 +110,7 @@ class SMPPClient:
             frappe.throw(f"SMPP Configuration {config.name} is not active")
             
         return config
-    
+
     def _setup_logger(self):
         """Setup logging for SMPP operations"""
         logger = logging.getLogger(f'smpp_client_{self.config.name}')
@@ -47,189 +125,354 @@ class SMPPClient:
             logger.addHandler(handler)
             
         return logger
-    
-    def connect(self):
-        """Establish SMPP connection"""
-        try:
-            with self.lock:
-                if self.connected:
-                    return True
 
-                # Get decrypted password from Frappe's password manager
-                # Password fieldtype stores encrypted values
-                # Use the document's get_password() method
-                decrypted_password = self.config.get_password("password", raise_exception=False)
-
-                if not decrypted_password:
-                    frappe.throw("Failed to retrieve SMPP password. Please check SMPP Configuration.")
-
-                # Create client
-                self.client = smpplib.client.Client(
-                    self.config.smsc_host,
-                    int(self.config.smsc_port),
-                    timeout=int(self.config.connection_timeout)
-                )
-
-                # Connect to SMSC
-                self.client.connect()
-
-                # Determine bind type and perform bind
-                bind_type = self.config.bind_type.lower()
-
-                if bind_type == "transmitter":
-                    self.client.bind_transmitter(
-                        system_id=self.config.system_id,
-                        password=decrypted_password,  # Use decrypted password
-                        system_type=self.config.system_type or "",
-                        interface_version=int(self.config.interface_version.replace('0x', ''), 16),
-                        addr_ton=int(self.config.addr_ton),
-                        addr_npi=int(self.config.addr_npi),
-                        address_range=self.config.address_range or ""
-                    )
-                elif bind_type == "receiver":
-                    self.client.bind_receiver(
-                        system_id=self.config.system_id,
-                        password=decrypted_password,  # Use decrypted password
-                        system_type=self.config.system_type or "",
-                        interface_version=int(self.config.interface_version.replace('0x', ''), 16),
-                        addr_ton=int(self.config.addr_ton),
-                        addr_npi=int(self.config.addr_npi),
-                        address_range=self.config.address_range or ""
-                    )
-                else:  # transceiver
-                    self.client.bind_transceiver(
-                        system_id=self.config.system_id,
-                        password=decrypted_password,  # Use decrypted password
-                        system_type=self.config.system_type or "",
-                        interface_version=int(self.config.interface_version.replace('0x', ''), 16),
-                        addr_ton=int(self.config.addr_ton),
-                        addr_npi=int(self.config.addr_npi),
-                        address_range=self.config.address_range or ""
-                    )
-
-                self.connected = True
-                self._log_connection_event("bind_success", "Successfully connected to SMSC")
-
-                # Start enquire link thread
-                self._start_enquire_link()
-
-                return True
+    def _get_bind_timeout(self, endpoints):
+        """With endpoints to fail over to, give up on one after failover_timeout"""
+        timeout = int(self.config.connection_timeout or 30)
+        if len(endpoints) > 1:
+            timeout = min(timeout, cint(self.config.get("failover_timeout")) or 5)
+        return timeout
+
+    def _get_bind_params(self):
+        """Build bind_* parameters from the configuration"""
+        # Get decrypted password from Frappe's password manager
+        # Password fieldtype stores encrypted values
+        # Use the document's get_password() method
+        decrypted_password = self.config.get_password("password", raise_exception=False)
+
+        if not decrypted_password:
+            frappe.throw("Failed to retrieve SMPP password. Please check SMPP Configuration.")
+
+        return {
+            "system_id": self.config.system_id,
+            "password": decrypted_password,  # Use decrypted password
+            "system_type": self.config.system_type or "",
+            "interface_version": int(self.config.interface_version.replace('0x', ''), 16),
+            "addr_ton": cint(self.config.source_addr_ton),
+            "addr_npi": cint(self.config.source_addr_npi),
+            "address_range": self.config.address_range or ""
+        }
+
+    def _keepalive_interval(self):
+        return int(self.config.enquire_link_timer or 30)
 
-        except Exception as e:
-            error_msg = f"Failed to connect to SMSC: {str(e)}"
-            self.logger.error(error_msg)
-            self._log_connection_event("bind_failed", error_msg, str(e))
-            raise frappe.ValidationError(error_msg)
-    
-    def disconnect(self):
-        """Disconnect from SMSC"""
-        try:
-            with self.lock:
-                if self.client and self.connected:
-                    self.client.unbind()
-                    self.client.disconnect()
-                    self.connected = False
-                    self._log_connection_event("disconnect", "Disconnected from SMSC")
-        except Exception as e:
-            self.logger.error(f"Error during disconnect: {str(e)}")
-    
-    def _start_enquire_link(self):
-        """Start enquire link thread to keep connection alive"""
-        def enquire_link_worker():
-            while self.connected:
-                try:
-                    if self.client:
-                        self.client.enquire_link()
-                        self._log_connection_event("enquire_link", "Enquire link sent")
-                    time.sleep(int(self.config.enquire_link_timer))
-                except Exception as e:
-                    self.logger.error(f"Enquire link failed: {str(e)}")
-                    self._log_connection_event("error", f"Enquire link failed: {str(e)}")
-                    break
-        
-        enquire_thread = threading.Thread(target=enquire_link_worker, daemon=True)
-        enquire_thread.start()
-    
     def send_sms(self, sms_doc):
         """Send SMS message via SMPP"""
+        return self.send_sms_batch([sms_doc])[0]
+
+    def send_sms_batch(self, sms_docs, intake=None):
+        """Send SMS messages keeping up to submit_window_size submit_sm PDUs in flight"""
         try:
             if not self.connected:
                 self.connect()
-            
-            # Prepare message parameters
-            source_addr = sms_doc.sender_id or ""
-            dest_addr = sms_doc.recipient_number
-            message_text = sms_doc.message_text
-            
-            # Handle message encoding
-            data_coding = int(sms_doc.data_coding or 0)
-            if data_coding == 8:  # UCS2
-                message_bytes = message_text.encode('utf-16be')
-            else:  # GSM 7-bit or ASCII
-                message_bytes = message_text.encode('utf-8')
-            
-            # Prepare submit_sm parameters
-            submit_params = {
-                'source_addr_ton': int(self.config.addr_ton),
-                'source_addr_npi': int(self.config.addr_npi),
-                'source_addr': source_addr,
-                'dest_addr_ton': int(self.config.addr_ton),
-                'dest_addr_npi': int(self.config.addr_npi),
-                'destination_addr': dest_addr,
-                'esm_class': self._build_esm_class(sms_doc),
-                'protocol_id': 0,
-                'priority_flag': int(sms_doc.priority or 0),
-                'schedule_delivery_time': self._format_time(sms_doc.scheduled_time),
-                'validity_period': self._format_time(sms_doc.validity_period),
-                'registered_delivery': 1 if sms_doc.registered_delivery else 0,
-                'replace_if_present_flag': 1 if sms_doc.replace_if_present else 0,
-                'data_coding': data_coding,
-                'sm_default_msg_id': 0,
-                'short_message': message_bytes
+        except Exception as e:
+            error_msg = f"Send SMS failed: {str(e)}"
+            self.route_stats.record_error()
+            publish_route_health()
+            for sms_doc in sms_docs:
+                self._handle_send_error(sms_doc, "SYSTEM_ERROR", error_msg)
+            flush_status_buffer()
+            return [{"success": False, "error": error_msg} for _sms_doc in sms_docs]
+
+        results = self._send_across([self], sms_docs, intake)
+        flush_status_buffer()
+        publish_route_health()
+        return [results[sms_doc.name] for sms_doc in sms_docs]
+
+    @classmethod
+    def _query_across(cls, clients, queries):
+        """Pipeline query_sm PDUs over connected clients; results come back in the order of queries"""
+        jobs = [{"query": clients[0]._build_query_params(query), "result": None} for query in queries]
+        cls._run_window(clients, PriorityLanes(jobs))
+
+        return [job["result"] for job in jobs]
+
+    @classmethod
+    def _intake_jobs(cls, clients, sms_docs, intake):
+        """Wrap an intake callable so it returns submit jobs for the messages it takes"""
+        if not intake:
+            return None
+
+        def take():
+            taken = intake()
+            sms_docs.extend(taken)
+            return clients[0]._build_batch_jobs(taken) if taken else []
+
+        return take
+
+    @staticmethod
+    def _hold_io_locks(clients):
+        """Context holding the io_lock of every client; the locks are reentrant, so callers may nest it"""
+        stack = ExitStack()
+        for client in clients:
+            stack.enter_context(client.io_lock)
+
+        return stack
+
+    def _build_batch_jobs(self, sms_docs):
+        """
+        Build the submit jobs of a batch
+
+        With submit_multi enabled, messages sharing body and options are sent as
+        submit_multi to up to MAX_MULTI_DESTINATIONS recipients at a time.
+        """
+        if not self.use_submit_multi:
+            return [job for sms_doc in sms_docs for job in self._build_jobs(sms_doc)]
+
+        broadcasts = {}
+        for sms_doc in sms_docs:
+            key = self._get_skeleton_key(sms_doc) + (sms_doc.message_text,)
+            broadcasts.setdefault(key, []).append(sms_doc)
+
+        jobs = []
+        for same_docs in broadcasts.values():
+            for start in range(0, len(same_docs), MAX_MULTI_DESTINATIONS):
+                chunk = same_docs[start:start + MAX_MULTI_DESTINATIONS]
+                if len(chunk) == 1:
+                    jobs.extend(self._build_jobs(chunk[0]))
+                else:
+                    jobs.extend(self._build_multi_jobs(chunk))
+
+        return jobs
+
+    def _build_jobs(self, sms_doc):
+        """
+        Build one submit job per SMS part
+
+        Jobs of the same message share a group that collects the part results,
+        so the message is completed once, after its last part is answered.
+        """
+        try:
+            parts = self._build_submit_parts(sms_doc)
+        except Exception as e:
+            self._complete(sms_doc, "SYSTEM_ERROR", f"Send SMS failed: {str(e)}")
+            return []
+
+        group = self._new_group(sms_doc, len(parts))
+        lane = get_lane(sms_doc)
+
+        return [{"group": group, "index": index, "lane": lane, "params": params}
+                for index, params in enumerate(parts)]
+
+    def _build_multi_jobs(self, sms_docs):
+        """Build one submit_multi job per part for messages with identical body and options"""
+        try:
+            parts = self._build_submit_parts(sms_docs[0])
+        except Exception as e:
+            for sms_doc in sms_docs:
+                self._complete(sms_doc, "SYSTEM_ERROR", f"Send SMS failed: {str(e)}")
+            return []
+
+        groups = [self._new_group(sms_doc, len(parts)) for sms_doc in sms_docs]
+        destinations = [sms_doc.recipient_number for sms_doc in sms_docs]
+
+        # Messages of one submit_multi share their skeleton, priority included
+        lane = get_lane(sms_docs[0])
+
+        return [{
+            "members": [{"group": group, "index": index, "destination": group["sms_doc"].recipient_number}
+                        for group in groups],
+            "lane": lane,
+            "params": {
+                "skeleton": params["skeleton"],
+                "destinations": destinations,
+                "short_message": params["short_message"],
+                "tlvs": params.get("tlvs")
             }
-            
-            # Add service type if specified
-            if sms_doc.service_type:
-                submit_params['service_type'] = sms_doc.service_type
-            
-            # Send message
-            pdu = self.client.send_message(**submit_params)
+        } for index, params in enumerate(parts)]
 
-            # Update SMS document with SMSC response
-            # Extract the actual message_id from submit_sm_resp PDU (not receipted_message_id)
-            message_id = pdu.message_id if hasattr(pdu, 'message_id') else str(pdu.sequence)
-            
-            frappe.db.set_value("SMPP SMS Message", sms_doc.name, {
-                "message_id": message_id,
-                "status": "Sent",
-                "sent_time": now(),
-                "error_code": None,
-                "error_message": None
-            })
-            
-            frappe.db.commit()
-            
-            self.logger.info(f"SMS sent successfully: {sms_doc.name} -> {dest_addr}")
-            self._log_connection_event("send_message", 
-                                     f"Message sent to {dest_addr}", 
-                                     f"Message ID: {message_id}")
-            
-            return {
+    def _split_multi(self, job):
+        """Turn a submit_multi job back into one submit_sm job per destination"""
+        params = job["params"]
+
+        return [{
+            "group": member["group"],
+            "index": member["index"],
+            "lane": job.get("lane", 0),
+            "params": {
+                "skeleton": params["skeleton"],
+                "destination_addr": member["destination"],
+                "short_message": params["short_message"],
+                "tlvs": params.get("tlvs")
+            }
+        } for member in job["members"]]
+
+    def _disable_submit_multi(self):
+        """Stop using submit_multi for this configuration in this process"""
+        if self.use_submit_multi:
+            self.logger.warning(f"SMSC rejected submit_multi, falling back to submit_sm for {self.config.name}")
+            _submit_multi_unsupported.add(self.config.name)
+            self.use_submit_multi = False
+
+    def _new_group(self, sms_doc, parts):
+        return {
+            "sms_doc": sms_doc,
+            "remaining": parts,
+            "message_ids": [None] * parts,
+            "error_code": None,
+            "error_message": None,
+            "throttled": False
+        }
+
+    def _build_submit_parts(self, sms_doc):
+        """Build submit_sm parameters for every part of an SMS document"""
+        data_coding = int(sms_doc.data_coding or 0)
+        encoded = encode_message(sms_doc.message_text, data_coding)
+
+        if self.use_message_payload and not fits_one_part(encoded, data_coding):
+            # One submit_sm with the whole text; the SMSC does the segmenting
+            return [{
+                "skeleton": self._get_submit_skeleton(sms_doc, data_coding, False),
+                "destination_addr": sms_doc.recipient_number,
+                "short_message": b"",
+                "tlvs": [(TAG_MESSAGE_PAYLOAD, encoded)]
+            }]
+
+        short_messages, has_udh = segment_message(
+            encoded,
+            data_coding,
+            reference_bits=cint(self.config.get("concat_reference_bits") or 8),
+            pack=bool(self.config.get("gsm7_packing"))
+        )
+
+        skeleton = self._get_submit_skeleton(sms_doc, data_coding, has_udh)
+
+        return [{
+            "skeleton": skeleton,
+            "destination_addr": sms_doc.recipient_number,
+            "short_message": short_message
+        } for short_message in short_messages]
+
+    def _get_skeleton_key(self, sms_doc):
+        """The message fields that end up in the submit_sm skeleton"""
+        return (sms_doc.sender_id, sms_doc.service_type, sms_doc.message_type, sms_doc.priority,
+                sms_doc.scheduled_time, sms_doc.validity_period, sms_doc.registered_delivery,
+                sms_doc.replace_if_present)
+
+    def _get_submit_skeleton(self, sms_doc, data_coding, has_udh):
+        """Return the cached submit_sm skeleton for the fields a message shares with others"""
+        key = self._get_skeleton_key(sms_doc) + (data_coding, has_udh)
+
+        skeletons = get_submit_skeletons(self.config)
+        skeleton = skeletons.get(key)
+
+        if skeleton is None:
+            submit_params = self._build_submit_params(sms_doc)
+            submit_params['data_coding'] = data_coding
+            if has_udh:
+                submit_params['esm_class'] |= ESM_CLASS_UDHI
+
+            if len(skeletons) >= MAX_SUBMIT_SKELETONS:
+                skeletons.clear()
+            skeleton = skeletons[key] = SubmitSMSkeleton(submit_params)
+
+        return skeleton
+
+    def _build_submit_params(self, sms_doc):
+        """Build the submit_sm parameters that do not depend on destination or body"""
+        submit_params = {
+            'source_addr_ton': cint(self.config.source_addr_ton),
+            'source_addr_npi': cint(self.config.source_addr_npi),
+            'source_addr': sms_doc.sender_id or "",
+            'dest_addr_ton': cint(self.config.dest_addr_ton),
+            'dest_addr_npi': cint(self.config.dest_addr_npi),
+            'esm_class': self._build_esm_class(sms_doc),
+            'protocol_id': 0,
+            'priority_flag': int(sms_doc.priority or 0),
+            'schedule_delivery_time': self._format_time(sms_doc.scheduled_time),
+            'validity_period': self._format_time(sms_doc.validity_period),
+            'registered_delivery': 1 if sms_doc.registered_delivery else 0,
+            'replace_if_present_flag': 1 if sms_doc.replace_if_present else 0,
+            'data_coding': int(sms_doc.data_coding or 0),
+            'sm_default_msg_id': 0
+        }
+
+        # Add service type if specified
+        if sms_doc.service_type:
+            submit_params['service_type'] = sms_doc.service_type
+
+        return submit_params
+
+    def _complete_part(self, job, error_code=None, error_message=None, message_id=None, throttled=False,
+                       unsuccess=None, response=None):
+        """Record the outcome of one part and complete its message after the last part"""
+        if "query" in job:
+            job["result"] = self._query_result(job["query"], error_message, response)
+            return
+
+        if "members" in job:
+            # submit_multi: one outcome for all destinations except those listed in unsuccess_sme.
+            # The SMSC may echo an address without + or separators, so both sides are compared as digits
+            failed = {normalize_prefix(address): status for address, status in (unsuccess or {}).items()}
+            for member in job["members"]:
+                status = failed.get(normalize_prefix(member["destination"]))
+                if status:
+                    self._complete_part(member, str(status), "SMPP submit_multi error: ({}) {}".format(
+                        status, smpplib.consts.DESCRIPTIONS.get(status, 'Unknown status')))
+                else:
+                    self._complete_part(member, error_code, error_message, message_id, throttled)
+            return
+
+        group = job["group"]
+        group["remaining"] -= 1
+
+        if error_message:
+            # The first failing part decides the error reported for the message
+            if not group["error_message"]:
+                group.update(error_code=error_code, error_message=error_message, throttled=throttled)
+        else:
+            group["message_ids"][job["index"]] = message_id
+
+        if group["remaining"] == 0:
+            self._complete(group["sms_doc"], group["error_code"], group["error_message"],
+                           message_id=group["message_ids"][0], throttled=group["throttled"],
+                           part_message_ids=group["message_ids"])
+
+    def _complete(self, sms_doc, error_code=None, error_message=None, message_id=None, throttled=False,
+                  part_message_ids=None):
+        """Record the outcome of a submit and queue it for the caller"""
+        if throttled:
+            self._handle_throttled(sms_doc, error_code, error_message)
+            result = {"success": False, "throttled": True, "error": error_message}
+        elif error_message:
+            self._handle_send_error(sms_doc, error_code, error_message)
+            result = {"success": False, "error": error_message}
+        else:
+            self._handle_send_success(sms_doc, message_id, part_message_ids)
+            result = {
                 "success": True,
                 "message_id": message_id,
+                "sms_parts": len(part_message_ids or [message_id]),
                 "status": "Sent"
             }
-            
-        except smpplib.exceptions.PDUError as e:
-            error_msg = f"SMPP PDU Error: {str(e)}"
-            self._handle_send_error(sms_doc, str(e.code), error_msg)
-            return {"success": False, "error": error_msg}
-            
-        except Exception as e:
-            error_msg = f"Send SMS failed: {str(e)}"
-            self._handle_send_error(sms_doc, "SYSTEM_ERROR", error_msg)
-            return {"success": False, "error": error_msg}
-    
+
+        self._completed.append((sms_doc, result))
+
+    def _drain_completed(self):
+        """Return and forget submits completed since the last call"""
+        completed, self._completed = self._completed, []
+        return completed
+
+    def _handle_send_success(self, sms_doc, message_id, part_message_ids=None):
+        """Store the SMSC message_id for a successfully submitted SMS"""
+        part_message_ids = part_message_ids or [message_id]
+
+        # Written with other transitions in one transaction; see status_buffer
+        get_status_buffer().add({
+            "name": sms_doc.name,
+            "status": "Sent",
+            "time": now(),
+            "message_id": message_id,
+            "sms_parts": len(part_message_ids),
+            # Delivery receipts arrive per part, under each part's own message_id
+            "part_message_ids": part_message_ids if len(part_message_ids) > 1 else None,
+            "log": self._get_log_fields("send_message",
+                                        f"Message sent to {sms_doc.recipient_number}",
+                                        f"Message ID: {message_id}")
+        })
+
+        self.logger.info(f"SMS sent successfully: {sms_doc.name} -> {sms_doc.recipient_number}")
+
     def _build_esm_class(self, sms_doc):
         """Build ESM class byte based on message type"""
         esm_class = 0
@@ -242,7 +485,7 @@ class SMPPClient:
             esm_class |= (1 << 2)  # Set bit 2 for flash SMS
         
         return esm_class
-    
+
     def _format_time(self, dt):
         """Format datetime for SMPP time fields"""
         if not dt:
@@ -252,104 +495,125 @@ class SMPPClient:
             dt = get_datetime(dt)
         
         return dt.strftime("%y%m%d%H%M%S000+")
-    
+
+    def _handle_throttled(self, sms_doc, error_code, error_message):
+        """Re-queue a throttled SMS without counting it as a failed attempt"""
+        self.logger.warning(f"SMS throttled by SMSC, re-queued: {sms_doc.name}")
+
+        # Written with other transitions in one transaction; the SMPP SMS Queue
+        # item is inserted there too unless one is still open
+        get_status_buffer().add({
+            "name": sms_doc.name,
+            "status": "Queued",
+            "time": now(),
+            "error_code": error_code,
+            "error_message": error_message,
+            "priority": cint(sms_doc.priority),
+            "scheduled_for": add_to_date(now(), seconds=THROTTLE_REQUEUE_DELAY, as_string=True)
+        })
+
     def _handle_send_error(self, sms_doc, error_code, error_message):
         """Handle SMS sending errors"""
         self.logger.error(f"SMS send error for {sms_doc.name}: {error_message}")
         
-        # Update SMS document
-        frappe.db.set_value("SMPP SMS Message", sms_doc.name, {
+        # Update SMS document and log the error; retry_count is incremented when written
+        get_status_buffer().add({
+            "name": sms_doc.name,
             "status": "Failed",
+            "time": now(),
             "error_code": error_code,
             "error_message": error_message,
-            "retry_count": (sms_doc.retry_count or 0) + 1
+            "log": self._get_log_fields("error", error_message, error_code)
         })
-        
-        frappe.db.commit()
-        
-        # Log error
-        self._log_connection_event("error", error_message, error_code)
-    
+
+    def _get_log_fields(self, event_type, details, error_code=None):
+        """Fields of an SMPP Connection Log for an event of this client"""
+        return {
+            "connection_name": self.config.name,
+            "event_type": event_type,
+            "event_details": details,
+            "error_code": error_code,
+            "session_id": self.session_id
+        }
+
     def _log_connection_event(self, event_type, details, error_code=None):
         """Log SMPP connection events"""
         try:
-            log_doc = frappe.get_doc({
-                "doctype": "SMPP Connection Log",
-                "connection_name": self.config.name,
-                "event_type": event_type,
-                "event_time": now(),
-                "event_details": details,
-                "error_code": error_code,
-                "session_id": getattr(self.client, 'sequence', None) if self.client else None
-            })
+            log_doc = frappe.get_doc(dict(self._get_log_fields(event_type, details, error_code),
+                                          doctype="SMPP Connection Log",
+                                          event_time=now()))
             log_doc.insert(ignore_permissions=True)
             frappe.db.commit()
         except Exception as e:
             self.logger.error(f"Failed to log event: {str(e)}")
-    
-    def process_delivery_receipts(self):
-        """Process incoming delivery receipts"""
-        try:
-            if not self.connected:
-                return
-            
-            # Listen for delivery receipts
-            pdus = self.client.read_once()
-            for pdu in pdus:
-                if pdu.command_id == smpplib.consts.SMPP_DELIVER_SM:
-                    self._process_delivery_receipt(pdu)
-                    
-        except Exception as e:
-            self.logger.error(f"Error processing delivery receipts: {str(e)}")
 
     def query_message_status(self, message_id, source_addr=""):
         """Query message status using query_sm PDU"""
+        return self.query_message_statuses([{"message_id": message_id, "source_addr": source_addr}])[0]
+
+    def query_message_statuses(self, queries):
+        """
+        Query the state of many messages, keeping up to submit_window_size query_sm PDUs in flight
+
+        Args:
+            queries: list of dicts with `message_id` and `source_addr`
+
+        Returns:
+            list: one result dict per query, in the same order
+        """
         try:
             if not self.connected:
                 self.connect()
+        except Exception as e:
+            error_msg = f"Query SM failed: {str(e)}"
+            return [{"success": False, "message_id": str(query["message_id"]), "error": error_msg}
+                    for query in queries]
 
-            # For now, simulate a successful query response
-            # This avoids the smpplib compatibility issues
-            # TODO: Implement actual query_sm PDU when smpplib is updated
+        return self._query_across([self], queries)
 
-            self.logger.info(f"Simulating query for message {message_id}")
+    def _build_query_params(self, query):
+        return {
+            "message_id": str(query["message_id"]),
+            "source_addr_ton": cint(self.config.source_addr_ton),
+            "source_addr_npi": cint(self.config.source_addr_npi),
+            "source_addr": query.get("source_addr") or ""
+        }
 
-            # Return a simulated successful response
-            result = {
-                "success": True,
-                "message_id": str(message_id),
-                "message_state": 2,  # DELIVERED
-                "message_state_text": "DELIVERED",
-                "final_date": None,
-                "error_code": 0
+    def _query_result(self, params, error_message=None, response=None):
+        """Turn a query_sm_resp, or the reason there is none, into a result dict"""
+        if error_message:
+            return {
+                "success": False,
+                "message_id": params["message_id"],
+                "error": f"Query SM failed for message {params['message_id']}: {error_message}"
             }
 
-
-            self.logger.info(f"Query SM successful for message {message_id}: {result['message_state_text']}")
-            return result
-
-        except Exception as e:
-            error_msg = f"Query SM failed for message {message_id}: {str(e)}"
-            self.logger.error(error_msg)
-            return {"success": False, "error": error_msg}
-
-
+        return {
+            "success": True,
+            "message_id": response.message_id or params["message_id"],
+            "message_state": response.message_state,
+            "message_state_text": MESSAGE_STATES.get(response.message_state, "UNKNOWN"),
+            "final_date": response.final_date or None,
+            "error_code": response.error_code
+        }
 
     def _process_delivery_receipt(self, pdu):
         """Process individual delivery receipt"""
         try:
-            # Parse delivery receipt from short_message
-            receipt_data = pdu.short_message.decode('utf-8')
+            # Parse delivery receipt from short_message, or message_payload when the SMSC uses it
+            receipt_text = pdu.short_message or pdu.optional_params.get(TAG_MESSAGE_PAYLOAD, b"")
+            receipt_data = receipt_text.decode('utf-8')
             
             # Extract receipt information (format may vary by provider)
             # Standard format: id:XXXXXXXXXX sub:001 dlvrd:001 submit date:... done date:... stat:DELIVRD err:000
             receipt_info = self._parse_delivery_receipt(receipt_data)
             
             if receipt_info and receipt_info.get('id'):
+                # The receipt may overtake the buffered Sent transition holding its message_id
+                flush_status_buffer()
+                
                 # Find original SMS message
-                sms_message = frappe.db.get_value("SMPP SMS Message", 
-                                                {"message_id": receipt_info['id']}, 
-                                                "name")
+                sms_message, sms_parts = self._find_receipted_message(receipt_info['id'], pdu.source_addr)
                 
                 if sms_message:
                     # Create delivery receipt record
@@ -368,11 +632,19 @@ class SMPPClient:
                     
                     # Update original SMS status
                     new_status = self._map_receipt_status(receipt_info.get('stat'))
-                    frappe.db.set_value("SMPP SMS Message", sms_message, {
-                        "smpp_status": receipt_info.get('stat'),
-                        "status": new_status,
-                        "delivered_time": receipt_info.get('done_date') if new_status == "Delivered" else None
-                    })
+                    
+                    # A long message is delivered only once every part is; an SMSC may repeat a receipt
+                    if new_status == "Delivered" and sms_parts > 1 and frappe.db.sql("""
+                            SELECT COUNT(DISTINCT `receipted_message_id`) FROM `tabSMPP Delivery Receipt`
+                            WHERE `original_message` = %s AND `final_status` = %s
+                            """, (sms_message, receipt_info.get('stat')))[0][0] < sms_parts:
+                        frappe.db.set_value("SMPP SMS Message", sms_message, "smpp_status", receipt_info.get('stat'))
+                    else:
+                        frappe.db.set_value("SMPP SMS Message", sms_message, {
+                            "smpp_status": receipt_info.get('stat'),
+                            "status": new_status,
+                            "delivered_time": receipt_info.get('done_date') if new_status == "Delivered" else None
+                        })
                     
                     frappe.db.commit()
                     
@@ -381,7 +653,31 @@ class SMPPClient:
         
         except Exception as e:
             self.logger.error(f"Error processing delivery receipt: {str(e)}")
-    
+
+    def _find_receipted_message(self, message_id, recipient=None):
+        """Find the SMS message a receipt refers to, by its own or one of its parts' message_id"""
+        if isinstance(recipient, bytes):
+            recipient = recipient.decode('ascii', 'ignore')
+        
+        # submit_multi gives every recipient the same message_id
+        candidates = frappe.get_all("SMPP SMS Message",
+                                    filters={"message_id": message_id},
+                                    fields=["name", "sms_parts", "recipient_number"])
+        
+        if not candidates:
+            candidates = frappe.get_all("SMPP SMS Message",
+                                        filters=[["SMPP SMS Message Part", "message_id", "=", message_id]],
+                                        fields=["name", "sms_parts", "recipient_number"])
+        
+        if not candidates:
+            return None, 0
+        
+        if len(candidates) > 1 and recipient:
+            digits = recipient.lstrip("+")
+            candidates = [c for c in candidates if (c.recipient_number or "").lstrip("+") == digits] or candidates
+        
+        return candidates[0].name, cint(candidates[0].sms_parts) or 1
+
     def _parse_delivery_receipt(self, receipt_text):
         """Parse delivery receipt text"""
         try:
@@ -396,7 +692,7 @@ class SMPPClient:
             return receipt_info
         except Exception:
             return None
-    
+
     def _map_receipt_status(self, smpp_status):
         """Map SMPP status to SMS Message status"""
         status_map = {
@@ -410,18 +706,656 @@ class SMPPClient:
         }
         return status_map.get(smpp_status, 'Failed')
 
+
+class SMPPClient(BaseSMPPClient):
+    """SMPP bind over smpplib's blocking socket, read with select()"""
+
+    def __init__(self, config_name=None):
+        super(SMPPClient, self).__init__(config_name)
+        self.client = None
+        self._inflight = {}
+        self._throttled = []
+        self._requeued = []
+        # deliver_sm PDUs answered in the window loop, persisted once the socket is left alone
+        self._received = deque()
+        # Request PDUs written since the last flush, sent to the socket in one call
+        self._outbox = bytearray()
+        self.encoder = PDUEncoder()
+        self.reader = PDUReader()
+
+    def connect(self):
+        """Bind to the healthiest SMSC endpoint, failing over to the next one"""
+        try:
+            with self.lock:
+                if self.connected:
+                    return True
+
+                bind_params = self._get_bind_params()
+                endpoints = rank_endpoints(self.config)
+                errors = []
+
+                for endpoint in endpoints:
+                    try:
+                        started = time.monotonic()
+                        self._bind(endpoint, bind_params, self._get_bind_timeout(endpoints))
+                    except Exception as e:
+                        endpoint.record_failure()
+                        errors.append(f"{endpoint.address}: {str(e)}")
+                        self.logger.warning(f"Bind to {endpoint.address} failed: {str(e)}")
+                        continue
+
+                    endpoint.record_bind(time.monotonic() - started)
+                    self.endpoint = endpoint
+                    self.connected = True
+                    self.last_activity = time.monotonic()
+                    self._log_connection_event("bind_success",
+                                               f"Successfully connected to SMSC at {endpoint.address}")
+
+                    get_keepalive_scheduler().register(self, self._keepalive_interval())
+
+                    return True
+
+                raise ConnectionError("; ".join(errors))
+
+        except Exception as e:
+            error_msg = f"Failed to connect to SMSC: {str(e)}"
+            self.logger.error(error_msg)
+            self._log_connection_event("bind_failed", error_msg, str(e))
+            raise frappe.ValidationError(error_msg)
+
+    def _bind(self, endpoint, bind_params, timeout):
+        """Connect and bind to one endpoint"""
+        self.client = smpplib.client.Client(endpoint.host, endpoint.port, timeout=timeout)
+
+        try:
+            # Connect to SMSC
+            self.client.connect()
+
+            # Determine bind type and perform bind
+            bind_type = self.config.bind_type.lower()
+
+            if bind_type == "transmitter":
+                self.client.bind_transmitter(**bind_params)
+            elif bind_type == "receiver":
+                self.client.bind_receiver(**bind_params)
+            else:  # transceiver
+                self.client.bind_transceiver(**bind_params)
+        except Exception:
+            self.client.disconnect()
+            raise
+
+        # The short failover timeout only applies to connect and bind
+        self.client._socket.settimeout(int(self.config.connection_timeout or 30))
+        configure_socket(self.client._socket, self.config)
+
+        # Route responses read by smpplib back into the submit window
+        self.client.set_message_sent_handler(self._on_submit_sm_resp)
+        self.client.set_message_received_handler(self._on_message_received)
+        self.client.set_error_pdu_handler(self._on_error_pdu)
+
+    def disconnect(self):
+        """Disconnect from SMSC"""
+        try:
+            get_keepalive_scheduler().unregister(self)
+
+            with self.lock, self.io_lock:
+                if self.client and self.connected:
+                    self.client.unbind()
+                    self.client.disconnect()
+                    self.connected = False
+                    self._log_connection_event("disconnect", "Disconnected from SMSC")
+        except Exception as e:
+            self.logger.error(f"Error during disconnect: {str(e)}")
+
+    def ping(self):
+        """Send an enquire_link so a dead socket shows up as a lost connection"""
+        try:
+            with self.io_lock:
+                self.client._socket.sendall(encode_enquire_link(self.client.next_sequence()))
+            return True
+        except Exception as e:
+            self._fail_jobs(self._connection_lost(e), e)
+            return False
+
+    def keepalive(self):
+        """
+        Called by the keepalive scheduler: send enquire_link if the bind has been idle
+        
+        Runs on the scheduler thread, so it never touches the database.
+        
+        Returns:
+            float: monotonic time of the next check, or None to stop
+        """
+        if not self.connected:
+            return None
+        
+        interval = self._keepalive_interval()
+        current = time.monotonic()
+        
+        if current - self.last_activity < interval:
+            self.keepalive_stats["skipped"] += 1
+            return self.last_activity + interval
+        
+        # A batch or receipt poll holds the socket, so the link is in use anyway
+        if not self.io_lock.acquire(blocking=False):
+            self.keepalive_stats["skipped"] += 1
+            return current + interval
+        
+        try:
+            self.client._socket.sendall(encode_enquire_link(self.client.next_sequence()))
+            self.keepalive_stats["sent"] += 1
+            self.last_activity = current
+        except Exception as e:
+            # The next batch or health check replaces the session
+            self.keepalive_stats["failed"] += 1
+            self.connected = False
+            if self.endpoint:
+                self.endpoint.record_failure()
+            self.logger.warning(f"Enquire link failed: {str(e)}")
+            return None
+        finally:
+            self.io_lock.release()
+        
+        return current + interval
+
+    @classmethod
+    def _send_across(cls, clients, sms_docs, intake=None):
+        """
+        Spread submits over connected clients, always filling the least outstanding window
+
+        `intake`, if given, is called every INTAKE_INTERVAL seconds while the batch
+        is in flight and returns further messages to send, e.g. urgent ones handed
+        off meanwhile. They are appended to sms_docs so their results are returned too.
+        """
+        # Drained under the same locks, so a concurrent batch on these clients cannot take the results
+        with cls._hold_io_locks(clients):
+            cls._run_window(clients, PriorityLanes(clients[0]._build_batch_jobs(sms_docs)),
+                            cls._intake_jobs(clients, sms_docs, intake))
+
+            results = {}
+            for client in clients:
+                for sms_doc, result in client._drain_completed():
+                    results[sms_doc.name] = result
+
+        for client in clients:
+            client._process_received()
+
+        return results
+
+    @classmethod
+    def _run_window(cls, clients, pending, intake=None):
+        """Write pending jobs while the windows have room and read responses until all are answered"""
+        with cls._hold_io_locks(clients):
+            cls._pump_window(clients, pending, intake)
+
+    @classmethod
+    def _pump_window(cls, clients, pending, intake=None):
+        live = [client for client in clients if client.connected]
+        throttle = clients[0].throttle
+        throttle_tries = {}
+        # Lost sessions rebinding with backoff: client -> (attempt, monotonic time of the next try)
+        reconnecting = {}
+        intake_at = time.monotonic() + INTAKE_INTERVAL
+
+        while (live or reconnecting) and (pending or any(client.outstanding for client in live)):
+            wait = 0
+
+            if intake and time.monotonic() >= intake_at:
+                pending.extend(intake())
+                intake_at = time.monotonic() + INTAKE_INTERVAL
+
+            # Fill the windows before waiting for any submit_sm_resp
+            while pending and live:
+                client = min(live, key=lambda c: c.outstanding - c.window_size)
+                if client.outstanding >= client.window_size:
+                    break
+
+                # The top reserved_slots of every window are left to urgent jobs
+                urgent_only = client.outstanding >= client.window_size - client.reserved_slots
+                if urgent_only and not pending.has_urgent():
+                    break
+
+                # Stay within the configured TPS across all binds
+                wait = throttle.reserve() if throttle else 0
+                if wait:
+                    break
+
+                job = pending.pop_urgent() if urgent_only else pending.popleft()
+                try:
+                    client._submit(job)
+                except Exception as e:
+                    cls._session_lost(client, e, live, pending, reconnecting)
+
+            # Whatever is still gathered goes out before waiting for responses
+            for client in list(live):
+                try:
+                    client._flush()
+                except Exception as e:
+                    cls._session_lost(client, e, live, pending, reconnecting)
+
+            waiting = [client for client in live if client.outstanding]
+            if waiting:
+                timeout = min(wait, 1) if wait else 1
+                readable = select.select(waiting, [], [], min(timeout, INTAKE_INTERVAL) if intake else timeout)[0]
+                for client in readable:
+                    try:
+                        # Read every response already waiting, so the refill goes out as one write
+                        client._poll_responses()
+                        while client.coalesce_bytes and select.select([client], [], [], 0)[0]:
+                            client._poll_responses()
+                    except smpplib.exceptions.PDUError as e:
+                        client.logger.error(f"Unexpected error PDU: {str(e)}")
+                    except Exception as e:
+                        cls._session_lost(client, e, live, pending, reconnecting)
+            elif wait:
+                time.sleep(wait)
+            elif not live:
+                # Nothing can move until a session is back
+                next_try = min(due for _attempt, due in reconnecting.values())
+                time.sleep(max(0, next_try - time.monotonic()))
+
+            for client in clients:
+                client._expire_inflight()
+
+                # Throttled submits go round again at the reduced rate, then back to the queue
+                for job, error_code, error_message in client._drain_throttled():
+                    throttle_tries[id(job)] = throttle_tries.get(id(job), 0) + 1
+                    if throttle_tries[id(job)] > THROTTLE_RETRIES:
+                        client._complete_part(job, error_code, error_message, throttled=True)
+                    else:
+                        pending.append(job)
+
+                # submit_multi the SMSC refused, split into one submit_sm per destination
+                pending.extend(client._drain_requeued())
+
+            cls._reconnect_due(live, reconnecting)
+
+        if pending:
+            error_msg = "Send SMS failed: no SMPP session available"
+            for job in pending:
+                clients[0]._complete_part(job, "SYSTEM_ERROR", error_msg)
+
+    @classmethod
+    def _session_lost(cls, client, error, live, pending, reconnecting):
+        """Take a dead session out of the window, replay its unacknowledged jobs and schedule a rebind"""
+        live.remove(client)
+
+        replay = []
+        for job in client._connection_lost(error):
+            job["replays"] = job.get("replays", 0) + 1
+            if job["replays"] > MAX_REPLAYS:
+                client._complete_part(job, "SYSTEM_ERROR", f"Send SMS failed: {str(error)}")
+            else:
+                replay.append(job)
+
+        # Replayed jobs keep their message groups, so results land on the original SMPP SMS Messages
+        pending.extendleft(reversed(replay))
+        if replay:
+            client.logger.warning(f"Replaying {len(replay)} unacknowledged PDUs after losing the session")
+
+        reconnecting[client] = (0, time.monotonic() + reconnect_delay(0))
+
+    @classmethod
+    def _reconnect_due(cls, live, reconnecting):
+        """Try to rebind lost sessions whose backoff has passed"""
+        for client, (attempt, due) in list(reconnecting.items()):
+            if time.monotonic() < due:
+                continue
+
+            try:
+                client.connect()
+            except Exception:
+                if attempt + 1 >= RECONNECT_ATTEMPTS:
+                    del reconnecting[client]
+                else:
+                    reconnecting[client] = (attempt + 1, time.monotonic() + reconnect_delay(attempt + 1))
+                continue
+
+            del reconnecting[client]
+            live.append(client)
+
+    @property
+    def outstanding(self):
+        """Number of submit_sm and query_sm PDUs waiting for a response"""
+        return len(self._inflight)
+
+    @property
+    def session_id(self):
+        """Last sequence number of the bind, logged with connection events"""
+        return getattr(self.client, 'sequence', None) if self.client else None
+
+    def fileno(self):
+        """Socket descriptor, so clients can be passed to select()"""
+        return self.client._socket.fileno()
+
+    def _connection_lost(self, error):
+        """
+        Mark the session dead and close its socket
+
+        Returns:
+            list: jobs that were written but not acknowledged, in submit order
+        """
+        self.connected = False
+        get_keepalive_scheduler().unregister(self)
+        if self.endpoint:
+            self.endpoint.record_failure()
+        error_msg = f"SMPP session lost: {str(error)}"
+        self.logger.error(error_msg)
+
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+        del self._outbox[:]
+        inflight, self._inflight = self._inflight, {}
+
+        self._log_connection_event("error", error_msg)
+
+        return [entry["job"] for entry in inflight.values()]
+
+    def _fail_jobs(self, jobs, error):
+        """Fail jobs a lost session left unacknowledged when there is no window to replay them in"""
+        for job in jobs:
+            self._complete_part(job, "SYSTEM_ERROR", f"Send SMS failed: {str(error)}")
+
+    def _submit(self, job):
+        """Write one submit_sm, submit_multi or query_sm PDU and register it in the window by sequence number"""
+        try:
+            sequence = self.client.next_sequence()
+            if "query" in job:
+                pdu = self.encoder.query_sm(sequence, job["query"])
+            elif "members" in job:
+                pdu = self.encoder.submit_multi(sequence, job["params"])
+            else:
+                pdu = self.encoder.submit_sm(sequence, job["params"])
+        except Exception as e:
+            self._complete_part(job, "SYSTEM_ERROR", f"Send SMS failed: {str(e)}")
+            return
+
+        # Registered first: if the write fails, the job is replayed with the rest of the window
+        self._inflight[sequence] = {
+            "job": job,
+            "submitted_at": time.monotonic()
+        }
+
+        # Connection errors propagate so _pump_window can retire the session
+        self._outbox += pdu
+        if len(self._outbox) >= self.coalesce_bytes:
+            self._flush()
+
+    def _flush(self):
+        """Write the gathered PDUs with a single send"""
+        if self._outbox:
+            try:
+                self.client._socket.sendall(self._outbox)
+            finally:
+                del self._outbox[:]
+
+    def _poll_responses(self):
+        """Read one PDU from the SMSC; submit_sm_resp and deliver_sm skip smpplib's PDU classes"""
+        length = self.reader.read(self.client._socket)
+        buffer = self.reader.buffer
+        command_id = get_command_id(buffer)
+        self.last_activity = time.monotonic()
+
+        if command_id in (SUBMIT_SM_RESP, SUBMIT_MULTI_RESP):
+            if command_id == SUBMIT_SM_RESP:
+                pdu = decode_submit_sm_resp(buffer, length)
+            else:
+                pdu = decode_submit_multi_resp(buffer, length)
+
+            if pdu.is_error():
+                self._on_error_pdu(pdu)
+            else:
+                self._on_submit_sm_resp(pdu)
+
+        elif command_id == QUERY_SM_RESP:
+            pdu = decode_query_sm_resp(buffer, length)
+
+            if pdu.is_error():
+                self._on_error_pdu(pdu)
+            else:
+                self._on_query_sm_resp(pdu)
+
+        elif command_id == DELIVER_SM:
+            pdu = decode_deliver_sm(buffer, length)
+            # Answered before any database work; a slow receipt lookup would make the SMSC redeliver
+            self.client._socket.sendall(self.encoder.response(DELIVER_SM_RESP, pdu.sequence))
+            self._received.append(pdu)
+
+        elif command_id == ENQUIRE_LINK:
+            # Answered inline; the SMSC drops binds that leave enquire_link unanswered
+            self.client._socket.sendall(self.encoder.response(ENQUIRE_LINK_RESP, decode_header(buffer)[3]))
+            self.keepalive_stats["answered"] += 1
+
+        elif command_id == ENQUIRE_LINK_RESP:
+            self.keepalive_stats["acknowledged"] += 1
+
+        elif command_id == GENERIC_NACK:
+            self._on_error_pdu(decode_generic_nack(buffer))
+
+        elif command_id == UNBIND:
+            # The SMSC is closing the bind; whatever it has not answered gets replayed after rebinding
+            self.client._socket.sendall(self.encoder.response(UNBIND_RESP, decode_header(buffer)[3]))
+            raise smpplib.exceptions.ConnectionError("SMSC unbound the session")
+
+        else:
+            self._dispatch_pdu(smpplib.smpp.parse_pdu(bytes(buffer[:length]), client=self.client,
+                                                      allow_unknown_opt_params=True))
+
+    def _dispatch_pdu(self, pdu):
+        """Act on a PDU parsed by smpplib the way smpplib's read_once would"""
+        if pdu.is_error():
+            self._on_error_pdu(pdu)
+        elif pdu.command != 'alert_notification':
+            self.logger.warning(f'Unhandled SMPP command "{pdu.command}"')
+
+    def _expire_inflight(self):
+        """Fail in-flight requests whose response did not arrive in time"""
+        timeout = int(self.config.connection_timeout or 30)
+        cutoff = time.monotonic() - timeout
+
+        for sequence, entry in list(self._inflight.items()):
+            if entry["submitted_at"] < cutoff:
+                del self._inflight[sequence]
+                self._record_response(entry, failed=True)
+                response = "query_sm_resp" if "query" in entry["job"] else "submit_sm_resp"
+                self._complete_part(entry["job"], "TIMEOUT",
+                                    f"No {response} within {timeout} seconds")
+
+    def _on_submit_sm_resp(self, pdu, **kwargs):
+        """Match a submit_sm_resp or submit_multi_resp to its job by sequence number"""
+        entry = self._inflight.pop(pdu.sequence, None)
+        if not entry:
+            return
+
+        self._record_response(entry)
+
+        message_id = pdu.message_id
+        if isinstance(message_id, bytes):
+            message_id = message_id.decode('ascii', 'ignore')
+
+        self._complete_part(entry["job"], message_id=message_id or str(pdu.sequence),
+                            unsuccess=getattr(pdu, "unsuccess", None))
+
+    def _on_query_sm_resp(self, pdu):
+        """Match a query_sm_resp to its query by sequence number"""
+        entry = self._inflight.pop(pdu.sequence, None)
+        if entry:
+            self._record_response(entry)
+            self._complete_part(entry["job"], response=pdu)
+
+    def _on_error_pdu(self, pdu):
+        """Fail the matching in-flight submit instead of aborting the whole window"""
+        entry = self._inflight.pop(pdu.sequence, None)
+        if not entry:
+            if pdu.command == "generic_nack":
+                # Usually sequence 0: the SMSC could not even read which request it rejects
+                self.logger.warning("generic_nack for unknown sequence {}: ({}) {}".format(
+                    pdu.sequence, pdu.status, smpplib.consts.DESCRIPTIONS.get(pdu.status, 'Unknown status')))
+                return
+            smpplib.client.Client.error_pdu_handler(self.client, pdu)
+            return
+
+        self._record_response(entry, failed=pdu.status in SMSC_ERRORS)
+
+        error_msg = "SMPP PDU Error: ({}) {}: {}".format(
+            pdu.status,
+            pdu.command,
+            smpplib.consts.DESCRIPTIONS.get(pdu.status, 'Unknown status')
+        )
+
+        if "members" in entry["job"] and pdu.status in SUBMIT_MULTI_UNSUPPORTED:
+            self._disable_submit_multi()
+            self._requeued.extend(self._split_multi(entry["job"]))
+            return
+
+        if is_throttling_error(pdu.status):
+            # The SMSC asked us to slow down; the message itself is fine
+            if self.throttle:
+                self.throttle.penalize()
+            self._throttled.append((entry["job"], str(pdu.status), error_msg))
+            return
+
+        self._complete_part(entry["job"], str(pdu.status), error_msg)
+
+    def _record_response(self, entry, failed=False):
+        """Feed the response time of an in-flight request into the endpoint and route health scores"""
+        latency = time.monotonic() - entry["submitted_at"]
+        self.route_stats.record_response(latency, failed)
+        if self.endpoint:
+            self.endpoint.record_response(latency, failed)
+
+    def _on_message_received(self, pdu, **kwargs):
+        """Handle deliver_sm PDUs read while waiting for submit responses"""
+        self._received.append(pdu)
+
+    def _drain_requeued(self):
+        """Return and forget jobs to submit again in another form"""
+        requeued, self._requeued = self._requeued, []
+        return requeued
+
+    def _drain_throttled(self):
+        """Return and forget submits the SMSC throttled since the last call"""
+        throttled, self._throttled = self._throttled, []
+        return throttled
+
+    def process_delivery_receipts(self):
+        """Process incoming delivery receipts"""
+        try:
+            if not self.connected:
+                return
+            
+            # Read whatever is waiting; deliver_sm PDUs are answered
+            # and late submit_sm_resp close the window
+            with self.io_lock:
+                while select.select([self], [], [], 0)[0]:
+                    self._poll_responses()
+                self._drain_completed()
+                    
+        except smpplib.exceptions.PDUError as e:
+            self.logger.error(f"Error processing delivery receipts: {str(e)}")
+        except Exception as e:
+            # The pool rebinds the session; nothing is waiting to replay late submits
+            with self.io_lock:
+                self._fail_jobs(self._connection_lost(e), e)
+                self._drain_completed()
+        finally:
+            self._process_received()
+
+    def _process_received(self):
+        """Persist the deliver_sm PDUs answered while the socket was read, outside the io_lock"""
+        while self._received:
+            self._process_delivery_receipt(self._received.popleft())
+
+
 # Global connection pool
 _connection_pool = {}
 
+# Prebuilt submit_sm skeletons per configuration, rebuilt when the configuration is saved
+_submit_skeletons = {}
+
+# Distinct sender/option combinations kept per configuration before starting over
+MAX_SUBMIT_SKELETONS = 256
+
+# Configurations whose SMSC rejected submit_multi in this process
+_submit_multi_unsupported = set()
+
+# ESME_RINVCMDID and ESME_RINVNUMDESTS answer a submit_multi the SMSC cannot take
+SUBMIT_MULTI_UNSUPPORTED = {0x00000003, 0x00000033}
+
+# Rebinding a lost session backs off exponentially from RECONNECT_BASE_DELAY up to
+# RECONNECT_MAX_DELAY seconds, giving up on it for the batch after RECONNECT_ATTEMPTS
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+RECONNECT_ATTEMPTS = 5
+
+# Times an unacknowledged PDU is replayed after its session was lost before it fails
+MAX_REPLAYS = 2
+
+# Seconds between two calls of a batch's intake, i.e. the longest an urgent message
+# handed off during a bulk send waits before it joins the window
+INTAKE_INTERVAL = 0.1
+
+def reconnect_delay(attempt):
+    """Backoff before rebind attempt `attempt` (0-based), jittered so binds do not reconnect in lockstep"""
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def configure_socket(sock, config):
+    """Apply the socket options of an SMPP Configuration to a connected socket"""
+    # On unless switched off; configurations saved before the option existed leave it unset
+    nodelay = config.get("tcp_nodelay")
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 0 if nodelay is not None and not cint(nodelay) else 1)
+
+    send_buffer = cint(config.get("socket_send_buffer"))
+    if send_buffer > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+
+    if config.get("tcp_keepalive"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        # Not every platform lets the idle time be set per socket
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, cint(config.get("tcp_keepalive_idle")) or 60)
+
+def get_submit_skeletons(config):
+    """Get the skeleton cache of a configuration, dropping it if the configuration changed"""
+    cached = _submit_skeletons.get(config.name)
+    
+    if cached is None or cached["modified"] != str(config.modified):
+        cached = _submit_skeletons[config.name] = {"modified": str(config.modified), "skeletons": {}}
+    
+    return cached["skeletons"]
+
+def clear_submit_skeletons(config_name):
+    """Forget the submit_sm skeletons of a configuration"""
+    _submit_skeletons.pop(config_name, None)
+
 def get_smpp_client(config_name=None):
-    """Get or create SMPP client instance"""
+    """Get or create the SMPP session pool for a configuration"""
+    from smpp_gateway.smpp_gateway.api.session_pool import SMPPSessionPool
+
     key = config_name or "default"
     
     if key not in _connection_pool:
-        _connection_pool[key] = SMPPClient(config_name)
+        _connection_pool[key] = SMPPSessionPool(config_name)
     
     return _connection_pool[key]
 
+def create_client(config_name=None):
+    """Create a client for the session engine selected on the configuration"""
+    engine = frappe.db.get_value("SMPP Configuration",
+                                 config_name or {"is_default": 1},
+                                 "session_engine")
+    
+    if engine == "asyncio":
+        from smpp_gateway.smpp_gateway.api.async_client import AsyncSMPPClient
+        return AsyncSMPPClient(config_name)
+    
+    return SMPPClient(config_name)
+
 def cleanup_connections():
     """Clean up all SMPP connections"""
     for client in _connection_pool.values():
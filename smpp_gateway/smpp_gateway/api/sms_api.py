@@ -7,7 +7,7 @@ Handles sending SMS via SMPP Gateway for Notifications and other integrations
 from __future__ import unicode_literals
 import frappe
 from frappe import _
-from frappe.utils import now
+from frappe.utils import cint
 import json
 import re
 
@@ -104,7 +104,7 @@ def get_priority_options():
 
 @frappe.whitelist()
 def send_notification_sms(receiver_list, message, reference_doctype=None, reference_name=None,
-                         smpp_config=None, priority="Normal", sender_id=None):
+                         smpp_config=None, priority="Normal", sender_id=None, transliterate=0):
     """
     Send SMS via SMPP Gateway from Notification system
 
@@ -113,9 +113,10 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
         message: SMS message text (can contain Jinja)
         reference_doctype: Source doctype (e.g., "Sales Order")
         reference_name: Source document name
-        smpp_config: SMPP Configuration name (optional, uses default if not provided)
+        smpp_config: SMPP Configuration name (optional; routed by number prefix, then the default, if not provided)
         priority: Message priority (High/Normal/Low)
         sender_id: Sender ID (optional)
+        transliterate: Replace characters outside GSM 03.38 with look-alikes when that avoids UCS2
 
     Returns:
         dict: {
@@ -126,6 +127,9 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
         }
     """
     from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+    from smpp_gateway.smpp_gateway.api.gateway import is_gateway_running, hand_off
+    from smpp_gateway.smpp_gateway.api.routing import get_router
+    from smpp_gateway.smpp_gateway.api.bulk_insert import BULK_INSERT_THRESHOLD, insert_sms_messages
 
     try:
         # Normalize receiver list
@@ -149,34 +153,48 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
         if not message:
             frappe.throw(_("Message text is required"))
 
-        # Get SMPP configuration
-        if not smpp_config:
-            smpp_config = frappe.db.get_value("SMPP Configuration",
-                                             {"is_default": 1, "is_active": 1},
-                                             "name")
+        # Without an explicit configuration, every recipient is routed by number prefix
+        router = None if smpp_config else get_router()
+        default_config = smpp_config or frappe.db.get_value("SMPP Configuration",
+                                                            {"is_default": 1, "is_active": 1},
+                                                            "name")
 
-        if not smpp_config:
+        if not default_config and not router.has_routes():
             frappe.throw(_("No active SMPP Configuration found. Please configure SMPP Gateway."))
 
-        # Get SMPP Configuration document to access default sender ID
-        config_doc = frappe.get_doc("SMPP Configuration", smpp_config)
-
-        # Use sender_id if provided, otherwise use default from config, or fallback to system_id
-        if not sender_id:
-            sender_id = config_doc.get("default_sender_id") or config_doc.system_id
+        # Default sender ID per configuration: its default_sender_id, or fallback to system_id
+        default_sender_ids = {}
 
-        # Get SMPP client
-        client = get_smpp_client(smpp_config)
+        # When the gateway daemon owns the binds, hand messages over instead of binding here
+        use_gateway = is_gateway_running()
 
         # Normalize priority to SMPP numeric format (0-3)
         numeric_priority = normalize_priority(priority)
 
+        # Field values every message of the call shares
+        message_values = {
+            "message_text": message,
+            "priority": str(numeric_priority),  # Convert to string for Select field
+            "registered_delivery": 1,  # Always request delivery receipts
+            "transliterate": cint(transliterate),
+            "reference_doctype": reference_doctype or "Notification",
+            "reference_name": reference_name or "Auto-sent",
+            "status": "Queued" if use_gateway else "Draft"
+        }
+
         # Track results
         success_list = []
         failed_list = []
+        queued_list = []
         sms_message_names = []
 
-        # Send to each recipient
+        # Create a message per recipient, then submit them as one windowed batch
+        sms_docs = []
+
+        # Messages of large lists are written with multi-row INSERTs once every recipient is routed
+        bulk = len(receiver_list) >= BULK_INSERT_THRESHOLD
+        bulk_recipients = []
+
         for phone_number in receiver_list:
             try:
                 # Clean phone number
@@ -187,34 +205,30 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
                     failed_list.append(phone_number)
                     continue
 
-                # Create SMPP SMS Message with numeric priority
-                sms_doc = frappe.get_doc({
-                    "doctype": "SMPP SMS Message",
-                    "recipient_number": phone_number,
-                    "message_text": message,
-                    "smpp_configuration": smpp_config,
-                    "priority": str(numeric_priority),  # Convert to string for Select field
-                    "sender_id": sender_id,  # Now uses default from config if not provided
-                    "registered_delivery": 1,  # Always request delivery receipts
-                    "reference_doctype": reference_doctype or "Notification",
-                    "reference_name": reference_name or "Auto-sent",
-                    "status": "Draft"
-                })
-                sms_doc.insert(ignore_permissions=True)
-                sms_message_names.append(sms_doc.name)
+                # Longest matching prefix route, else the default configuration
+                config_name = (router.route(phone_number) or default_config) if router else smpp_config
+                if not config_name:
+                    frappe.log_error(f"No SMPP Route matches {phone_number}", "SMPP Notification")
+                    failed_list.append(phone_number)
+                    continue
 
-                # Send via SMPP - pass the document object, not individual parameters
-                result = client.send_sms(sms_doc)
+                if bulk:
+                    bulk_recipients.append((phone_number, config_name))
+                    continue
 
-                if result.get('success'):
-                    success_list.append(phone_number)
-                    # Status is already updated by client.send_sms()
-                else:
-                    failed_list.append(phone_number)
-                    # Error is already logged by client.send_sms()
+                if config_name not in default_sender_ids:
+                    config_doc = frappe.get_doc("SMPP Configuration", config_name)
+                    default_sender_ids[config_name] = config_doc.get("default_sender_id") or config_doc.system_id
 
-                # Reload document to get updated status
-                sms_doc.reload()
+                # Create SMPP SMS Message with numeric priority
+                sms_doc = frappe.get_doc(dict(message_values,
+                                              doctype="SMPP SMS Message",
+                                              recipient_number=phone_number,
+                                              smpp_configuration=config_name,
+                                              sender_id=sender_id or default_sender_ids[config_name]))
+                sms_doc.insert(ignore_permissions=True)
+                sms_message_names.append(sms_doc.name)
+                sms_docs.append(sms_doc)
 
             except Exception as e:
                 error_msg = str(e)
@@ -222,11 +236,44 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
                                "SMPP Notification Error")
                 failed_list.append(phone_number)
 
+        if bulk_recipients:
+            # The sender ID falls back per configuration when the message is validated
+            sms_docs, rejected = insert_sms_messages(bulk_recipients, dict(message_values, sender_id=sender_id))
+            sms_message_names = [sms_doc.name for sms_doc in sms_docs]
+            failed_list.extend(rejected)
+
+        if sms_docs and use_gateway:
+            hand_off([sms_doc.name for sms_doc in sms_docs], numeric_priority)
+            queued_list = [sms_doc.recipient_number for sms_doc in sms_docs]
+
+        elif sms_docs:
+            # Send via SMPP, one batch per routed configuration - status and errors
+            # are updated by client.send_sms_batch()
+            batches = {}
+            for sms_doc in sms_docs:
+                batches.setdefault(sms_doc.smpp_configuration, []).append(sms_doc)
+
+            results = []
+            for config_name, batch in batches.items():
+                client = get_smpp_client(config_name)
+                results.extend(zip(batch, client.send_sms_batch(batch)))
+
+            for sms_doc, result in results:
+                if result.get('success'):
+                    success_list.append(sms_doc.recipient_number)
+                elif result.get('throttled'):
+                    # Re-queued by the client while the SMSC is over its rate
+                    queued_list.append(sms_doc.recipient_number)
+                else:
+                    failed_list.append(sms_doc.recipient_number)
+
         # Return results
         result = {
-            "success": len(success_list) > 0,
+            "success": len(success_list) > 0 or len(queued_list) > 0,
             "sent_count": len(success_list),
+            "queued_count": len(queued_list),
             "failed_count": len(failed_list),
+            "segments_saved": sum(cint(sms_doc.segments_saved) for sms_doc in sms_docs),
             "sms_messages": sms_message_names,
             "success_list": success_list,
             "failed_list": failed_list
@@ -239,6 +286,12 @@ def send_notification_sms(receiver_list, message, reference_doctype=None, refere
                 indicator="green"
             )
 
+        if len(queued_list) > 0:
+            frappe.msgprint(
+                _("SMS queued for {0} recipient(s) via SMPP gateway").format(len(queued_list)),
+                indicator="blue"
+            )
+
         if len(failed_list) > 0:
             frappe.msgprint(
                 _("Failed to send SMS to {0} recipient(s)").format(len(failed_list)),
@@ -367,7 +420,8 @@ def send_template_sms(template_name, recipients, template_data=None):
             message=message,
             smpp_config=template.get("default_smpp_configuration"),
             sender_id=template.get("default_sender_id"),
-            priority=template.get("default_priority", "Normal")
+            priority=template.get("default_priority", "Normal"),
+            transliterate=template.get("transliterate")
         )
 
     except Exception as e:
@@ -422,104 +476,59 @@ def query_sms_delivery_status(sms_id):
         dict: Delivery status information from SMSC
     """
     try:
-        sms_doc = frappe.get_doc("SMPP SMS Message", sms_id)
-
-        # Check if message has been sent and has message_id
-        if not sms_doc.message_id:
-            return {
-                "success": False,
-                "message": "Message has not been sent yet or message ID is missing"
-            }
+        result = query_sms_delivery_statuses([sms_id])[sms_id]
 
-        if sms_doc.status not in ["Sent", "Delivered", "Failed", "Expired"]:
-            return {
-                "success": False,
-                "message": f"Cannot query status for message in '{sms_doc.status}' state"
-            }
-
-        # Get SMPP client
-        from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+        if not result.get("success"):
+            return result
 
-        config_name = sms_doc.smpp_configuration
-        if not config_name:
-            # Get default configuration
-            config_name = frappe.db.get_value("SMPP Configuration",
-                                             {"is_default": 1, "is_active": 1},
-                                             "name")
+        sms_doc = frappe.get_doc("SMPP SMS Message", sms_id)
 
-        if not config_name:
-            return {
-                "success": False,
-                "message": "No active SMPP Configuration found"
-            }
+        return {
+            "success": True,
+            "message_id": sms_doc.message_id,
+            "status": result["status"],
+            "smpp_status": result["smpp_status"],
+            "message_state": result.get("message_state"),
+            "final_date": result.get("final_date"),
+            "error_code": result.get("error_code"),
+            "sent_time": sms_doc.sent_time,
+            "delivered_time": sms_doc.delivered_time,
+            "recipient_number": sms_doc.recipient_number,
+            "sender_id": sms_doc.sender_id,
+            "message": f"Status queried successfully: {result['smpp_status']}"
+        }
 
-        client = get_smpp_client(config_name)
+    except Exception as e:
+        frappe.log_error(f"Failed to query SMS delivery status: {str(e)}", "SMPP Query Status Error")
+        return {
+            "success": False,
+            "message": str(e)
+        }
 
-        # Query message status using query_sm PDU
-        result = client.query_message_status(
-            message_id=sms_doc.message_id,
-            source_addr=sms_doc.sender_id or ""
-        )
 
-        if result.get("success"):
-            # Update SMS document with latest status from SMSC
-            message_state = result.get("message_state")
-            message_state_text = result.get("message_state_text")
-
-            # Map SMPP message states to our status values
-            status_mapping = {
-                "ENROUTE": "Sent",
-                "DELIVERED": "Delivered",
-                "EXPIRED": "Expired",
-                "DELETED": "Failed",
-                "UNDELIVERABLE": "Failed",
-                "ACCEPTED": "Delivered",
-                "UNKNOWN": "Failed",
-                "REJECTED": "Rejected"
-            }
+@frappe.whitelist()
+def query_sms_delivery_statuses(sms_ids):
+    """
+    Query the delivery status of many SMS messages with pipelined query_sm PDUs
 
-            new_status = status_mapping.get(message_state_text, sms_doc.status)
+    Args:
+        sms_ids: List (or JSON list) of SMPP SMS Message names
 
-            # Update document if status changed
-            if new_status != sms_doc.status or message_state_text != sms_doc.smpp_status:
-                update_data = {
-                    "status": new_status,
-                    "smpp_status": message_state_text
-                }
+    Returns:
+        dict: Result per SMS message name
+    """
+    from smpp_gateway.smpp_gateway.api.delivery_status import query_delivery_statuses
 
-                # Set delivered time if message was delivered
-                if new_status == "Delivered" and not sms_doc.delivered_time:
-                    update_data["delivered_time"] = now()
+    if isinstance(sms_ids, str):
+        sms_ids = json.loads(sms_ids)
 
-                frappe.db.set_value("SMPP SMS Message", sms_id, update_data)
-                frappe.db.commit()
+    results = query_delivery_statuses(sms_ids)
+    frappe.db.commit()
 
-            return {
-                "success": True,
-                "message_id": sms_doc.message_id,
-                "status": new_status,
-                "smpp_status": message_state_text,
-                "message_state": message_state,
-                "final_date": result.get("final_date"),
-                "error_code": result.get("error_code"),
-                "sent_time": sms_doc.sent_time,
-                "delivered_time": sms_doc.delivered_time,
-                "recipient_number": sms_doc.recipient_number,
-                "sender_id": sms_doc.sender_id,
-                "message": f"Status queried successfully: {message_state_text}"
-            }
-        else:
-            return {
-                "success": False,
-                "message": f"Failed to query status: {result.get('error', 'Unknown error')}"
-            }
+    for sms_id in sms_ids:
+        results.setdefault(sms_id, {"success": False, "message": f"SMS message {sms_id} not found"})
 
-    except Exception as e:
-        frappe.log_error(f"Failed to query SMS delivery status: {str(e)}", "SMPP Query Status Error")
-        return {
-            "success": False,
-            "message": str(e)
-        }
+    return results
 
 
 @frappe.whitelist()
@@ -563,6 +572,7 @@ def get_smpp_connection_status(config_name=None):
                 "smsc_port": config.smsc_port,
                 "system_id": config.system_id,
                 "bind_type": config.bind_type,
+                "endpoints": client.get_endpoint_health(),
                 "message": "Connected" if client.connected else "Not connected"
             }
 
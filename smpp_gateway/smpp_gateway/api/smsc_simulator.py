@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+"""
+SMSC Simulator
+A local SMPP server for tests, benchmarks and soak runs: accepts binds,
+answers submit_sm, submit_multi and query_sm with generated message_ids,
+sends deliver_sm receipts after a delay and can inject throttling,
+generic_nacks, rejected submits, slow responses and dropped connections
+
+    with SMSCSimulator(dlr_delay=0.5, throttle_rate=0.01) as smsc:
+        # point an SMPP Configuration at smsc.host:smsc.port
+
+or `bench smpp-gateway simulate --port 2775` for a standalone server.
+"""
+
+from __future__ import unicode_literals
+import asyncio
+import itertools
+import random
+import struct
+import threading
+import time
+from datetime import datetime
+
+from smpp_gateway.smpp_gateway.api.pdu_codec import (
+    DELIVER_SM,
+    DELIVER_SM_RESP,
+    ENQUIRE_LINK,
+    ENQUIRE_LINK_RESP,
+    GENERIC_NACK,
+    HEADER,
+    HEADER_SIZE,
+    MAX_PDU_LENGTH,
+    QUERY_SM,
+    QUERY_SM_RESP,
+    SUBMIT_MULTI,
+    SUBMIT_MULTI_RESP,
+    SUBMIT_SM,
+    SUBMIT_SM_RESP,
+    UNBIND,
+    UNBIND_RESP
+)
+
+
+BIND_RECEIVER = 0x00000001
+BIND_TRANSMITTER = 0x00000002
+BIND_TRANSCEIVER = 0x00000009
+
+# Response command_id of a request
+RESPONSE = 0x80000000
+
+ESME_RINVCMDID = 0x00000003
+ESME_RINVBNDSTS = 0x00000004
+ESME_RSYSERR = 0x00000008
+ESME_RINVPASWD = 0x0000000E
+ESME_RINVSYSID = 0x0000000F
+ESME_RSUBMITFAIL = 0x00000045
+ESME_RTHROTTLED = 0x00000058
+ESME_RQUERYFAIL = 0x00000067
+
+# receipted_message_id and message_state optional parameters of a receipt
+TAG_RECEIPTED_MESSAGE_ID = 0x001E
+TAG_MESSAGE_STATE = 0x0427
+
+# esm_class of a deliver_sm carrying an SMSC delivery receipt
+ESM_CLASS_DELIVERY_RECEIPT = 0x04
+
+# Receipt stat values and the query_sm message_state they correspond to
+RECEIPT_STATES = {
+    "DELIVRD": 2,
+    "EXPIRED": 3,
+    "DELETED": 4,
+    "UNDELIV": 5,
+    "ACCEPTD": 6,
+    "UNKNOWN": 7,
+    "REJECTD": 8,
+}
+
+# message_state of a message whose receipt was not sent yet
+STATE_ENROUTE = 1
+
+# States kept for query_sm; the oldest are forgotten first, so soak runs stay bounded
+MAX_TRACKED_MESSAGES = 100000
+
+_ADDRESS = struct.Struct(">BB")
+_SUBMIT_FLAGS = struct.Struct(">BBB")
+_SUBMIT_TAIL = struct.Struct(">BBBBB")
+_MULTI_ADDRESS = struct.Struct(">BBB")
+_TLV = struct.Struct(">HH")
+
+
+def _get_cstring(buffer, offset):
+    stop = buffer.index(0, offset)
+    return bytes(buffer[offset:stop]), stop + 1
+
+
+def decode_submit(buffer, multi=False):
+    """
+    Decode the body of a submit_sm or submit_multi
+
+    Returns:
+        dict: Fields of the PDU; destinations is a list of (ton, npi, address)
+    """
+    pdu = {}
+    offset = HEADER_SIZE
+
+    pdu["service_type"], offset = _get_cstring(buffer, offset)
+    pdu["source_addr_ton"], pdu["source_addr_npi"] = _ADDRESS.unpack_from(buffer, offset)
+    pdu["source_addr"], offset = _get_cstring(buffer, offset + _ADDRESS.size)
+
+    destinations = []
+    if multi:
+        count = buffer[offset]
+        offset += 1
+        for _index in range(count):
+            dest_flag, ton, npi = _MULTI_ADDRESS.unpack_from(buffer, offset)
+            if dest_flag == 1:
+                address, offset = _get_cstring(buffer, offset + _MULTI_ADDRESS.size)
+                destinations.append((ton, npi, address))
+            else:
+                # Distribution list name; the simulator has no lists
+                offset = _get_cstring(buffer, offset + 1)[1]
+    else:
+        ton, npi = _ADDRESS.unpack_from(buffer, offset)
+        address, offset = _get_cstring(buffer, offset + _ADDRESS.size)
+        destinations.append((ton, npi, address))
+    pdu["destinations"] = destinations
+
+    pdu["esm_class"], pdu["protocol_id"], pdu["priority_flag"] = _SUBMIT_FLAGS.unpack_from(buffer, offset)
+    offset = _get_cstring(buffer, offset + _SUBMIT_FLAGS.size)[1]
+    offset = _get_cstring(buffer, offset)[1]
+
+    (pdu["registered_delivery"], _replace, pdu["data_coding"],
+     _default_msg_id, sm_length) = _SUBMIT_TAIL.unpack_from(buffer, offset)
+    offset += _SUBMIT_TAIL.size
+
+    pdu["short_message"] = bytes(buffer[offset:offset + sm_length])
+    offset += sm_length
+
+    pdu["optional_params"] = {}
+    while offset + _TLV.size <= len(buffer):
+        tag, length = _TLV.unpack_from(buffer, offset)
+        offset += _TLV.size
+        pdu["optional_params"][tag] = bytes(buffer[offset:offset + length])
+        offset += length
+
+    return pdu
+
+
+def encode_pdu(command_id, sequence, body=b"", status=0):
+    return HEADER.pack(HEADER_SIZE + len(body), command_id, status, sequence) + body
+
+
+def encode_receipt(sequence, message, stat):
+    """deliver_sm carrying the delivery receipt of a submitted message"""
+    now = datetime.now().strftime("%y%m%d%H%M")
+    delivered = 1 if stat == "DELIVRD" else 0
+    text = (f"id:{message['message_id']} sub:001 dlvrd:{delivered:03d} "
+            f"submit date:{message['submit_date']} done date:{now} "
+            f"stat:{stat} err:{0 if delivered else 1:03d} text:").encode("ascii")
+    text += message["short_message"][:20]
+
+    ton, npi, address = message["destination"]
+    receipted_id = message["message_id"].encode("ascii") + b"\0"
+
+    body = b"".join([
+        b"\0",
+        _ADDRESS.pack(ton, npi), address, b"\0",
+        _ADDRESS.pack(message["source_addr_ton"], message["source_addr_npi"]), message["source_addr"], b"\0",
+        _SUBMIT_FLAGS.pack(ESM_CLASS_DELIVERY_RECEIPT, 0, 0),
+        b"\0\0",
+        _SUBMIT_TAIL.pack(0, 0, 0, 0, len(text)), text,
+        _TLV.pack(TAG_RECEIPTED_MESSAGE_ID, len(receipted_id)), receipted_id,
+        _TLV.pack(TAG_MESSAGE_STATE, 1), bytes([RECEIPT_STATES.get(stat, 7)])
+    ])
+
+    return encode_pdu(DELIVER_SM, sequence, body)
+
+
+class SimulatorSession:
+    """One ESME connection to the simulator"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bind_type = None
+        self.system_id = None
+        self.sequence = itertools.count(1)
+        self.window = []
+        self.submits = 0
+
+    @property
+    def receives(self):
+        return self.bind_type in (BIND_RECEIVER, BIND_TRANSCEIVER)
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class SMSCSimulator:
+    """
+    Fake SMSC
+
+    Every injection setting may be changed while the simulator runs.
+
+    Args:
+        host, port: Address to listen on; port 0 picks a free port
+        system_id, password: Credentials to require; None accepts any
+        response_delay: Seconds before every response to a submit
+        response_jitter: Up to this many seconds added at random to response_delay
+        dlr_delay: Seconds between a submit_sm_resp and its deliver_sm receipt; None sends no receipts
+        undeliverable_rate: Fraction of receipts reporting UNDELIV instead of DELIVRD
+        throttle_rate: Fraction of submits answered with ESME_RTHROTTLED
+        max_tps: Submits per second and bind beyond which ESME_RTHROTTLED is returned; 0 for no limit
+        reject_rate: Fraction of submits answered with ESME_RSUBMITFAIL
+        nack_rate: Fraction of submits answered with a generic_nack
+        slow_rate: Fraction of responses held back slow_delay seconds more
+        slow_delay: Extra seconds of a slow response
+        drop_rate: Fraction of submits after which the connection is closed without a response
+        drop_every: Close every connection without a response at its this many-th submit; 0 for never
+        keep_messages: Keep every submitted message in self.messages
+        seed: Seed of the injection dice, for reproducible runs
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, system_id=None, password=None, response_delay=0.0,
+                 response_jitter=0.0, dlr_delay=1.0, undeliverable_rate=0.0, throttle_rate=0.0, max_tps=0,
+                 reject_rate=0.0, nack_rate=0.0, slow_rate=0.0, slow_delay=5.0, drop_rate=0.0,
+                 drop_every=0, keep_messages=False, seed=None):
+        self.host = host
+        self.port = port
+        self.system_id = system_id
+        self.password = password
+        self.response_delay = response_delay
+        self.response_jitter = response_jitter
+        self.dlr_delay = dlr_delay
+        self.undeliverable_rate = undeliverable_rate
+        self.throttle_rate = throttle_rate
+        self.max_tps = max_tps
+        self.reject_rate = reject_rate
+        self.nack_rate = nack_rate
+        self.slow_rate = slow_rate
+        self.slow_delay = slow_delay
+        self.drop_rate = drop_rate
+        self.drop_every = drop_every
+        self.keep_messages = keep_messages
+
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.messages = []
+        self.states = {}
+        self.sessions = set()
+        self.stats = {
+            "binds": 0, "bind_failures": 0, "unbinds": 0, "enquire_links": 0,
+            "submit_sm": 0, "submit_multi": 0, "destinations": 0, "query_sm": 0,
+            "throttled": 0, "rejected": 0, "nacked": 0, "slow": 0, "dropped": 0,
+            "receipts_sent": 0, "receipts_acknowledged": 0
+        }
+
+        self.loop = None
+        self.server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Listen on a background thread with its own event loop; returns the bound port"""
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="smsc-simulator", daemon=True)
+        self._thread.start()
+
+        asyncio.run_coroutine_threadsafe(self.listen(), self.loop).result()
+        return self.port
+
+    def stop(self):
+        """Close every connection and the listening socket, then end the background thread"""
+        if not self.loop:
+            return
+
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+
+    def run_forever(self):
+        """Serve in the calling thread until interrupted"""
+        async def serve():
+            await self.listen()
+            async with self.server:
+                await self.server.serve_forever()
+
+        asyncio.run(serve())
+
+    async def listen(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        for session in list(self.sessions):
+            session.close()
+        await self.server.wait_closed()
+
+    def drop_connections(self):
+        """Close every ESME connection at once, as an SMSC restart would"""
+        def drop():
+            for session in list(self.sessions):
+                session.close()
+                self.stats["dropped"] += 1
+
+        self.loop.call_soon_threadsafe(drop)
+
+    async def _serve(self, reader, writer):
+        session = SimulatorSession(reader, writer)
+        self.sessions.add(session)
+
+        try:
+            while True:
+                header = await reader.readexactly(HEADER_SIZE)
+                length, command_id, _status, sequence = HEADER.unpack(header)
+                if length < HEADER_SIZE or length > MAX_PDU_LENGTH:
+                    break
+
+                pdu = header + await reader.readexactly(length - HEADER_SIZE)
+                if not self._handle(session, command_id, sequence, pdu):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            session.close()
+
+    def _handle(self, session, command_id, sequence, pdu):
+        """Answer one PDU; returns False once the connection should close"""
+        if command_id in (BIND_RECEIVER, BIND_TRANSMITTER, BIND_TRANSCEIVER):
+            return self._bind(session, command_id, sequence, pdu)
+
+        if command_id == ENQUIRE_LINK:
+            self.stats["enquire_links"] += 1
+            session.send(encode_pdu(ENQUIRE_LINK_RESP, sequence))
+        elif command_id == UNBIND:
+            self.stats["unbinds"] += 1
+            session.send(encode_pdu(UNBIND_RESP, sequence))
+            return False
+        elif command_id == DELIVER_SM_RESP:
+            self.stats["receipts_acknowledged"] += 1
+        elif command_id & RESPONSE:
+            pass
+        elif session.bind_type is None:
+            session.send(encode_pdu(GENERIC_NACK, sequence, status=ESME_RINVBNDSTS))
+        elif command_id in (SUBMIT_SM, SUBMIT_MULTI):
+            return self._submit(session, command_id, sequence, pdu)
+        elif command_id == QUERY_SM:
+            self._query(session, sequence, pdu)
+        else:
+            session.send(encode_pdu(GENERIC_NACK, sequence, status=ESME_RINVCMDID))
+
+        return True
+
+    def _bind(self, session, command_id, sequence, pdu):
+        system_id, offset = _get_cstring(pdu, HEADER_SIZE)
+        password = _get_cstring(pdu, offset)[0]
+
+        status = 0
+        if self.system_id is not None and system_id.decode("ascii", "replace") != self.system_id:
+            status = ESME_RINVSYSID
+        elif self.password is not None and password.decode("ascii", "replace") != self.password:
+            status = ESME_RINVPASWD
+
+        session.send(encode_pdu(command_id | RESPONSE, sequence, b"SIMSMSC\0", status))
+        if status:
+            self.stats["bind_failures"] += 1
+            return False
+
+        session.bind_type = command_id
+        session.system_id = system_id
+        self.stats["binds"] += 1
+        return True
+
+    def _submit(self, session, command_id, sequence, pdu):
+        multi = command_id == SUBMIT_MULTI
+        self.stats["submit_multi" if multi else "submit_sm"] += 1
+        session.submits += 1
+
+        dice = self.random.random
+        if (self.drop_every and session.submits == self.drop_every) or (self.drop_rate and dice() < self.drop_rate):
+            self.stats["dropped"] += 1
+            return False
+
+        status = 0
+        if self.nack_rate and dice() < self.nack_rate:
+            self.stats["nacked"] += 1
+            self._respond(session, encode_pdu(GENERIC_NACK, sequence, status=ESME_RSYSERR))
+            return True
+
+        if self._over_rate(session) or (self.throttle_rate and dice() < self.throttle_rate):
+            self.stats["throttled"] += 1
+            status = ESME_RTHROTTLED
+        elif self.reject_rate and dice() < self.reject_rate:
+            self.stats["rejected"] += 1
+            status = ESME_RSUBMITFAIL
+
+        resp_id = SUBMIT_MULTI_RESP if multi else SUBMIT_SM_RESP
+        if status:
+            self._respond(session, encode_pdu(resp_id, sequence, status=status))
+            return True
+
+        fields = decode_submit(pdu, multi)
+        self.stats["destinations"] += len(fields["destinations"])
+        message_id = format(next(self.message_ids), "x")
+        submit_date = datetime.now().strftime("%y%m%d%H%M")
+
+        messages = []
+        for destination in fields["destinations"]:
+            message = dict(fields, message_id=message_id, destination=destination, submit_date=submit_date)
+            del message["destinations"]
+            messages.append(message)
+
+        self.states[message_id] = STATE_ENROUTE
+        if len(self.states) > MAX_TRACKED_MESSAGES:
+            del self.states[next(iter(self.states))]
+
+        if self.keep_messages:
+            self.messages.extend(messages)
+
+        # submit_multi_resp carries no_unsuccess after the message_id
+        body = message_id.encode("ascii") + (b"\0\0" if multi else b"\0")
+        delay = self._respond(session, encode_pdu(resp_id, sequence, body))
+
+        if self.dlr_delay is not None and fields["registered_delivery"] & 0x03:
+            for message in messages:
+                self.loop.call_later(delay + self.dlr_delay, self._send_receipt, session, message)
+
+        return True
+
+    def _over_rate(self, session):
+        """Count the submit in the bind's one-second window and check it against max_tps"""
+        if not self.max_tps:
+            return False
+
+        now = time.monotonic()
+        session.window = [sent for sent in session.window if now - sent < 1]
+        if len(session.window) >= self.max_tps:
+            return True
+
+        session.window.append(now)
+        return False
+
+    def _respond(self, session, data):
+        """Send a response after the configured delay; returns the delay used"""
+        delay = self.response_delay
+        if self.response_jitter:
+            delay += self.random.uniform(0, self.response_jitter)
+        if self.slow_rate and self.random.random() < self.slow_rate:
+            self.stats["slow"] += 1
+            delay += self.slow_delay
+
+        if delay:
+            self.loop.call_later(delay, session.send, data)
+        else:
+            session.send(data)
+
+        return delay
+
+    def _send_receipt(self, session, message):
+        stat = "DELIVRD"
+        if self.undeliverable_rate and self.random.random() < self.undeliverable_rate:
+            stat = "UNDELIV"
+
+        if message["message_id"] in self.states:
+            self.states[message["message_id"]] = RECEIPT_STATES[stat]
+
+        # A transmitter bind gets its receipts on a receiver bind of the same account
+        if not session.receives or session.writer.is_closing():
+            session = next((other for other in self.sessions
+                            if other.receives and other.system_id == session.system_id), None)
+            if session is None:
+                return
+
+        session.send(encode_receipt(next(session.sequence), message, stat))
+        self.stats["receipts_sent"] += 1
+
+    def _query(self, session, sequence, pdu):
+        self.stats["query_sm"] += 1
+        message_id = _get_cstring(pdu, HEADER_SIZE)[0]
+
+        state = self.states.get(message_id.decode("ascii", "replace"))
+        if state is None:
+            session.send(encode_pdu(QUERY_SM_RESP, sequence, status=ESME_RQUERYFAIL))
+            return
+
+        final_date = datetime.now().strftime("%y%m%d%H%M%S000+").encode("ascii") if state != STATE_ENROUTE else b""
+        body = message_id + b"\0" + final_date + b"\0" + bytes([state, 0])
+        session.send(encode_pdu(QUERY_SM_RESP, sequence, body))
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Status Buffer
+Collects the Sent, Failed and throttled (Queued) transitions of submitted
+messages and writes them as batched UPDATEs in one transaction every FLUSH_ROWS transitions,
+FLUSH_INTERVAL seconds or at the end of a batch, instead of committing once
+or twice per message. Transitions are journaled to Redis in pipelined
+batches of JOURNAL_ROWS and always before they are written; journals of
+processes whose heartbeat stopped are replayed by the connection check.
+A process that dies loses at most the transitions of one unjournaled
+batch, whose messages keep their previous status.
+
+The journal is kept in the Redis of the background job queue rather than
+redis_cache, which evicts keys under memory pressure and is not persisted.
+It is as durable as that Redis is configured to be.
+"""
+
+from __future__ import unicode_literals
+import json
+import os
+import socket
+import threading
+import time
+import frappe
+from frappe.utils import now
+from frappe.utils.background_jobs import get_redis_conn
+
+from smpp_gateway.smpp_gateway.api.bulk_insert import insert_rows
+
+
+# Journal list per site and process; the queue Redis is shared by every site of the bench
+STATUS_JOURNAL_KEY = "smpp_gateway:status_journal"
+
+# Hash per site of process -> time of its last flush
+STATUS_JOURNALS_KEY = "smpp_gateway:status_journals"
+
+# Hash per site of process -> time it last showed it is alive, to find journals left behind by dead processes
+STATUS_HEARTBEATS_KEY = "smpp_gateway:status_heartbeats"
+
+# Transitions buffered before they are written
+FLUSH_ROWS = 100
+
+# Transitions journaled with one pipelined RPUSH instead of a round trip each
+JOURNAL_ROWS = 20
+
+# Seconds the oldest buffered transition may wait for a write
+FLUSH_INTERVAL = 0.2
+
+# Seconds before the first retry of a failed flush, doubled per failure up to FLUSH_RETRY_MAX
+FLUSH_RETRY_DELAY = 1
+FLUSH_RETRY_MAX = 60
+
+# Savepoint the UPDATEs of a flush are rolled back to when one of them fails
+FLUSH_SAVEPOINT = "smpp_status_flush"
+
+# Seconds between heartbeats of a process with buffered transitions
+HEARTBEAT_INTERVAL = 10
+
+# Journals of processes without a heartbeat for this long are replayed by another process;
+# well above FLUSH_RETRY_MAX, so a process backing off a database outage keeps its journal
+STALE_AFTER = 300
+
+# Rows per UPDATE ... WHERE name IN (...)
+UPDATE_CHUNK_SIZE = 500
+
+# Connection logs kept per configuration, as SMPPConnectionLog.before_insert keeps them
+MAX_CONNECTION_LOGS = 1000
+
+# A replayed transition never overwrites a final state set by a delivery receipt
+FINAL_STATUSES = ("Delivered", "Expired", "Rejected")
+
+# SMPP SMS Queue items a throttled message is already waiting in
+OPEN_QUEUE_STATUSES = ("Pending", "Processing", "Retrying")
+
+_PROCESS = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class StatusBuffer:
+    """Status transitions of this process for one site, mirrored in its Redis journal until written"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = []
+        # Leading entries already in the Redis journal
+        self.journaled = 0
+        self.first_added = 0
+        self.retry_delay = 0
+        self.retry_at = 0
+        self.beaten = 0
+
+    def add(self, entry):
+        """
+        Buffer a transition, journaling every JOURNAL_ROWS and writing the buffer when it is full or old enough
+
+        Args:
+            entry: Dict with name, status ("Sent", "Failed" or "Queued"), time and the fields of
+                that status; `log` holds the SMPP Connection Log fields of the transition
+        """
+        with self.lock:
+            if not self.entries:
+                self.first_added = time.monotonic()
+
+            self.entries.append(entry)
+            if len(self.entries) - self.journaled >= JOURNAL_ROWS:
+                self._journal()
+            else:
+                self.beat()
+            current = time.monotonic()
+            due = current >= self.retry_at and (len(self.entries) >= FLUSH_ROWS
+                                                or current - self.first_added >= FLUSH_INTERVAL)
+
+        if due:
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        Write every buffered transition in one transaction and drop it from the journal
+
+        On a database error the transitions stay buffered and journaled, and
+        flushes are held back for a growing delay instead of being retried
+        with every added transition.
+
+        Args:
+            force: Flush even while a failed flush is being backed off, e.g. at shutdown
+
+        Returns:
+            int: Number of transitions written
+        """
+        with self.lock:
+            if not self.entries:
+                return 0
+
+            # Journaled first, so a failed write leaves every transition recoverable
+            self._journal()
+
+            if not force and time.monotonic() < self.retry_at:
+                # Still backing off; the journal stays ours meanwhile
+                self.beat()
+                return 0
+
+            entries = list(self.entries)
+            try:
+                frappe.db.savepoint(FLUSH_SAVEPOINT)
+                write_status_entries(entries)
+                frappe.db.commit()
+            except Exception as e:
+                # Undo the UPDATEs that did run; the next commit of any caller would
+                # otherwise apply them and the retry would count the failures twice
+                try:
+                    frappe.db.rollback(save_point=FLUSH_SAVEPOINT)
+                except Exception:
+                    # The connection went away and took the transaction with it
+                    pass
+
+                self.retry_delay = min(self.retry_delay * 2 or FLUSH_RETRY_DELAY, FLUSH_RETRY_MAX)
+                self.retry_at = time.monotonic() + self.retry_delay
+                self.beat(force=True)
+                frappe.log_error(f"SMPP status flush failed, {len(entries)} transitions kept, "
+                                 f"retrying in {self.retry_delay}s: {str(e)}",
+                                 "SMPP Status Buffer")
+                return 0
+
+            del self.entries[:len(entries)]
+            self.journaled -= len(entries)
+            self.first_added = time.monotonic()
+            self.retry_delay = self.retry_at = 0
+
+            journal = get_redis_conn()
+            journal.ltrim(get_journal_key(_PROCESS), len(entries), -1)
+            journal.hset(get_journals_key(), _PROCESS, time.time())
+
+            return len(entries)
+
+    def _journal(self):
+        """Append the unjournaled transitions and a heartbeat to Redis in one round trip"""
+        pending = self.entries[self.journaled:]
+        if not pending:
+            return
+
+        pipeline = get_redis_conn().pipeline()
+        pipeline.rpush(get_journal_key(_PROCESS), *[json.dumps(entry) for entry in pending])
+        pipeline.hset(get_heartbeats_key(), _PROCESS, time.time())
+        pipeline.execute()
+
+        self.journaled = len(self.entries)
+        self.beaten = time.monotonic()
+
+    def beat(self, force=False):
+        """
+        Show other processes that this one still owns its journal
+
+        Called without the lock, so a flush stuck on the database does not hold
+        back the heartbeat thread of the gateway daemon.
+
+        Args:
+            force: Refresh even if the last heartbeat is younger than HEARTBEAT_INTERVAL
+        """
+        if not self.entries or (not force and time.monotonic() - self.beaten < HEARTBEAT_INTERVAL):
+            return
+
+        self.beaten = time.monotonic()
+        get_redis_conn().hset(get_heartbeats_key(), _PROCESS, time.time())
+
+
+def write_status_entries(entries, replay=False):
+    """
+    Apply transitions with one UPDATE per chunk of Sent messages and per distinct error,
+    and re-queue throttled messages with one multi-row INSERT
+
+    Args:
+        entries: Transitions as passed to StatusBuffer.add, oldest first
+        replay: Leave messages alone that a delivery receipt already moved to a final state
+    """
+    # A message completed twice before a flush keeps its latest transition
+    latest = {}
+    for entry in entries:
+        latest.pop(entry["name"], None)
+        latest[entry["name"]] = entry
+
+    timestamp = now()
+    user = frappe.session.user
+    guard = " AND `status` NOT IN ({})".format(", ".join(["%s"] * len(FINAL_STATUSES))) if replay else ""
+    guard_values = list(FINAL_STATUSES) if replay else []
+
+    sent = [entry for entry in latest.values() if entry["status"] == "Sent"]
+    for chunk in _chunks(sent):
+        case = "CASE `name`{} END".format(" WHEN %s THEN %s" * len(chunk))
+        values = []
+        for field in ("message_id", "sms_parts", "time"):
+            for entry in chunk:
+                values.extend([entry["name"], entry.get(field)])
+
+        frappe.db.sql(f"""
+            UPDATE `tabSMPP SMS Message`
+            SET `status` = 'Sent', `message_id` = {case}, `sms_parts` = {case}, `sent_time` = {case},
+                `error_code` = NULL, `error_message` = NULL, `modified` = %s, `modified_by` = %s
+            WHERE `name` IN ({", ".join(["%s"] * len(chunk))}){guard}
+        """, values + [timestamp, user] + [entry["name"] for entry in chunk] + guard_values)
+
+    _write_parts(sent, timestamp, user)
+
+    for status, retry in (("Failed", ", `retry_count` = COALESCE(`retry_count`, 0) + 1"), ("Queued", "")):
+        errors = {}
+        for entry in latest.values():
+            if entry["status"] == status:
+                errors.setdefault((entry.get("error_code"), entry.get("error_message")), []).append(entry["name"])
+
+        for (error_code, error_message), names in errors.items():
+            for chunk in _chunks(names):
+                frappe.db.sql(f"""
+                    UPDATE `tabSMPP SMS Message`
+                    SET `status` = %s, `error_code` = %s, `error_message` = %s{retry},
+                        `modified` = %s, `modified_by` = %s
+                    WHERE `name` IN ({", ".join(["%s"] * len(chunk))}){guard}
+                """, [status, error_code, error_message, timestamp, user] + chunk + guard_values)
+
+    _requeue([entry for entry in latest.values() if entry["status"] == "Queued"])
+
+    if not replay:
+        _write_logs([entry for entry in entries if entry.get("log")])
+
+
+def _write_parts(entries, timestamp, user):
+    """
+    Replace the SMPP SMS Message Parts of sent messages
+
+    Receipts for the second and later parts of a long message are matched by
+    the indexed message_id of its part rows. Parts left by an earlier submit
+    of a message, or by a replayed flush, are removed first.
+    """
+    for chunk in _chunks([entry["name"] for entry in entries]):
+        frappe.db.sql(f"""
+            DELETE FROM `tabSMPP SMS Message Part`
+            WHERE `parenttype` = 'SMPP SMS Message' AND `parent` IN ({", ".join(["%s"] * len(chunk))})
+        """, chunk)
+
+    fields = ["name", "parent", "parenttype", "parentfield", "idx", "message_id",
+              "creation", "modified", "owner", "modified_by", "docstatus"]
+    rows = [
+        [frappe.generate_hash(length=10), entry["name"], "SMPP SMS Message", "message_parts", idx, message_id,
+         timestamp, timestamp, user, user, 0]
+        for entry in entries
+        for idx, message_id in enumerate(entry.get("part_message_ids") or [], 1)
+    ]
+
+    if rows:
+        frappe.db.bulk_insert("SMPP SMS Message Part", fields, rows, chunk_size=UPDATE_CHUNK_SIZE)
+
+
+def _requeue(entries):
+    """
+    Insert SMPP SMS Queue items for throttled messages that are not waiting in one already
+
+    Queue items being processed right now are rescheduled by the queue processor.
+    """
+    open_items = set()
+    for chunk in _chunks([entry["name"] for entry in entries]):
+        open_items.update(frappe.get_all("SMPP SMS Queue",
+                                         filters={"sms_message": ["in", chunk],
+                                                  "status": ["in", list(OPEN_QUEUE_STATUSES)]},
+                                         pluck="sms_message"))
+
+    entries = [entry for entry in entries if entry["name"] not in open_items]
+    if not entries:
+        return
+
+    # new_doc applies the field defaults insert() would otherwise set
+    base = frappe.new_doc("SMPP SMS Queue").get_valid_dict(convert_dates_to_str=True)
+    insert_rows("SMPP SMS Queue", [
+        dict(base, sms_message=entry["name"], status="Pending", priority=entry.get("priority") or 0,
+             scheduled_for=entry["scheduled_for"])
+        for entry in entries
+    ])
+
+
+def _write_logs(entries):
+    """Insert the SMPP Connection Logs of the transitions and trim each configuration's logs"""
+    rows = [{
+        "connection_name": entry["log"]["connection_name"],
+        "event_type": entry["log"]["event_type"],
+        "event_time": entry["time"],
+        "event_details": entry["log"].get("event_details"),
+        "error_code": entry["log"].get("error_code"),
+        "session_id": entry["log"].get("session_id")
+    } for entry in entries]
+
+    insert_rows("SMPP Connection Log", rows)
+
+    for connection_name in {row["connection_name"] for row in rows}:
+        excess = frappe.db.count("SMPP Connection Log", {"connection_name": connection_name}) - MAX_CONNECTION_LOGS
+        if excess > 0:
+            oldest = frappe.get_all("SMPP Connection Log",
+                                    filters={"connection_name": connection_name},
+                                    order_by="event_time asc",
+                                    limit=excess,
+                                    pluck="name")
+            frappe.db.delete("SMPP Connection Log", {"name": ["in", oldest]})
+
+
+def get_journal_key(process):
+    """Journal list of a process for the current site"""
+    return f"{STATUS_JOURNAL_KEY}:{frappe.local.site}:{process}"
+
+
+def get_journals_key():
+    return f"{STATUS_JOURNALS_KEY}:{frappe.local.site}"
+
+
+def get_heartbeats_key():
+    return f"{STATUS_HEARTBEATS_KEY}:{frappe.local.site}"
+
+
+# site -> StatusBuffer of this process
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+
+def get_status_buffer():
+    """The status buffer of the current site"""
+    site = frappe.local.site
+    with _buffers_lock:
+        if site not in _buffers:
+            _buffers[site] = StatusBuffer()
+
+        return _buffers[site]
+
+
+def flush_status_buffer(force=False):
+    """Write the buffered transitions of the current site, e.g. before reading message statuses back"""
+    buffer = _buffers.get(frappe.local.site)
+    return buffer.flush(force=force) if buffer else 0
+
+
+def beat_status_buffer():
+    """Refresh the heartbeat of the current site's buffered transitions, from a thread that never blocks on the database"""
+    buffer = _buffers.get(frappe.local.site)
+    if buffer:
+        buffer.beat()
+
+
+def recover_status_journals():
+    """
+    Replay the journals of processes whose heartbeat stopped, e.g. after a crash
+
+    A journal is renamed before it is read, so transitions a slow but live
+    process journals meanwhile go to a new journal instead of being deleted
+    with the replayed one.
+
+    Returns:
+        int: Number of transitions replayed
+    """
+    journal = get_redis_conn()
+    replayed = 0
+
+    for process, heartbeat in (journal.hgetall(get_heartbeats_key()) or {}).items():
+        process = frappe.safe_decode(process)
+        if process == _PROCESS or time.time() - float(heartbeat) < STALE_AFTER:
+            continue
+
+        key = get_journal_key(process)
+        taken = f"{key}:replaying"
+        try:
+            # Appends to the journal after this go to a new one; a replay interrupted
+            # before it deleted `taken` is picked up again by the next run
+            journal.rename(key, taken)
+        except Exception:
+            # No journal left to take
+            pass
+
+        entries = [json.loads(raw) for raw in journal.lrange(taken, 0, -1) or []]
+        if entries:
+            write_status_entries(entries, replay=True)
+            frappe.db.commit()
+            replayed += len(entries)
+
+        journal.delete(taken)
+
+        journal.hdel(get_heartbeats_key(), process)
+        journal.hdel(get_journals_key(), process)
+
+    if replayed:
+        frappe.logger().info(f"SMPP status journals: replayed {replayed} transitions")
+
+    return replayed
+
+
+def _chunks(items):
+    for offset in range(0, len(items), UPDATE_CHUNK_SIZE):
+        yield items[offset:offset + UPDATE_CHUNK_SIZE]
@@ -0,0 +1,141 @@
+# Copyright (c) 2026, aakvatech and Contributors
+# See license.txt
+
+import unittest
+
+from smpp_gateway.smpp_gateway.api.gsm_codec import (
+	DATA_CODING_GSM7,
+	DATA_CODING_UCS2,
+	GSM7_BASIC,
+	GSM7_EXTENSION,
+	decode_gsm7,
+	encode_gsm7,
+	encode_message,
+	get_message_stats,
+	gsm7_length,
+	is_gsm7,
+	transliterate,
+	ucs2_length
+)
+
+
+class TestGSMCodec(unittest.TestCase):
+	def test_encode_gsm7(self):
+		# (text, septets)
+		cases = [
+			("", b""),
+			("@£$¥", b"\x00\x01\x02\x03"),
+			("Hello", b"Hello"),
+			("\n\r", b"\x0a\x0d"),
+			("ΔΦΓΛΩΠΨΣΘΞ", bytes.fromhex("1012131415161718191a")),
+			("ÄÖÑÜ§¿äöñüà", bytes.fromhex("5b5c5d5e5f607b7c7d7e7f")),
+			("¤", b"\x24"),
+			("€", b"\x1b\x65"),
+			("{}", b"\x1b\x28\x1b\x29"),
+			("[~]", b"\x1b\x3c\x1b\x3d\x1b\x3e"),
+			("\\^|", b"\x1b\x2f\x1b\x14\x1b\x40"),
+			("\f", b"\x1b\x0a")
+		]
+		for text, septets in cases:
+			with self.subTest(text=text):
+				self.assertEqual(encode_gsm7(text), septets)
+				self.assertEqual(decode_gsm7(septets), text)
+
+	def test_every_character_round_trips(self):
+		text = "".join(char for septet, char in enumerate(GSM7_BASIC) if septet != 0x1B)
+		text += "".join(GSM7_EXTENSION.values())
+
+		self.assertEqual(decode_gsm7(encode_gsm7(text)), text)
+
+	def test_lengths(self):
+		# (text, GSM 7-bit length or None, UCS2 length)
+		cases = [
+			("Hello", 5, 5),
+			("€uro", 5, 4),
+			("{[]}", 8, 4),
+			("Привет", None, 6),
+			("✓", None, 1),
+			("\U0001f600", None, 2),
+			("`", None, 1)
+		]
+		for text, septets, code_units in cases:
+			with self.subTest(text=text):
+				self.assertEqual(gsm7_length(text), septets)
+				self.assertEqual(is_gsm7(text), septets is not None)
+				self.assertEqual(ucs2_length(text), code_units)
+
+	def test_unrepresentable_characters(self):
+		self.assertEqual(encode_gsm7("a✓b"), b"a?b")
+		self.assertEqual(encode_gsm7("a✓b", replacement="€"), b"a\x1b\x65b")
+
+		with self.assertRaises(ValueError):
+			encode_gsm7("a✓b", replacement=None)
+
+	def test_decode_unknown_escape(self):
+		# An escape before a septet without an extension character decodes as the basic character
+		self.assertEqual(decode_gsm7(b"\x1b\x41"), "A")
+
+	def test_transliterate(self):
+		# (text, transliterated)
+		cases = [
+			("\u201cHi\u201d \u2013 it\u2019s\u2026", "\"Hi\" - it's..."),
+			("Łódź", "Lodz"),
+			("café", "café"),
+			("naïve résumé", "naive résumé"),
+			("© 2026 ™", "(c) 2026 TM"),
+			("zero\u200bwidth", "zerowidth"),
+			("При", "При")
+		]
+		for text, transliterated in cases:
+			with self.subTest(text=text):
+				self.assertEqual(transliterate(text), transliterated)
+
+	def test_encode_message(self):
+		# (text, data_coding, encoded)
+		cases = [
+			("Hi€", 0, b"Hi\x1b\x65"),
+			("Hi✓", 8, "Hi✓".encode("utf-16-be")),
+			("\U0001f600", 8, bytes.fromhex("d83dde00")),
+			("Hi✓", 1, b"Hi?"),
+			("héllo", 3, b"h\xe9llo"),
+			("héllo", 4, "héllo".encode("utf-8"))
+		]
+		for text, data_coding, encoded in cases:
+			with self.subTest(text=text, data_coding=data_coding):
+				self.assertEqual(encode_message(text, data_coding), encoded)
+
+	def test_message_stats(self):
+		# (text, reference_bits, data_coding, length, sms_parts)
+		cases = [
+			("Hello", 8, DATA_CODING_GSM7, 5, 1),
+			("a" * 160, 8, DATA_CODING_GSM7, 160, 1),
+			("a" * 159 + "€", 8, DATA_CODING_GSM7, 161, 2),
+			("a" * 306, 8, DATA_CODING_GSM7, 306, 2),
+			("a" * 306, 16, DATA_CODING_GSM7, 306, 3),
+			("✓" * 70, 8, DATA_CODING_UCS2, 70, 1),
+			("✓" * 71, 8, DATA_CODING_UCS2, 71, 2),
+			("\U0001f600" * 35, 8, DATA_CODING_UCS2, 70, 1),
+			# An escape or surrogate pair on a part boundary moves to the next part
+			("a" * 152 + "€" + "a" * 152, 8, DATA_CODING_GSM7, 306, 3),
+			("✓" * 66 + "\U0001f600" + "✓" * 66, 8, DATA_CODING_UCS2, 134, 3)
+		]
+		for text, reference_bits, data_coding, length, sms_parts in cases:
+			with self.subTest(text=text[:10], length=len(text), reference_bits=reference_bits):
+				stats = get_message_stats(text, reference_bits)
+				self.assertEqual((stats["data_coding"], stats["length"], stats["sms_parts"]),
+								 (data_coding, length, sms_parts))
+
+	def test_transliteration_saves_segments(self):
+		text = "It’s " + "a" * 95
+
+		self.assertEqual(get_message_stats(text)["data_coding"], DATA_CODING_UCS2)
+
+		stats = get_message_stats(text, transliterate_text=True)
+		self.assertEqual((stats["text"], stats["data_coding"], stats["sms_parts"], stats["segments_saved"]),
+						 ("It's " + "a" * 95, DATA_CODING_GSM7, 1, 1))
+
+	def test_transliteration_kept_out_when_ucs2_remains(self):
+		text = "It’s ✓"
+		stats = get_message_stats(text, transliterate_text=True)
+
+		self.assertEqual((stats["text"], stats["data_coding"], stats["segments_saved"]), (text, DATA_CODING_UCS2, 0))
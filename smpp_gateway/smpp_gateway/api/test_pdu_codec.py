@@ -0,0 +1,233 @@
+# Copyright (c) 2026, aakvatech and Contributors
+# See license.txt
+
+import unittest
+
+from smpp_gateway.smpp_gateway.api.pdu_codec import (
+	DELIVER_SM_RESP,
+	ENQUIRE_LINK_RESP,
+	MAX_MULTI_DESTINATIONS,
+	MAX_SHORT_MESSAGE,
+	SUBMIT_MULTI,
+	TAG_MESSAGE_PAYLOAD,
+	PDUEncoder,
+	PDUReader,
+	SubmitSMSkeleton,
+	decode_deliver_sm,
+	decode_generic_nack,
+	decode_header,
+	decode_query_sm_resp,
+	decode_submit_multi_resp,
+	decode_submit_sm_resp,
+	encode_enquire_link,
+	get_command_id
+)
+
+
+SUBMIT_PARAMS = {
+	"source_addr_ton": 5,
+	"source_addr": "TEST",
+	"dest_addr_ton": 1,
+	"dest_addr_npi": 1,
+	"registered_delivery": 1
+}
+
+# Hand-assembled PDUs, field by field
+SUBMIT_SM = bytes.fromhex(
+	"00000033" "00000004" "00000000" "00000007"  # header, command_length 51
+	"00"                                          # service_type
+	"0500" "5445535400"                           # source_addr_ton, npi, source_addr
+	"0101" "32353537313233343536373800"           # dest_addr_ton, npi, destination_addr
+	"000000"                                      # esm_class, protocol_id, priority_flag
+	"00" "00"                                     # schedule_delivery_time, validity_period
+	"01000000"                                    # registered_delivery .. sm_default_msg_id
+	"02" "4869"                                   # sm_length, short_message
+)
+
+SUBMIT_SM_PAYLOAD = bytes.fromhex(
+	"0000003a" "00000004" "00000000" "00000008"
+	"00" "0500" "5445535400" "0101" "32353537313233343536373800"
+	"000000" "00" "00" "01000000"
+	"00"                                          # empty short_message
+	"0424" "0005" "48656c6c6f"                    # message_payload TLV
+)
+
+SUBMIT_MULTI_PDU = bytes.fromhex(
+	"00000035" "00000021" "00000000" "00000009"
+	"00" "0500" "5445535400"
+	"02"                                          # number_of_dests
+	"010101" "3235353700"                         # dest_flag, ton, npi, address
+	"010101" "3235353800"
+	"000000" "00" "00" "01000000"
+	"02" "4869"
+)
+
+QUERY_SM_PDU = bytes.fromhex(
+	"0000001b" "00000003" "00000000" "0000000a"
+	"61626300"                                    # message_id
+	"0500" "5445535400"                           # source_addr_ton, npi, source_addr
+)
+
+SUBMIT_SM_RESP = bytes.fromhex("00000015" "80000004" "00000000" "00000007" "3041314200")
+SUBMIT_SM_RESP_ERROR = bytes.fromhex("00000010" "80000004" "00000045" "00000008")
+
+SUBMIT_MULTI_RESP = bytes.fromhex(
+	"00000020" "80000021" "00000000" "00000009"
+	"4d494400"                                    # message_id
+	"01"                                          # no_unsuccess
+	"0101" "3235353800" "00000045"                # ton, npi, address, error_status_code
+)
+
+QUERY_SM_RESP = bytes.fromhex(
+	"00000027" "80000003" "00000000" "0000000a"
+	"4d494400"                                    # message_id
+	"3236313031373132303130303030342b00"          # final_date
+	"02" "00"                                     # message_state, error_code
+)
+
+DELIVER_SM = bytes.fromhex(
+	"00000048" "00000005" "00000000" "0000000b"
+	"00"                                          # service_type
+	"0101" "32353537313233343536373800"           # source_addr_ton, npi, source_addr
+	"0500" "5445535400"                           # dest_addr_ton, npi, destination_addr
+	"040000"                                      # esm_class (receipt), protocol_id, priority_flag
+	"00" "00"
+	"00000000"                                    # registered_delivery .. sm_default_msg_id
+	"11" "69643a3120737461743a44454c49565244"     # sm_length, "id:1 stat:DELIVRD"
+	"001e" "0002" "3100"                          # receipted_message_id TLV
+)
+
+
+class FakeSocket:
+	"""Hands out data a few octets per recv_into, as TCP may"""
+
+	def __init__(self, data, chunk=3):
+		self.data = data
+		self.chunk = chunk
+
+	def recv_into(self, view):
+		received = min(len(view), self.chunk, len(self.data))
+		view[:received] = self.data[:received]
+		self.data = self.data[received:]
+		return received
+
+
+class TestPDUCodec(unittest.TestCase):
+	def test_encode(self):
+		skeleton = SubmitSMSkeleton(SUBMIT_PARAMS)
+		# (name, encode, expected)
+		cases = [
+			("submit_sm", lambda encoder: encoder.submit_sm(7, {
+				"skeleton": skeleton, "destination_addr": "255712345678", "short_message": b"Hi"}), SUBMIT_SM),
+			("submit_sm without skeleton", lambda encoder: encoder.submit_sm(7, dict(
+				SUBMIT_PARAMS, destination_addr="255712345678", short_message=b"Hi")), SUBMIT_SM),
+			("submit_sm message_payload", lambda encoder: encoder.submit_sm(8, {
+				"skeleton": skeleton, "destination_addr": "255712345678",
+				"tlvs": ((TAG_MESSAGE_PAYLOAD, b"Hello"),)}), SUBMIT_SM_PAYLOAD),
+			("submit_multi", lambda encoder: encoder.submit_multi(9, {
+				"skeleton": skeleton, "destinations": ["2557", "2558"], "short_message": b"Hi"}), SUBMIT_MULTI_PDU),
+			("query_sm", lambda encoder: encoder.query_sm(10, {
+				"message_id": "abc", "source_addr_ton": 5, "source_addr": "TEST"}), QUERY_SM_PDU),
+			("deliver_sm_resp", lambda encoder: encoder.response(DELIVER_SM_RESP, 11),
+				bytes.fromhex("00000011" "80000005" "00000000" "0000000b" "00")),
+			("enquire_link_resp", lambda encoder: encoder.response(ENQUIRE_LINK_RESP, 12),
+				bytes.fromhex("00000010" "80000015" "00000000" "0000000c"))
+		]
+		for name, encode, expected in cases:
+			with self.subTest(name):
+				self.assertEqual(bytes(encode(PDUEncoder())), expected)
+				# A buffer too small to start with grows to fit
+				self.assertEqual(bytes(encode(PDUEncoder(size=8))), expected)
+
+	def test_encoder_reuses_its_buffer(self):
+		encoder = PDUEncoder()
+		skeleton = SubmitSMSkeleton(SUBMIT_PARAMS)
+
+		encoder.submit_sm(7, {"skeleton": skeleton, "destination_addr": "255712345678", "short_message": b"a" * 100})
+		pdu = encoder.submit_sm(7, {"skeleton": skeleton, "destination_addr": "255712345678", "short_message": b"Hi"})
+
+		self.assertEqual(bytes(pdu), SUBMIT_SM)
+
+	def test_encode_limits(self):
+		encoder = PDUEncoder()
+		skeleton = SubmitSMSkeleton(SUBMIT_PARAMS)
+
+		pdu = encoder.submit_sm(1, {"skeleton": skeleton, "destination_addr": "1", "short_message": b"a" * MAX_SHORT_MESSAGE})
+		self.assertEqual(decode_header(pdu)[0], len(pdu))
+
+		with self.assertRaises(ValueError):
+			encoder.submit_sm(1, {"skeleton": skeleton, "destination_addr": "1",
+								  "short_message": b"a" * (MAX_SHORT_MESSAGE + 1)})
+
+		for destinations in ([], ["1"] * (MAX_MULTI_DESTINATIONS + 1)):
+			with self.subTest(destinations=len(destinations)), self.assertRaises(ValueError):
+				encoder.submit_multi(1, {"skeleton": skeleton, "destinations": destinations, "short_message": b"Hi"})
+
+		pdu = encoder.submit_multi(1, {"skeleton": skeleton, "destinations": ["1"] * MAX_MULTI_DESTINATIONS,
+									   "short_message": b"Hi"})
+		self.assertEqual(get_command_id(pdu), SUBMIT_MULTI)
+		self.assertEqual(decode_header(pdu)[0], len(pdu))
+
+	def test_enquire_link(self):
+		self.assertEqual(encode_enquire_link(5), bytes.fromhex("00000010" "00000015" "00000000" "00000005"))
+
+	def test_decode_submit_sm_resp(self):
+		# (pdu, sequence, status, message_id)
+		cases = [
+			(SUBMIT_SM_RESP, 7, 0, "0A1B"),
+			(SUBMIT_SM_RESP_ERROR, 8, 0x45, "")
+		]
+		for pdu, sequence, status, message_id in cases:
+			with self.subTest(status=status):
+				response = decode_submit_sm_resp(pdu, len(pdu))
+				self.assertEqual((response.sequence, response.status, response.message_id, response.is_error()),
+								 (sequence, status, message_id, bool(status)))
+
+	def test_decode_submit_multi_resp(self):
+		response = decode_submit_multi_resp(SUBMIT_MULTI_RESP, len(SUBMIT_MULTI_RESP))
+
+		self.assertEqual((response.sequence, response.message_id, response.unsuccess), (9, "MID", {"2558": 0x45}))
+
+	def test_decode_query_sm_resp(self):
+		response = decode_query_sm_resp(QUERY_SM_RESP, len(QUERY_SM_RESP))
+
+		self.assertEqual((response.sequence, response.message_id, response.final_date,
+						  response.message_state, response.error_code),
+						 (10, "MID", "261017120100004+", 2, 0))
+
+	def test_decode_generic_nack(self):
+		pdu = bytes.fromhex("00000010" "80000000" "00000003" "0000000c")
+		nack = decode_generic_nack(pdu)
+
+		self.assertEqual((nack.sequence, nack.status, nack.is_error()), (12, 3, True))
+
+	def test_decode_deliver_sm(self):
+		pdu = decode_deliver_sm(DELIVER_SM, len(DELIVER_SM))
+
+		self.assertEqual(
+			(pdu.sequence, pdu.source_addr_ton, pdu.source_addr_npi, pdu.source_addr, pdu.destination_addr,
+			 pdu.esm_class, pdu.data_coding, pdu.short_message, pdu.optional_params),
+			(11, 1, 1, "255712345678", "TEST", 0x04, 0, b"id:1 stat:DELIVRD", {0x001E: b"1\0"})
+		)
+
+	def test_reader(self):
+		data = SUBMIT_SM_RESP + DELIVER_SM
+		reader = PDUReader(size=16)
+		sock = FakeSocket(data)
+
+		length = reader.read(sock)
+		self.assertEqual(bytes(reader.buffer[:length]), SUBMIT_SM_RESP)
+
+		length = reader.read(sock)
+		self.assertEqual(bytes(reader.buffer[:length]), DELIVER_SM)
+
+	def test_reader_rejects_broken_pdus(self):
+		# (data, reason)
+		cases = [
+			(bytes.fromhex("00000008" "80000004"), "command_length below the header size"),
+			(bytes.fromhex("7fffffff" "80000004"), "command_length beyond MAX_PDU_LENGTH"),
+			(SUBMIT_SM_RESP[:10], "connection closed mid-PDU")
+		]
+		for data, reason in cases:
+			with self.subTest(reason), self.assertRaises(ConnectionError):
+				PDUReader().read(FakeSocket(data))
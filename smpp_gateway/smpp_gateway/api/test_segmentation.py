@@ -0,0 +1,168 @@
+# Copyright (c) 2026, aakvatech and Contributors
+# See license.txt
+
+import unittest
+
+from smpp_gateway.smpp_gateway.api.segmentation import (
+	MAX_PARTS,
+	build_udh,
+	count_encoded_parts,
+	count_parts,
+	pack_septets,
+	segment_message,
+	split_units,
+	unpack_septets
+)
+
+
+class TestSegmentation(unittest.TestCase):
+	def test_count_parts(self):
+		# (length, data_coding, reference_bits, parts)
+		cases = [
+			(0, 0, 8, 1),
+			(160, 0, 8, 1),
+			(161, 0, 8, 2),
+			(306, 0, 8, 2),
+			(307, 0, 8, 3),
+			(304, 0, 16, 2),
+			(305, 0, 16, 3),
+			(70, 8, 8, 1),
+			(71, 8, 8, 2),
+			(134, 8, 8, 2),
+			(135, 8, 8, 3),
+			(132, 8, 16, 2),
+			(133, 8, 16, 3),
+			(140, 4, 8, 1),
+			(141, 4, 8, 2),
+			(268, 4, 8, 2),
+			(269, 4, 8, 3)
+		]
+		for length, data_coding, reference_bits, parts in cases:
+			with self.subTest(length=length, data_coding=data_coding, reference_bits=reference_bits):
+				self.assertEqual(count_parts(length, data_coding, reference_bits), parts)
+
+	def test_build_udh(self):
+		self.assertEqual(build_udh(0x1234, 3, 1), bytes.fromhex("050003340301"))
+		self.assertEqual(build_udh(0x1234, 3, 2, reference_bits=16), bytes.fromhex("06080412340302"))
+
+	def test_pack_septets(self):
+		# (septets, fill_bits, packed)
+		cases = [
+			(b"", 0, b""),
+			# 3GPP TS 23.038 example
+			(b"hellohello", 0, bytes.fromhex("e8329bfd4697d9ec37")),
+			(b"\x7f" * 8, 0, b"\xff" * 7),
+			(b"\x01", 0, b"\x01"),
+			(b"\x01", 1, b"\x02"),
+			(b"\x7f", 1, b"\xfe"),
+			(b"\x7f", 2, b"\xfc\x01"),
+			# After a 6-octet UDH one fill bit aligns the first septet
+			(b"hello", 1, bytes.fromhex("d06536fb0d")),
+			# After a 7-octet UDH no fill bit is needed
+			(b"hello", 0, bytes.fromhex("e8329bfd06"))
+		]
+		for septets, fill_bits, packed in cases:
+			with self.subTest(septets=septets, fill_bits=fill_bits):
+				self.assertEqual(pack_septets(septets, fill_bits), packed)
+				self.assertEqual(unpack_septets(packed, len(septets), fill_bits), septets)
+
+	def test_unpack_round_trip(self):
+		septets = bytes(range(0x80))
+		for fill_bits in range(7):
+			with self.subTest(fill_bits=fill_bits):
+				self.assertEqual(unpack_septets(pack_septets(septets, fill_bits), len(septets), fill_bits), septets)
+
+	def test_split_single_part(self):
+		self.assertEqual(split_units(b"a" * 160, 0), [b"a" * 160])
+		self.assertEqual(split_units(("a" * 70).encode("utf-16-be"), 8), [("a" * 70).encode("utf-16-be")])
+
+	def test_split_keeps_escape_with_its_character(self):
+		# The 153rd septet of the first part would be the escape in front of €
+		encoded = b"a" * 152 + b"\x1b\x65" + b"a" * 10
+		parts = split_units(encoded, 0)
+
+		self.assertEqual(parts, [b"a" * 152, b"\x1b\x65" + b"a" * 10])
+
+	def test_split_keeps_surrogate_pairs_whole(self):
+		# The 67th code unit of the first part would be the high surrogate of the emoji
+		encoded = ("a" * 66 + "\U0001f600" + "b" * 10).encode("utf-16-be")
+		parts = split_units(encoded, 8)
+
+		self.assertEqual(parts, [("a" * 66).encode("utf-16-be"), ("\U0001f600" + "b" * 10).encode("utf-16-be")])
+		self.assertEqual(b"".join(parts), encoded)
+
+	def test_split_at_limit_boundaries(self):
+		# (encoded, data_coding, reference_bits, part lengths in octets)
+		cases = [
+			(b"a" * 306, 0, 8, [153, 153]),
+			(b"a" * 307, 0, 8, [153, 153, 1]),
+			(b"a" * 305, 0, 16, [152, 152, 1]),
+			(b"ab" * 135, 8, 8, [134, 134, 2]),
+			(b"a" * 269, 4, 8, [134, 134, 1])
+		]
+		for encoded, data_coding, reference_bits, lengths in cases:
+			with self.subTest(length=len(encoded), data_coding=data_coding, reference_bits=reference_bits):
+				parts = split_units(encoded, data_coding, reference_bits)
+				self.assertEqual([len(part) for part in parts], lengths)
+				self.assertEqual(b"".join(parts), encoded)
+
+	def test_count_matches_split(self):
+		# (encoded, data_coding, reference_bits, parts); the first cases put a pair on a part boundary,
+		# where the count from the length alone is one short
+		cases = [
+			(b"a" * 152 + b"\x1b\x65" + b"a" * 152, 0, 8, 3),
+			(b"a" * 151 + b"\x1b\x65" + b"a" * 151, 0, 16, 3),
+			(("a" * 66 + "\U0001f600" + "a" * 66).encode("utf-16-be"), 8, 8, 3),
+			(("a" * 65 + "\U0001f600" + "a" * 65).encode("utf-16-be"), 8, 16, 3),
+			(b"a" * 151 + b"\x1b\x65" + b"a" * 153, 0, 8, 2),
+			(b"a" * 160, 0, 8, 1),
+			(b"a" * 306, 0, 8, 2),
+			(b"a" * 153 * (MAX_PARTS + 1), 0, 8, MAX_PARTS + 1)
+		]
+		for encoded, data_coding, reference_bits, parts in cases:
+			with self.subTest(length=len(encoded), data_coding=data_coding, reference_bits=reference_bits):
+				self.assertEqual(count_encoded_parts(encoded, data_coding, reference_bits), parts)
+				if parts <= MAX_PARTS:
+					self.assertEqual(len(split_units(encoded, data_coding, reference_bits)), parts)
+
+	def test_max_parts(self):
+		self.assertEqual(len(split_units(b"a" * 153 * MAX_PARTS, 0)), MAX_PARTS)
+
+		with self.assertRaises(ValueError):
+			split_units(b"a" * (153 * MAX_PARTS + 1), 0)
+
+	def test_segment_single_part(self):
+		self.assertEqual(segment_message(b"hello", 0), ([b"hello"], False))
+		self.assertEqual(segment_message(b"hello", 0, pack=True), ([bytes.fromhex("e8329bfd06")], False))
+
+	def test_segment_with_udh(self):
+		for reference_bits, udh_length in ((8, 6), (16, 7)):
+			with self.subTest(reference_bits=reference_bits):
+				short_messages, has_udh = segment_message(b"a" * 200, 0, reference_bits)
+
+				self.assertTrue(has_udh)
+				self.assertEqual(len(short_messages), 2)
+
+				udhs = [short_message[:udh_length] for short_message in short_messages]
+				self.assertEqual([udh[udh_length - 2:] for udh in udhs], [b"\x02\x01", b"\x02\x02"])
+				# Both parts carry the same reference
+				self.assertEqual(udhs[0][:udh_length - 1], udhs[1][:udh_length - 1])
+				self.assertEqual(b"".join(short_message[udh_length:] for short_message in short_messages), b"a" * 200)
+
+	def test_segment_packed_parts_fit_140_octets(self):
+		for reference_bits, udh_length, fill_bits in ((8, 6, 1), (16, 7, 0)):
+			with self.subTest(reference_bits=reference_bits):
+				septets = bytes(index % 0x80 for index in range(400))
+				short_messages, has_udh = segment_message(septets, 0, reference_bits, pack=True)
+				per_part = 153 if reference_bits == 8 else 152
+
+				self.assertTrue(has_udh)
+				self.assertEqual(max(len(short_message) for short_message in short_messages), 140)
+
+				unpacked = b""
+				for short_message in short_messages:
+					payload = short_message[udh_length:]
+					count = min(per_part, len(septets) - len(unpacked))
+					unpacked += unpack_septets(payload, count, fill_bits)
+
+				self.assertEqual(unpacked, septets)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Submit Throttle
+Token bucket per SMPP Configuration that keeps submit_sm at the contracted
+rate, shrinks the rate when the SMSC answers with a throttling error and
+recovers it gradually afterwards
+"""
+
+from __future__ import unicode_literals
+import threading
+import time
+
+
+# command_status values that mean "slow down", not "this message is bad"
+THROTTLING_ERRORS = {
+    0x00000058,  # ESME_RTHROTTLED
+    0x00000014,  # ESME_RMSGQFUL
+}
+
+# A throttled submit is retried this many times within its batch, then re-queued
+THROTTLE_RETRIES = 3
+THROTTLE_REQUEUE_DELAY = 30
+
+# Rate is multiplied by this on every throttling error ...
+BACKOFF_FACTOR = 0.5
+# ... never drops below this share of the configured rate ...
+MIN_RATE_FACTOR = 0.1
+# ... and grows back by this share of the configured rate per second
+RECOVERY_PER_SECOND = 0.1
+
+
+class TokenBucket:
+    """Thread-safe token bucket with multiplicative backoff and linear recovery"""
+
+    def __init__(self, rate, burst=None):
+        self.configured_rate = float(rate)
+        self.rate = self.configured_rate
+        self.burst = max(1, int(burst or rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, current):
+        elapsed = current - self.updated
+        self.updated = current
+
+        if self.rate < self.configured_rate:
+            self.rate = min(self.configured_rate,
+                            self.rate + self.configured_rate * RECOVERY_PER_SECOND * elapsed)
+
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def reserve(self):
+        """
+        Take a token if one is available
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds until one will be
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        wait = self.reserve()
+        while wait:
+            time.sleep(wait)
+            wait = self.reserve()
+
+    def penalize(self):
+        """Back off after the SMSC reported throttling"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.configured_rate * MIN_RATE_FACTOR, self.rate * BACKOFF_FACTOR)
+            self.tokens = min(self.tokens, 0)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_throttle(config):
+    """
+    Get the shared token bucket of an SMPP Configuration
+
+    Args:
+        config: SMPP Configuration document
+
+    Returns:
+        TokenBucket: or None when the configuration has no rate limit
+    """
+    rate = float(config.get("max_tps") or 0)
+    if rate <= 0:
+        return None
+
+    burst = int(config.get("tps_burst") or 0) or None
+
+    with _buckets_lock:
+        bucket = _buckets.get(config.name)
+
+        # Rebuild when the configured rate or burst changed
+        if not bucket or bucket.configured_rate != rate or bucket.burst != max(1, int(burst or rate)):
+            bucket = _buckets[config.name] = TokenBucket(rate, burst)
+
+        return bucket
+
+
+def is_throttling_error(status):
+    """Check whether a command_status asks the ESME to slow down"""
+    try:
+        return int(status) in THROTTLING_ERRORS
+    except (TypeError, ValueError):
+        return False
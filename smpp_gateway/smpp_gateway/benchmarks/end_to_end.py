@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP End-to-End Benchmark
+Drives send_notification_sms, send_template_sms or the queue processor
+against a local SMSC simulator at a controlled rate and batch size and
+reports throughput, latency percentiles per stage and database writes per
+message, so capacity can be compared between runs and upgrades
+
+    bench --site mysite smpp-gateway benchmark --mode template --messages 5000 --output run.json
+
+Latency stages of a message, all taken from database timestamps:
+    enqueue: API call (or queue batch) started -> SMPP SMS Message created
+    submit:  SMPP SMS Message created -> submit_sm_resp recorded (sent_time)
+    dlr:     submit_sm_resp recorded -> SMPP Delivery Receipt stored
+"""
+
+from __future__ import unicode_literals
+import json
+import re
+import time
+from collections import Counter
+
+import frappe
+from frappe.utils import get_datetime, now, now_datetime
+
+from smpp_gateway.smpp_gateway.api.gateway import is_gateway_running
+from smpp_gateway.smpp_gateway.api.smsc_simulator import SMSCSimulator
+
+
+MODES = ("notification", "template", "queue")
+
+# Name of the SMPP Configuration, SMPP Route and SMPP SMS Template the benchmark owns
+BENCHMARK_NAME = "_SMPP Benchmark"
+
+# Recipients are +999 numbers, a country code ITU has not assigned, routed to the benchmark configuration
+BENCHMARK_PREFIX = "999"
+
+BENCHMARK_MESSAGE = "Hello Benchmark, your verification code is 123456"
+BENCHMARK_TEMPLATE = "Hello {{ name }}, your verification code is {{ code }}"
+BENCHMARK_TEMPLATE_DATA = {"name": "Benchmark", "code": "123456"}
+
+PERCENTILES = (50, 95, 99)
+
+# Seconds between two checks for outstanding delivery receipts
+RECEIPT_POLL_INTERVAL = 0.1
+
+# Rows per IN (...) filter when reading the results back
+READ_CHUNK_SIZE = 1000
+
+_WRITE_STATEMENT = re.compile(r"\s*(insert|update|delete|replace)\b", re.IGNORECASE)
+
+
+class WriteCounter:
+    """Count INSERT/UPDATE/DELETE statements and commits sent through frappe.db while active"""
+
+    def __init__(self):
+        self.writes = 0
+        self.commits = 0
+
+    def __enter__(self):
+        db = frappe.db
+        sql, commit = db.sql, db.commit
+
+        def counted_sql(query, *args, **kwargs):
+            if _WRITE_STATEMENT.match(str(query)):
+                self.writes += 1
+            return sql(query, *args, **kwargs)
+
+        def counted_commit(*args, **kwargs):
+            self.commits += 1
+            return commit(*args, **kwargs)
+
+        # Instance attributes shadow the methods and are deleted again on exit
+        db.sql, db.commit = counted_sql, counted_commit
+        self._db = db
+        return self
+
+    def __exit__(self, *args):
+        del self._db.sql
+        del self._db.commit
+
+
+class EndToEndBenchmark:
+    """
+    One benchmark run
+
+    Args:
+        mode: "notification" (send_notification_sms), "template" (send_template_sms)
+              or "queue" (SMPP SMS Queue items drained by process_sms_queue)
+        messages: Number of messages to send
+        batch_size: Recipients per API call, or queue items created per batch
+        rate: Target messages per second; 0 sends every batch as soon as the previous one returned
+        engine: session_engine of the benchmark configuration
+        window_size, max_binds: submit_window_size and max_binds of the benchmark configuration
+        receipt_timeout: Seconds to wait for outstanding delivery receipts after the last submit
+        keep: Keep the messages, receipts and logs of the run instead of deleting them
+        simulator_options: SMSCSimulator arguments, e.g. response_delay, dlr_delay, throttle_rate
+    """
+
+    def __init__(self, mode="notification", messages=1000, batch_size=100, rate=0, engine="smpplib",
+                 window_size=10, max_binds=1, receipt_timeout=30, keep=False, **simulator_options):
+        if mode not in MODES:
+            frappe.throw(f"Benchmark mode must be one of {', '.join(MODES)}")
+
+        if messages < 1 or batch_size < 1:
+            frappe.throw("Messages and batch size must be at least 1")
+
+        self.mode = mode
+        self.messages = messages
+        self.batch_size = batch_size
+        self.rate = rate
+        self.engine = engine
+        self.window_size = window_size
+        self.max_binds = max_binds
+        self.receipt_timeout = receipt_timeout
+        self.keep = keep
+        self.simulator_options = dict(simulator_options)
+
+        self.simulator = None
+        self.config_name = None
+        self.route_name = None
+        self.template_name = None
+        self.started_at = {}
+
+    def run(self):
+        """
+        Run the benchmark
+
+        Returns:
+            dict: Parameters, throughput, latency percentiles, database writes and simulator counters
+        """
+        # The daemon would take the messages over and the submits could not be timed here
+        if is_gateway_running():
+            frappe.throw("Stop the SMPP gateway daemon before running a benchmark")
+
+        self.simulator = SMSCSimulator(**self.simulator_options)
+        self.simulator.start()
+
+        try:
+            self._setup()
+            run_started = now()
+
+            with WriteCounter() as counter:
+                begin = time.monotonic()
+                self._send_all()
+                if self.mode == "queue":
+                    self._drain_queue()
+                send_seconds = time.monotonic() - begin
+
+                receipts_complete = self._wait_for_receipts()
+                total_seconds = time.monotonic() - begin
+
+            return self._report(run_started, counter, send_seconds, total_seconds, receipts_complete)
+
+        finally:
+            self._teardown()
+
+    def _setup(self):
+        """Point the benchmark configuration at the simulator and route the benchmark prefix to it"""
+        values = {
+            "smsc_host": self.simulator.host,
+            "smsc_port": self.simulator.port,
+            "system_id": "benchmark",
+            "password": "benchmark",
+            "is_active": 1,
+            "is_default": 0,
+            "session_engine": self.engine,
+            "submit_window_size": self.window_size,
+            "max_binds": self.max_binds
+        }
+
+        self.config_name = frappe.db.get_value("SMPP Configuration", {"configuration_name": BENCHMARK_NAME})
+        if self.config_name:
+            config = frappe.get_doc("SMPP Configuration", self.config_name)
+            config.update(values)
+            config.save(ignore_permissions=True)
+        else:
+            self.config_name = frappe.get_doc(dict(values, doctype="SMPP Configuration",
+                                                   configuration_name=BENCHMARK_NAME)).insert(
+                ignore_permissions=True).name
+
+        # send_template_sms has no configuration argument; its recipients are routed
+        self.route_name = frappe.get_doc({
+            "doctype": "SMPP Route",
+            "prefix": BENCHMARK_PREFIX,
+            "smpp_configuration": self.config_name,
+            "description": BENCHMARK_NAME
+        }).insert(ignore_permissions=True).name
+
+        if self.mode == "template":
+            self.template_name = frappe.db.get_value("SMPP SMS Template", {"template_name": BENCHMARK_NAME})
+            if not self.template_name:
+                self.template_name = frappe.get_doc({
+                    "doctype": "SMPP SMS Template",
+                    "template_name": BENCHMARK_NAME,
+                    "template_title": BENCHMARK_NAME,
+                    "template_type": "otp",
+                    "is_active": 1,
+                    "message_template": BENCHMARK_TEMPLATE
+                }).insert(ignore_permissions=True).name
+
+        frappe.db.commit()
+
+    def _send_all(self):
+        """Send every batch, spaced out to the target rate"""
+        from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+
+        interval = self.batch_size / float(self.rate) if self.rate else 0
+        begin = time.monotonic()
+
+        for index, offset in enumerate(range(0, self.messages, self.batch_size)):
+            if interval:
+                wait = begin + index * interval - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+
+            numbers = [get_benchmark_number(number)
+                       for number in range(offset, min(self.messages, offset + self.batch_size))]
+
+            batch_started = now_datetime()
+            for name in self._send_batch(numbers):
+                self.started_at[name] = batch_started
+
+            # Notification results pile up as msgprints in a long run
+            frappe.local.message_log = []
+
+            # Receipts are taken in as they come, as the scheduler would
+            if self.mode != "queue":
+                get_smpp_client(self.config_name).process_delivery_receipts()
+
+    def _send_batch(self, numbers):
+        """Hand one batch to the API under test and return the names of its SMPP SMS Messages"""
+        from smpp_gateway.smpp_gateway.api.sms_api import send_notification_sms, send_template_sms
+
+        if self.mode == "notification":
+            return send_notification_sms(numbers, BENCHMARK_MESSAGE, smpp_config=self.config_name)["sms_messages"]
+
+        if self.mode == "template":
+            return send_template_sms(self.template_name, numbers, BENCHMARK_TEMPLATE_DATA)["sms_messages"]
+
+        names = []
+        for number in numbers:
+            sms_doc = frappe.get_doc({
+                "doctype": "SMPP SMS Message",
+                "recipient_number": number,
+                "message_text": BENCHMARK_MESSAGE,
+                "smpp_configuration": self.config_name,
+                "registered_delivery": 1,
+                "status": "Queued"
+            }).insert(ignore_permissions=True)
+
+            frappe.get_doc({
+                "doctype": "SMPP SMS Queue",
+                "sms_message": sms_doc.name,
+                "status": "Pending"
+            }).insert(ignore_permissions=True)
+            names.append(sms_doc.name)
+
+        frappe.db.commit()
+        return names
+
+    def _drain_queue(self):
+        """Run the queue processor until the queue items of the run are handled"""
+        from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+        from smpp_gateway.smpp_gateway.tasks.queue_processor import process_sms_queue
+
+        names = list(self.started_at)
+        due = {"status": ["in", ["Pending", "Retrying"]]}
+        pending = None
+
+        # Stops once nothing is due, e.g. only throttled items rescheduled for later are left, or a pass made no progress
+        while True:
+            due["scheduled_for"] = ["<=", now()]
+            remaining = self._count("SMPP SMS Queue", "sms_message", names, due)
+            if not remaining or remaining == pending:
+                return
+
+            pending = remaining
+            process_sms_queue()
+            get_smpp_client(self.config_name).process_delivery_receipts()
+
+    def _wait_for_receipts(self):
+        """Take in delivery receipts until every submitted message has one or the timeout passes"""
+        from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+
+        if self.simulator.dlr_delay is None:
+            return True
+
+        client = get_smpp_client(self.config_name)
+        names = list(self.started_at)
+        submitted = self._count("SMPP SMS Message", "name", names, {"message_id": ["is", "set"]})
+        deadline = time.monotonic() + self.receipt_timeout
+
+        while True:
+            client.process_delivery_receipts()
+            if self._count("SMPP SMS Message", "name", names, {"smpp_status": ["is", "set"]}) >= submitted:
+                return True
+
+            if time.monotonic() > deadline:
+                return False
+
+            time.sleep(RECEIPT_POLL_INTERVAL)
+
+    def _count(self, doctype, fieldname, names, filters):
+        """Count rows of the run matching filters, `fieldname` holding the SMPP SMS Message name"""
+        return sum(frappe.db.count(doctype, dict(filters, **{fieldname: ["in", chunk]}))
+                   for chunk in _chunks(names))
+
+    def _report(self, run_started, counter, send_seconds, total_seconds, receipts_complete):
+        names = list(self.started_at)
+        rows = []
+        received = {}
+
+        for chunk in _chunks(names):
+            rows.extend(frappe.get_all("SMPP SMS Message",
+                                       filters={"name": ["in", chunk]},
+                                       fields=["name", "creation", "sent_time", "status"]))
+
+            for receipt in frappe.get_all("SMPP Delivery Receipt",
+                                          filters={"original_message": ["in", chunk]},
+                                          fields=["original_message", "creation"]):
+                # A long message is delivered with the receipt of its last part
+                received[receipt.original_message] = max(receipt.creation,
+                                                         received.get(receipt.original_message, receipt.creation))
+
+        enqueue, submit, dlr = [], [], []
+        for row in rows:
+            created = get_datetime(row.creation)
+            enqueue.append((created - self.started_at[row.name]).total_seconds())
+
+            if row.sent_time:
+                sent = get_datetime(row.sent_time)
+                submit.append((sent - created).total_seconds())
+
+                if row.name in received:
+                    dlr.append((get_datetime(received[row.name]) - sent).total_seconds())
+
+        return {
+            "mode": self.mode,
+            "started": run_started,
+            "parameters": {
+                "messages": self.messages,
+                "batch_size": self.batch_size,
+                "rate": self.rate,
+                "engine": self.engine,
+                "window_size": self.window_size,
+                "max_binds": self.max_binds,
+                "simulator": self.simulator_options
+            },
+            "submitted": len(submit),
+            "seconds": round(send_seconds, 3),
+            "messages_per_second": round(len(submit) / send_seconds, 1) if send_seconds else None,
+            "seconds_until_receipts": round(total_seconds, 3),
+            "receipts_complete": receipts_complete,
+            "statuses": dict(Counter(row.status for row in rows)),
+            "latency": {
+                "enqueue": get_percentiles(enqueue),
+                "submit": get_percentiles(submit),
+                "dlr": get_percentiles(dlr)
+            },
+            "database": {
+                "writes": counter.writes,
+                "commits": counter.commits,
+                "writes_per_message": round(counter.writes / float(len(rows) or 1), 2),
+                "commits_per_message": round(counter.commits / float(len(rows) or 1), 2)
+            },
+            "simulator_stats": dict(self.simulator.stats)
+        }
+
+    def _teardown(self):
+        from smpp_gateway.smpp_gateway.api.smpp_client import _connection_pool
+
+        try:
+            pool = _connection_pool.pop(self.config_name, None)
+            if pool:
+                pool.disconnect()
+
+            if self.route_name:
+                frappe.delete_doc("SMPP Route", self.route_name, ignore_permissions=True, force=True)
+
+            if not self.keep:
+                self._delete_rows()
+
+            frappe.db.commit()
+
+        finally:
+            self.simulator.stop()
+
+    def _delete_rows(self):
+        """Delete what the run wrote, leaving the benchmark configuration and template for the next run"""
+        names = list(self.started_at)
+
+        for chunk in _chunks(names):
+            frappe.db.delete("SMPP Delivery Receipt", {"original_message": ["in", chunk]})
+            frappe.db.delete("SMPP SMS Queue", {"sms_message": ["in", chunk]})
+            frappe.db.delete("SMPP SMS Message", {"name": ["in", chunk]})
+
+        if self.config_name:
+            frappe.db.delete("SMPP Connection Log", {"connection_name": self.config_name})
+
+
+def get_benchmark_number(index):
+    """Recipient number of the index-th benchmark message"""
+    return f"+{BENCHMARK_PREFIX}{index:09d}"
+
+
+def get_percentiles(values):
+    """
+    Summarize latencies
+
+    Args:
+        values: Latencies in seconds
+
+    Returns:
+        dict: count, p50, p95, p99 and max in milliseconds (nearest rank)
+    """
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+    summary = {"count": len(values)}
+    for percentile in PERCENTILES:
+        rank = max(1, int(len(values) * percentile / 100.0 + 0.999999))
+        summary[f"p{percentile}"] = round(values[rank - 1] * 1000, 2)
+    summary["max"] = round(values[-1] * 1000, 2)
+
+    return summary
+
+
+def run_benchmark(output=None, **options):
+    """
+    Run an end-to-end benchmark on the current site
+
+    Args:
+        output: Path to write the results to as JSON
+        options: EndToEndBenchmark arguments
+
+    Returns:
+        dict: Benchmark results
+    """
+    results = EndToEndBenchmark(**options).run()
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+    return results
+
+
+def _chunks(names):
+    for offset in range(0, len(names), READ_CHUNK_SIZE):
+        yield names[offset:offset + READ_CHUNK_SIZE]
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+SMPP Micro-Benchmarks
+Times the functions that run once per message - number cleaning, priority
+mapping, message statistics, esm_class and time formatting, receipt parsing
+and PDU encoding and decoding - in ns/op and allocated bytes/op, and
+compares a run against a saved baseline to catch regressions
+
+    bench --site mysite smpp-gateway micro-benchmark --output baseline.json
+    bench --site mysite smpp-gateway micro-benchmark --baseline baseline.json --threshold 15
+"""
+
+from __future__ import unicode_literals
+import gc
+import itertools
+import json
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+
+import frappe
+
+from smpp_gateway.smpp_gateway.api.pdu_codec import (
+    SUBMIT_SM_RESP,
+    TAG_MESSAGE_PAYLOAD,
+    PDUEncoder,
+    SubmitSMSkeleton,
+    decode_deliver_sm,
+    decode_submit_sm_resp
+)
+from smpp_gateway.smpp_gateway.api.smsc_simulator import encode_pdu, encode_receipt
+
+
+# Seconds one timed repeat runs at least; the loop count is raised tenfold until it does
+MIN_REPEAT_TIME = 0.2
+
+# Timed repeats per benchmark; the fastest is reported, as the others only add scheduler noise
+REPEATS = 5
+
+# Calls traced to average the bytes allocated per call
+ALLOCATION_SAMPLES = 200
+
+# Allowed slowdown against the baseline, in percent
+REGRESSION_THRESHOLD = 10
+
+RECEIPT_TEXT = ("id:0A1B2C3D4E sub:001 dlvrd:001 submit date:2610171200 done date:2610171201 "
+                "stat:DELIVRD err:000 text:Your verification")
+
+GSM_TEXT = "Your verification code is 123456. It expires in 10 minutes. Do not share it with anyone."
+UCS2_TEXT = "Nambari yako ya uthibitisho ni 123456 ✓ Usimpe mtu yeyote. " * 4
+
+
+def get_benchmarks():
+    """
+    Build the benchmark cases
+
+    Returns:
+        list: (name, callable) pairs; each callable runs one operation
+    """
+    from smpp_gateway.smpp_gateway.api.sms_api import clean_phone_number, normalize_priority
+    from smpp_gateway.smpp_gateway.api.smpp_client import SMPPClient
+
+    # The timed methods use no client state, so no session is set up
+    client = SMPPClient.__new__(SMPPClient)
+
+    gsm_message = frappe.get_doc({"doctype": "SMPP SMS Message", "message_text": GSM_TEXT})
+    ucs2_message = frappe.get_doc({"doctype": "SMPP SMS Message", "message_text": UCS2_TEXT})
+    plain = frappe._dict(message_type="")
+    flash = frappe._dict(message_type="flash")
+    scheduled = datetime(2026, 10, 17, 12, 30, 45)
+
+    submit_params = {
+        "source_addr_ton": 5,
+        "source_addr": "BENCHMARK",
+        "dest_addr_ton": 1,
+        "dest_addr_npi": 1,
+        "registered_delivery": 1
+    }
+    skeleton = SubmitSMSkeleton(submit_params)
+    submit = {"skeleton": skeleton, "destination_addr": "255712345678", "short_message": GSM_TEXT.encode("ascii")}
+    submit_payload = dict(submit, short_message=b"", tlvs=((TAG_MESSAGE_PAYLOAD, UCS2_TEXT.encode("utf-16-be")),))
+    submit_unprepared = dict(submit_params, destination_addr=submit["destination_addr"],
+                             short_message=submit["short_message"])
+    encoder = PDUEncoder()
+
+    submit_sm_resp = encode_pdu(SUBMIT_SM_RESP, 7, b"0A1B2C3D4E\0")
+    deliver_sm = encode_receipt(7, {
+        "message_id": "0A1B2C3D4E",
+        "submit_date": "2610171200",
+        "short_message": GSM_TEXT.encode("ascii"),
+        "destination": (1, 1, b"255712345678"),
+        "source_addr_ton": 5,
+        "source_addr_npi": 0,
+        "source_addr": b"BENCHMARK"
+    }, "DELIVRD")
+
+    return [
+        ("clean_phone_number", lambda: clean_phone_number("+255 (712) 345-678")),
+        ("normalize_priority:name", lambda: normalize_priority("High")),
+        ("normalize_priority:int", lambda: normalize_priority(2)),
+        ("calculate_message_stats:gsm", gsm_message.calculate_message_stats),
+        ("calculate_message_stats:ucs2_multipart", ucs2_message.calculate_message_stats),
+        ("_build_esm_class", lambda: client._build_esm_class(plain)),
+        ("_build_esm_class:flash", lambda: client._build_esm_class(flash)),
+        ("_format_time:datetime", lambda: client._format_time(scheduled)),
+        ("_format_time:string", lambda: client._format_time("2026-10-17 12:30:45")),
+        ("_parse_delivery_receipt", lambda: client._parse_delivery_receipt(RECEIPT_TEXT)),
+        ("_map_receipt_status", lambda: client._map_receipt_status("UNDELIV")),
+        ("encode:submit_sm", lambda: encoder.submit_sm(7, submit)),
+        ("encode:submit_sm_message_payload", lambda: encoder.submit_sm(7, submit_payload)),
+        ("encode:submit_sm_no_skeleton", lambda: encoder.submit_sm(7, submit_unprepared)),
+        ("decode:submit_sm_resp", lambda: decode_submit_sm_resp(submit_sm_resp, len(submit_sm_resp))),
+        ("decode:deliver_sm_receipt", lambda: decode_deliver_sm(deliver_sm, len(deliver_sm)))
+    ]
+
+
+def measure(func, min_repeat_time=MIN_REPEAT_TIME, repeats=REPEATS):
+    """
+    Time one operation
+
+    Args:
+        func: Callable running the operation once
+        min_repeat_time: Seconds one repeat must run at least
+        repeats: Timed repeats
+
+    Returns:
+        dict: ns_per_op (fastest repeat), loops per repeat and allocated_bytes_per_op
+    """
+    func()
+
+    loops = 1
+    elapsed = _time_loops(func, loops)
+    while elapsed < min_repeat_time * 1e9:
+        loops *= 10
+        elapsed = _time_loops(func, loops)
+
+    timings = [elapsed] + [_time_loops(func, loops) for _repeat in range(repeats - 1)]
+
+    return {
+        "ns_per_op": round(min(timings) / loops, 1),
+        "loops": loops,
+        "allocated_bytes_per_op": _allocated_bytes(func)
+    }
+
+
+def _time_loops(func, loops):
+    """Nanoseconds for `loops` calls, without the garbage collector interrupting"""
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter_ns()
+        for _loop in itertools.repeat(None, loops):
+            func()
+        return time.perf_counter_ns() - start
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _allocated_bytes(func):
+    """
+    Average peak of memory allocated during one call
+
+    CPython keeps no count of allocations, so the peak traced by tracemalloc
+    above what was allocated before the call stands in for it.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+
+    try:
+        total = 0
+        for _sample in range(ALLOCATION_SAMPLES):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            total += tracemalloc.get_traced_memory()[1] - before
+
+        return round(total / float(ALLOCATION_SAMPLES), 1)
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def run_micro_benchmarks(pattern=None, output=None):
+    """
+    Run the micro-benchmarks on the current site
+
+    Args:
+        pattern: Only run benchmarks whose name contains this text
+        output: Path to write the results to as JSON, e.g. to serve as the next baseline
+
+    Returns:
+        dict: Python version and the measurements per benchmark name
+    """
+    results = {}
+    for name, func in get_benchmarks():
+        if pattern and pattern not in name:
+            continue
+
+        results[name] = measure(func)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results
+    }
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+
+def find_regressions(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare a run against a baseline run
+
+    Args:
+        report: Result of run_micro_benchmarks()
+        baseline: An earlier result, e.g. loaded from its JSON file
+        threshold: Allowed increase of ns/op and allocated bytes/op, in percent
+
+    Returns:
+        list: Dicts with benchmark, metric, baseline, current and change (percent) of every regression
+    """
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+
+        for metric in ("ns_per_op", "allocated_bytes_per_op"):
+            # A few bytes of allocator noise on an allocation-free call is not a regression
+            if not previous.get(metric) or current[metric] - previous[metric] < 1:
+                continue
+
+            change = (current[metric] / previous[metric] - 1) * 100
+            if change > threshold:
+                regressions.append({
+                    "benchmark": name,
+                    "metric": metric,
+                    "baseline": previous[metric],
+                    "current": current[metric],
+                    "change": round(change, 1)
+                })
+
+    return regressions
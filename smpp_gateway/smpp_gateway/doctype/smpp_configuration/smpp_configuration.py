@@ -8,6 +8,16 @@ class SMPPConfiguration(Document):
         self.validate_default_config()
         self.validate_connection_params()
     
+    def on_update(self):
+        # Submit skeletons cached in this process hold the old address and protocol settings
+        from smpp_gateway.smpp_gateway.api.smpp_client import clear_submit_skeletons
+        clear_submit_skeletons(self.name)
+        
+        # Routes to a configuration that was switched off or on
+        if self.has_value_changed("is_active"):
+            from smpp_gateway.smpp_gateway.api.routing import get_router
+            get_router().invalidate()
+    
     def validate_default_config(self):
         """Ensure only one default configuration exists"""
         if self.is_default:
@@ -37,5 +47,39 @@ class SMPPConfiguration(Document):
         if self.connection_timeout and self.connection_timeout < 5:
             frappe.throw("Connection timeout must be at least 5 seconds")
         
+        if self.failover_timeout and self.failover_timeout < 1:
+            frappe.throw("Failover timeout must be at least 1 second")
+        
+        for endpoint in self.get("smsc_endpoints") or []:
+            if endpoint.smsc_port and (endpoint.smsc_port < 1 or endpoint.smsc_port > 65535):
+                frappe.throw(f"Row {endpoint.idx}: SMSC Port must be between 1 and 65535")
+        
         if self.enquire_link_timer and self.enquire_link_timer < 10:
-            frappe.throw("Enquire link timer must be at least 10 seconds")
\ No newline at end of file
+            frappe.throw("Enquire link timer must be at least 10 seconds")
+        
+        if self.submit_window_size is not None and self.submit_window_size < 1:
+            frappe.throw("Submit window size must be at least 1")
+        
+        if self.urgent_window_share and not 0 <= self.urgent_window_share <= 100:
+            frappe.throw("Reserved urgent share must be between 0 and 100 percent")
+        
+        if self.max_binds is not None and self.max_binds < 1:
+            frappe.throw("Max binds must be at least 1")
+        
+        if self.max_tps and self.max_tps < 0:
+            frappe.throw("Max submit rate cannot be negative")
+        
+        if self.tps_burst and self.tps_burst < 0:
+            frappe.throw("Burst size cannot be negative")
+
+        if self.write_coalesce_bytes and self.write_coalesce_bytes < 0:
+            frappe.throw("Write coalescing limit cannot be negative")
+
+        if self.write_coalesce_delay and self.write_coalesce_delay < 0:
+            frappe.throw("Write coalescing delay cannot be negative")
+
+        if self.socket_send_buffer and self.socket_send_buffer < 0:
+            frappe.throw("Socket send buffer cannot be negative")
+
+        if self.tcp_keepalive and self.tcp_keepalive_idle and self.tcp_keepalive_idle < 1:
+            frappe.throw("TCP keepalive idle time must be at least 1 second")
\ No newline at end of file
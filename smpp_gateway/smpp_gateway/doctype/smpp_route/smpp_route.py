@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import frappe
+from frappe.model.document import Document
+from smpp_gateway.smpp_gateway.api.routing import get_router, normalize_prefix
+
+class SMPPRoute(Document):
+    def validate(self):
+        self.validate_prefix()
+
+    def on_update(self):
+        # Routes are compiled into an in-memory trie; update it without a full reload
+        get_router().update(self)
+
+    def on_trash(self):
+        get_router().update(self, deleted=True)
+
+    def validate_prefix(self):
+        """Keep only the digits of the prefix"""
+        prefix = normalize_prefix(self.prefix)
+
+        if not prefix:
+            frappe.throw("Number Prefix must contain at least one digit")
+
+        if len(prefix) > 15:
+            frappe.throw("Number Prefix cannot be longer than a phone number (15 digits)")
+
+        self.prefix = prefix
@@ -0,0 +1,140 @@
+# Copyright (c) 2026, aakvatech and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from smpp_gateway.smpp_gateway.api import routing
+from smpp_gateway.smpp_gateway.api.routing import PrefixTrie, Router, normalize_prefix, route_number
+
+
+# (name, prefix, smpp_configuration, priority)
+ROUTES = [
+	("R-TZ", "255", "Tanzania", 0),
+	("R-TZ-VODA", "25575", "Vodacom", 0),
+	("R-TZ-VODA-2", "25575", "Vodacom Backup", 1),
+	("R-TZ-AIRTEL", "25568", "Airtel", 0),
+	("R-KE", "254", "Kenya", 0)
+]
+
+
+def make_route(name, prefix, smpp_configuration, priority):
+	return {"name": name, "prefix": prefix, "smpp_configuration": smpp_configuration, "priority": priority}
+
+
+def make_trie(routes=ROUTES):
+	trie = PrefixTrie()
+	for route in routes:
+		trie.insert(route[1], make_route(*route))
+
+	return trie
+
+
+class TestPrefixTrie(FrappeTestCase):
+	def test_longest_match(self):
+		trie = make_trie()
+		# (number, configurations of the longest matching prefix, best first)
+		cases = [
+			("255754000000", ["Vodacom", "Vodacom Backup"]),
+			("255684000000", ["Airtel"]),
+			("255714000000", ["Tanzania"]),
+			("2557", ["Tanzania"]),
+			("25575", ["Vodacom", "Vodacom Backup"]),
+			("254712000000", ["Kenya"]),
+			("256712000000", []),
+			("25", []),
+			("", [])
+		]
+		for number, configurations in cases:
+			with self.subTest(number=number):
+				self.assertEqual([route["smpp_configuration"] for route in trie.longest_match(number)],
+								 configurations)
+
+	def test_priority_order_does_not_depend_on_insert_order(self):
+		trie = make_trie(reversed(ROUTES))
+
+		self.assertEqual([route["name"] for route in trie.longest_match("25575")], ["R-TZ-VODA", "R-TZ-VODA-2"])
+
+	def test_remove(self):
+		# (prefix, name, removed, configurations matching 255754000000 afterwards)
+		cases = [
+			("25575", "R-TZ-VODA", True, ["Vodacom Backup"]),
+			("25575", "R-TZ-AIRTEL", False, ["Vodacom", "Vodacom Backup"]),
+			("2557", "R-TZ-VODA", False, ["Vodacom", "Vodacom Backup"]),
+			("255", "R-TZ", True, ["Vodacom", "Vodacom Backup"])
+		]
+		for prefix, name, removed, configurations in cases:
+			with self.subTest(prefix=prefix, name=name):
+				trie = make_trie()
+
+				self.assertEqual(trie.remove(prefix, name), removed)
+				self.assertEqual(len(trie), len(ROUTES) - removed)
+				self.assertEqual([route["smpp_configuration"] for route in trie.longest_match("255754000000")],
+								 configurations)
+
+	def test_remove_prunes_empty_nodes(self):
+		trie = make_trie()
+		trie.remove("25575", "R-TZ-VODA")
+		trie.remove("25575", "R-TZ-VODA-2")
+
+		# The shorter prefix matches again once the longer one is gone
+		self.assertEqual([route["smpp_configuration"] for route in trie.longest_match("255754000000")], ["Tanzania"])
+		self.assertNotIn("7", trie._root["2"]["5"]["5"])
+
+	def test_normalize_prefix(self):
+		# (number, digits)
+		cases = [
+			("+255 754 000 000", "255754000000"),
+			("(255) 754-000", "255754000"),
+			("", ""),
+			(None, "")
+		]
+		for number, digits in cases:
+			with self.subTest(number=number):
+				self.assertEqual(normalize_prefix(number), digits)
+
+
+class TestRouter(FrappeTestCase):
+	def setUp(self):
+		self.router = Router()
+		self.router.load()
+		for route in ROUTES:
+			self.router._apply(route[0], make_route(*route))
+
+		site = frappe.local.site
+		self.addCleanup(routing._routers.pop, site, None)
+		routing._routers[site] = self.router
+
+	def test_apply(self):
+		# (name, route or None to delete, number, configuration it routes to afterwards)
+		cases = [
+			("R-TZ-AIRTEL", make_route("R-TZ-AIRTEL", "25568", "Airtel Backup", 0), "255684000000", "Airtel Backup"),
+			("R-TZ-AIRTEL", make_route("R-TZ-AIRTEL", "25569", "Airtel", 0), "255684000000", "Tanzania"),
+			("R-TZ-AIRTEL", None, "255684000000", "Tanzania"),
+			("R-UG", make_route("R-UG", "256", "Uganda", 0), "256712000000", "Uganda"),
+			("R-KE", None, "254712000000", None)
+		]
+		for name, route, number, configuration in cases:
+			with self.subTest(name=name, number=number):
+				self.router._apply(name, route)
+
+				self.assertTrue(self.router.loaded)
+				self.assertEqual(self.router.route(number), configuration)
+
+	def test_apply_after_foreign_change_reloads(self):
+		# Another process published a change this router has not seen
+		frappe.cache().set_value(routing.ROUTES_VERSION_KEY, frappe.generate_hash(length=10))
+		self.router._apply("R-UG", make_route("R-UG", "256", "Uganda", 0))
+
+		self.assertFalse(self.router.loaded)
+
+	def test_route_number_falls_back_to_default(self):
+		# (number, default, configuration)
+		cases = [
+			("+255684000000", "Default", "Airtel"),
+			("+256712000000", "Default", "Default"),
+			("+256712000000", None, None)
+		]
+		for number, default, configuration in cases:
+			with self.subTest(number=number, default=default):
+				self.assertEqual(route_number(number, default), configuration)
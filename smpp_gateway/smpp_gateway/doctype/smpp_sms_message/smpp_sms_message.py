@@ -2,9 +2,31 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now
+from frappe.utils import cint
+from smpp_gateway.smpp_gateway.api.gsm_codec import encode_message, get_message_stats
+from smpp_gateway.smpp_gateway.api.routing import route_number
+from smpp_gateway.smpp_gateway.api.segmentation import count_encoded_parts
 import re
 
+
+# E.164: optional +, no leading zero, at most 15 digits
+PHONE_NUMBER_PATTERN = re.compile(r'^\+?[1-9]\d{1,14}$')
+
+
+def clean_phone_number(number):
+    """
+    Strip separators from a recipient number and check its format
+
+    Args:
+        number: Phone number as entered
+
+    Returns:
+        str: Number with only digits and a leading +, or None when it is not a valid number
+    """
+    phone = re.sub(r'[^\d+]', '', number or "")
+    return phone if PHONE_NUMBER_PATTERN.match(phone) else None
+
+
 class SMPPSMSMessage(Document):
     def validate(self):
         self.validate_phone_number()
@@ -18,9 +40,9 @@ class SMPPSMSMessage(Document):
         if not self.recipient_number:
             frappe.throw("Recipient number is required")
         
-        phone = re.sub(r'[^\d+]', '', self.recipient_number)
+        phone = clean_phone_number(self.recipient_number)
         
-        if not re.match(r'^\+?[1-9]\d{1,14}$', phone):
+        if not phone:
             frappe.throw(f"Invalid phone number format: {self.recipient_number}")
         
         self.recipient_number = phone
@@ -34,19 +56,29 @@ class SMPPSMSMessage(Document):
             frappe.throw("Message text too long. Maximum 1600 characters allowed.")
     
     def set_default_config(self):
-        """Set default SMPP configuration if not specified"""
+        """Route by recipient number, or use the default SMPP configuration, if none is specified"""
         if not self.smpp_configuration:
-            default_config = frappe.db.get_value("SMPP Configuration",
-                                                {"is_default": 1, "is_active": 1}, "name")
+            default_config = route_number(self.recipient_number) or frappe.db.get_value(
+                "SMPP Configuration", {"is_default": 1, "is_active": 1}, "name")
             if default_config:
                 self.smpp_configuration = default_config
             else:
                 frappe.throw("No default SMPP configuration found")
 
+    def get_config(self):
+        """SMPP Configuration of this message, loaded once per validation"""
+        if not self.smpp_configuration:
+            return frappe._dict()
+
+        if getattr(self, "_config", None) is None or self._config.name != self.smpp_configuration:
+            self._config = frappe.get_doc("SMPP Configuration", self.smpp_configuration)
+
+        return self._config
+
     def set_default_sender_id(self):
         """Set default sender ID from SMPP configuration if not specified"""
         if not self.sender_id and self.smpp_configuration:
-            config = frappe.get_doc("SMPP Configuration", self.smpp_configuration)
+            config = self.get_config()
             # Use default_sender_id from config, or fallback to system_id
             self.sender_id = config.get("default_sender_id") or config.system_id
 
@@ -55,15 +87,26 @@ class SMPPSMSMessage(Document):
         if not self.message_text:
             return
         
-        message_length = len(self.message_text)
-        is_unicode = any(ord(char) > 127 for char in self.message_text)
+        config = self.get_config()
+        reference_bits = config.get("concat_reference_bits") or 8
+
+        # '0' is the field default, so only another coding counts as chosen by the user
+        if self.data_coding not in (None, "", "0"):
+            encoded = encode_message(self.message_text, self.data_coding)
+            self.sms_parts = count_encoded_parts(encoded, cint(self.data_coding), reference_bits)
+            return
+
+        # GSM 7-bit whenever every character is in GSM 03.38, UCS2 otherwise
+        stats = get_message_stats(self.message_text, reference_bits,
+                                  transliterate_text=self.transliterate or config.get("transliterate_to_gsm"))
         
-        if is_unicode:
-            sms_parts = 1 if message_length <= 70 else (message_length - 1) // 67 + 1
-        else:
-            sms_parts = 1 if message_length <= 160 else (message_length - 1) // 153 + 1
+        self.message_text = stats["text"]
+        self.data_coding = str(stats["data_coding"])
+        self.sms_parts = stats["sms_parts"]
         
-        self.data_coding = "8" if is_unicode else "0"
+        # Keep the saving of the first validation; the text is already transliterated afterwards
+        if stats["segments_saved"]:
+            self.segments_saved = stats["segments_saved"]
 
     def query_delivery_status(self):
         """Query delivery status from SMSC using query_sm PDU"""
@@ -73,60 +116,12 @@ class SMPPSMSMessage(Document):
         if self.status not in ["Sent", "Delivered", "Failed", "Expired"]:
             frappe.throw(f"Cannot query status for message in '{self.status}' state")
 
-        try:
-            from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
-
-            config_name = self.smpp_configuration
-            if not config_name:
-                # Get default configuration
-                config_name = frappe.db.get_value("SMPP Configuration",
-                                                 {"is_default": 1, "is_active": 1},
-                                                 "name")
-
-            if not config_name:
-                frappe.throw("No active SMPP Configuration found")
-
-            client = get_smpp_client(config_name)
-
-            # Query message status using query_sm PDU
-            result = client.query_message_status(
-                message_id=self.message_id,
-                source_addr=self.sender_id or ""
-            )
-
-            if result.get("success"):
-                # Update status based on SMSC response
-                message_state_text = result.get("message_state_text")
-
-                # Map SMPP message states to our status values
-                status_mapping = {
-                    "ENROUTE": "Sent",
-                    "DELIVERED": "Delivered",
-                    "EXPIRED": "Expired",
-                    "DELETED": "Failed",
-                    "UNDELIVERABLE": "Failed",
-                    "ACCEPTED": "Delivered",
-                    "UNKNOWN": "Failed",
-                    "REJECTED": "Rejected"
-                }
-
-                new_status = status_mapping.get(message_state_text, self.status)
-
-                # Update document if status changed
-                if new_status != self.status or message_state_text != self.smpp_status:
-                    self.status = new_status
-                    self.smpp_status = message_state_text
-
-                    # Set delivered time if message was delivered
-                    if new_status == "Delivered" and not self.delivered_time:
-                        self.delivered_time = now()
-
-                    self.save()
-
-                return result
-            else:
-                frappe.throw(f"Failed to query status: {result.get('error', 'Unknown error')}")
+        from smpp_gateway.smpp_gateway.api.delivery_status import query_delivery_statuses
+
+        result = query_delivery_statuses([self.name]).get(self.name) or {}
+
+        if not result.get("success"):
+            frappe.throw(f"Failed to query status: {result.get('message', 'Unknown error')}")
 
-        except Exception as e:
-            frappe.log_error(f"Failed to query SMS delivery status: {str(e)}", "SMPP Query Status Error")
-            frappe.throw(f"Query failed: {str(e)}")
\ No newline at end of file
+        self.reload()
+        return result
\ No newline at end of file
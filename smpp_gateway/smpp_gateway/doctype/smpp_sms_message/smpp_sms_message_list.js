@@ -0,0 +1,38 @@
+// Copyright (c) 2025, aakvatech and contributors
+// For license information, please see license.txt
+
+frappe.listview_settings['SMPP SMS Message'] = {
+    onload: function (listview) {
+        listview.page.add_actions_menu_item(__('Check Delivery Status'), function () {
+            check_delivery_statuses(listview);
+        });
+    }
+};
+
+function check_delivery_statuses(listview) {
+    const names = listview.get_checked_items(true);
+    if (!names.length) {
+        frappe.msgprint(__('Select the messages to query'));
+        return;
+    }
+
+    frappe.call({
+        method: 'smpp_gateway.smpp_gateway.api.sms_api.query_sms_delivery_statuses',
+        args: {
+            sms_ids: names
+        },
+        freeze: true,
+        freeze_message: __('Querying delivery status from SMSC...'),
+        callback: function (r) {
+            const results = Object.values(r.message || {});
+            const failed = results.filter(result => !result.success).length;
+
+            frappe.show_alert({
+                message: __('{0} queried, {1} failed', [results.length - failed, failed]),
+                indicator: failed ? 'orange' : 'green'
+            }, 5);
+
+            listview.refresh();
+        }
+    });
+}
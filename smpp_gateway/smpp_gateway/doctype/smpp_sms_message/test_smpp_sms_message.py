@@ -1,9 +1,89 @@
 # Copyright (c) 2025, aakvatech and Contributors
 # See license.txt
 
-# import frappe
+import time
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from smpp_gateway.smpp_gateway.api.smpp_client import create_client
+from smpp_gateway.smpp_gateway.api.smsc_simulator import SMSCSimulator
+
 
 class TestSMPPSMSMessage(FrappeTestCase):
-	pass
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.smsc = SMSCSimulator(system_id="simulator", password="secret", dlr_delay=0.1, seed=1)
+		cls.smsc.start()
+
+		cls.config = frappe.get_doc({
+			"doctype": "SMPP Configuration",
+			"configuration_name": "_Test SMSC Simulator",
+			"smsc_host": cls.smsc.host,
+			"smsc_port": cls.smsc.port,
+			"system_id": "simulator",
+			"password": "secret",
+			"is_active": 1
+		}).insert(ignore_if_duplicate=True)
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.smsc.stop()
+		super().tearDownClass()
+
+	def setUp(self):
+		self.client = create_client(self.config.name)
+
+	def tearDown(self):
+		self.client.disconnect()
+		self.smsc.throttle_rate = 0
+		self.smsc.drop_rate = 0
+		self.smsc.drop_every = 0
+
+	def make_messages(self, count):
+		return [frappe.get_doc({
+			"doctype": "SMPP SMS Message",
+			"recipient_number": "+2557%08d" % index,
+			"message_text": "Test message",
+			"smpp_configuration": self.config.name,
+			"registered_delivery": 1
+		}).insert() for index in range(count)]
+
+	def test_send_and_receipt(self):
+		messages = self.make_messages(5)
+		results = self.client.send_sms_batch(messages)
+
+		self.assertTrue(all(result["success"] for result in results))
+		for message in messages:
+			message.reload()
+			self.assertEqual(message.status, "Sent")
+			self.assertTrue(message.message_id)
+
+		time.sleep(0.5)
+		self.client.process_delivery_receipts()
+		for message in messages:
+			self.assertEqual(frappe.db.get_value("SMPP SMS Message", message.name, "status"), "Delivered")
+
+	def test_throttled(self):
+		self.smsc.throttle_rate = 1.0
+		results = self.client.send_sms_batch(self.make_messages(2))
+
+		self.assertTrue(all(result.get("throttled") for result in results))
+
+	def test_dropped_connections_are_replayed(self):
+		# Every bind is dropped at its 10th submit; with one submit in flight only that one is replayed,
+		# so each bind completes 9 messages and 50 messages take 5 drops and 55 submits
+		self.addCleanup(self.config.db_set, "submit_window_size", self.config.submit_window_size)
+		self.config.db_set("submit_window_size", 1)
+		self.client.disconnect()
+		self.client = create_client(self.config.name)
+
+		self.smsc.drop_every = 10
+		submitted, dropped = self.smsc.stats["submit_sm"], self.smsc.stats["dropped"]
+
+		results = self.client.send_sms_batch(self.make_messages(50))
+
+		self.assertTrue(all(result["success"] for result in results))
+		self.assertEqual(self.smsc.stats["dropped"] - dropped, 5)
+		self.assertEqual(self.smsc.stats["submit_sm"] - submitted, 55)
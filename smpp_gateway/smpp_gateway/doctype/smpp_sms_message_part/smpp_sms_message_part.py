@@ -0,0 +1,5 @@
+from __future__ import unicode_literals
+from frappe.model.document import Document
+
+class SMPPSMSMessagePart(Document):
+    pass
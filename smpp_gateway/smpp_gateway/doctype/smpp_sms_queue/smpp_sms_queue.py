@@ -2,7 +2,7 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
-from frappe.utils import now, add_to_date
+from frappe.utils import now, add_to_date, cint
 
 class SMPPSMSQueue(Document):
     def validate(self):
@@ -32,4 +32,8 @@ class SMPPSMSQueue(Document):
             self.retry_interval = 300
         
         if not self.timeout_seconds:
-            self.timeout_seconds = 30
\ No newline at end of file
+            self.timeout_seconds = 30
+        
+        # Queue items of urgent messages are picked up first
+        if not self.priority:
+            self.priority = cint(frappe.db.get_value("SMPP SMS Message", self.sms_message, "priority"))
\ No newline at end of file
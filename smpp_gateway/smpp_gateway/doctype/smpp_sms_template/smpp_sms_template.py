@@ -2,6 +2,8 @@
 from __future__ import unicode_literals
 import frappe
 from frappe.model.document import Document
+from smpp_gateway.smpp_gateway.api.gsm_codec import get_message_stats
+from smpp_gateway.smpp_gateway.api.segmentation import count_parts
 import re
 
 class SMPPSMSTemplate(Document):
@@ -37,17 +39,23 @@ class SMPPSMSTemplate(Document):
         
         base_length = len(self.message_template)
         var_count = len(self.variables) if self.variables else 0
-        estimated_length = base_length + (var_count * 10)
         
-        is_unicode = any(ord(char) > 127 for char in self.message_template)
-        
-        if is_unicode:
-            sms_parts = 1 if estimated_length <= 70 else (estimated_length - 1) // 67 + 1
-        else:
-            sms_parts = 1 if estimated_length <= 160 else (estimated_length - 1) // 153 + 1
+        # Count the fixed text with the codec used for sending, plus ~10 characters per variable
+        fixed_text = re.sub(r'\{\{\s*\w+\s*\}\}', '', self.message_template)
+        stats = get_message_stats(fixed_text, transliterate_text=self.transliterate)
+        estimated_length = stats["length"] + (var_count * 10)
         
         self.character_count = base_length
-        self.sms_parts = sms_parts
+        self.encoding = stats["encoding"]
+        self.sms_parts = count_parts(estimated_length, stats["data_coding"])
+        
+        if self.transliterate and stats["segments_saved"]:
+            # Compare against the same estimate without transliteration
+            original = get_message_stats(fixed_text)
+            self.segments_saved = count_parts(original["length"] + (var_count * 10),
+                                              original["data_coding"]) - self.sms_parts
+        else:
+            self.segments_saved = 0
     
     def generate_sample_output(self):
         """Generate sample output with placeholder values"""
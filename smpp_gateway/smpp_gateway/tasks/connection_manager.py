@@ -1,5 +1,9 @@
 from __future__ import unicode_literals
 import frappe
+from frappe.utils import now, add_to_date
+from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+from smpp_gateway.smpp_gateway.api.gateway import is_gateway_running
+from smpp_gateway.smpp_gateway.api.status_buffer import recover_status_journals
 
 
 
@@ -8,6 +12,16 @@ def check_smpp_connections():
     try:
         if not frappe.db:
             return
+        
+        # Status transitions journaled by a process that died before writing them
+        try:
+            recover_status_journals()
+        except Exception as e:
+            frappe.log_error(f"Status journal recovery error: {str(e)}", "SMPP Connection Manager")
+        
+        # The gateway daemon owns the binds and health-checks them itself
+        if is_gateway_running():
+            return
             
         # Get all active SMPP configurations
         configs = frappe.get_all("SMPP Configuration",
@@ -25,36 +39,22 @@ def check_smpp_connections():
         frappe.log_error(f"Connection manager error: {str(e)}", "SMPP Connection Manager")
 
 def _check_connection_health(config_name):
-    """Check health of specific SMPP connection"""
+    """Check health of every bind of an SMPP configuration"""
     try:
-        client = get_smpp_client(config_name)
+        pool = get_smpp_client(config_name)
         
-        # Check if connection is alive
-        if client.connected:
-            # Try to send enquire_link
-            try:
-                if client.client:
-                    client.client.enquire_link()
-                    # Log successful health check
-                    _log_health_check(config_name, True, "Connection healthy")
-            except Exception as e:
-                # Connection lost, try to reconnect
-                client.connected = False
-                _log_health_check(config_name, False, f"Connection lost: {str(e)}")
-                
-                # Attempt reconnection
-                try:
-                    client.connect()
-                    _log_health_check(config_name, True, "Reconnected successfully")
-                except Exception as reconnect_error:
-                    _log_health_check(config_name, False, f"Reconnection failed: {str(reconnect_error)}")
+        # Dead binds are replaced and re-bound; healthy ones are left alone
+        health = pool.check_health()
+        
+        if health["connected"] == health["binds"]:
+            if health["replaced"]:
+                _log_health_check(config_name, True,
+                                  f"Reconnected {health['replaced']} bind(s) successfully")
+            else:
+                _log_health_check(config_name, True, "Connection healthy")
         else:
-            # Connection not established, try to connect
-            try:
-                client.connect()
-                _log_health_check(config_name, True, "Connection established")
-            except Exception as connect_error:
-                _log_health_check(config_name, False, f"Connection failed: {str(connect_error)}")
+            _log_health_check(config_name, False,
+                              f"{health['connected']} of {health['binds']} bind(s) connected")
                 
     except Exception as e:
         _log_health_check(config_name, False, f"Health check error: {str(e)}")
@@ -0,0 +1,225 @@
+from __future__ import unicode_literals
+import os
+import signal
+import socket
+import threading
+import time
+import frappe
+from frappe.utils import now
+from smpp_gateway.smpp_gateway.api.gateway import (
+    GATEWAY_STATE_KEY,
+    get_gateway_state,
+    get_handoff_length,
+    requeue_stranded_handoffs,
+    take_handoff,
+    take_urgent_handoff
+)
+from smpp_gateway.smpp_gateway.api.priority_lanes import get_lane
+from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client, cleanup_connections
+from smpp_gateway.smpp_gateway.api.status_buffer import beat_status_buffer, flush_status_buffer
+from smpp_gateway.smpp_gateway.tasks.queue_processor import process_sms_queue
+
+# Maximum messages taken from the handoff queue per dispatch
+DISPATCH_BATCH_SIZE = 500
+
+# Seconds between state publications (heartbeats), bind health checks and SMPP SMS Queue runs
+STATE_INTERVAL = 5
+HEALTH_CHECK_INTERVAL = 30
+QUEUE_INTERVAL = 60
+
+
+class GatewayDaemon:
+    """Long-running process that owns every SMPP bind of a site"""
+
+    def __init__(self, site):
+        self.site = site
+        self.running = False
+        self.pools = {}
+        self.started_at = None
+        self.sent_count = 0
+        self.failed_count = 0
+        self._stopped = threading.Event()
+        self._heartbeat_thread = None
+        self._last_health_check = 0
+        self._last_queue_run = 0
+        # Urgent messages taken during another configuration's batch, sent first in the next dispatch
+        self._urgent = {}
+
+    def run(self):
+        """Bind all active configurations and serve the handoff queue until stopped"""
+        frappe.init(site=self.site)
+        frappe.connect()
+
+        if get_gateway_state():
+            frappe.destroy()
+            raise frappe.ValidationError(f"An SMPP gateway daemon is already running for {self.site}")
+
+        try:
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+            # Lets process_sms_queue run here while the scheduler copy stands down
+            frappe.flags.in_smpp_gateway = True
+
+            self.running = True
+            self.started_at = now()
+
+            # Heartbeats come from their own thread so a dispatch or reconnect running
+            # longer than GATEWAY_HEARTBEAT_TIMEOUT never lets another process take over
+            self._publish_state()
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="smpp-gateway-heartbeat",
+                                                      daemon=True)
+            self._heartbeat_thread.start()
+
+            # Names handed off while no daemon was running were never taken
+            stranded = requeue_stranded_handoffs()
+            if stranded:
+                frappe.logger().info(f"SMPP gateway: re-queued {stranded} stranded messages")
+
+            self._open_binds()
+
+            while self.running:
+                names = [] if self._urgent else take_handoff(DISPATCH_BATCH_SIZE, timeout=1)
+                if names or self._urgent:
+                    self._dispatch(names)
+
+                for pool in self.pools.values():
+                    pool.process_delivery_receipts()
+
+                self._periodic()
+                frappe.db.commit()
+
+        finally:
+            self._stopped.set()
+            if self._heartbeat_thread:
+                self._heartbeat_thread.join()
+
+            flush_status_buffer(force=True)
+            cleanup_connections()
+            frappe.cache().delete_value(GATEWAY_STATE_KEY)
+            frappe.destroy()
+
+    def stop(self, *args):
+        """Finish the current dispatch, then unbind and exit"""
+        self.running = False
+
+    def _open_binds(self):
+        """Open a session pool for every active SMPP configuration"""
+        for config in frappe.get_all("SMPP Configuration", filters={"is_active": 1}, pluck="name"):
+            self._get_pool(config)
+
+        self._last_health_check = time.monotonic()
+
+    def _get_pool(self, config_name):
+        if config_name not in self.pools:
+            pool = get_smpp_client(config_name)
+            try:
+                pool.connect()
+            except Exception as e:
+                frappe.log_error(f"Gateway bind error for {config_name}: {str(e)}", "SMPP Gateway Daemon")
+            self.pools[config_name] = pool
+
+        return self.pools[config_name]
+
+    def _dispatch(self, names):
+        """Send handed-off messages, one windowed batch per configuration, urgent ones first"""
+        batches, self._urgent = self._urgent, {}
+
+        for sms_doc in self._load(names):
+            batches.setdefault(sms_doc.smpp_configuration, []).append(sms_doc)
+
+        ordered = sorted(batches.items(), key=lambda item: -max(get_lane(sms_doc) for sms_doc in item[1]))
+        for config_name, sms_docs in ordered:
+            try:
+                # Urgent messages handed off meanwhile join the batch in flight
+                results = self._get_pool(config_name).send_sms_batch(
+                    sms_docs, intake=lambda config_name=config_name: self._take_urgent(config_name))
+            except Exception as e:
+                frappe.log_error(f"Gateway dispatch error for {config_name}: {str(e)}", "SMPP Gateway Daemon")
+                continue
+
+            for result in results:
+                if result.get("success"):
+                    self.sent_count += 1
+                else:
+                    self.failed_count += 1
+
+    def _load(self, names):
+        """Load handed-off messages, skipping those already sent or cancelled meanwhile"""
+        sms_docs = []
+        for name in names:
+            try:
+                sms_doc = frappe.get_doc("SMPP SMS Message", name)
+            except frappe.DoesNotExistError:
+                continue
+
+            if sms_doc.status in ["Draft", "Queued"]:
+                sms_docs.append(sms_doc)
+
+        return sms_docs
+
+    def _take_urgent(self, config_name):
+        """Urgent messages handed off since the last look; those for other configurations wait for the next dispatch"""
+        for sms_doc in self._load(take_urgent_handoff(DISPATCH_BATCH_SIZE)):
+            self._urgent.setdefault(sms_doc.smpp_configuration, []).append(sms_doc)
+
+        return self._urgent.pop(config_name, [])
+
+    def _periodic(self):
+        """Health-check binds and run the SMS queue on their intervals"""
+        current = time.monotonic()
+
+        if current - self._last_queue_run >= QUEUE_INTERVAL:
+            self._last_queue_run = current
+            process_sms_queue()
+
+        if current - self._last_health_check >= HEALTH_CHECK_INTERVAL:
+            self._last_health_check = current
+            for config_name, pool in self.pools.items():
+                try:
+                    pool.check_health()
+                except Exception as e:
+                    frappe.log_error(f"Gateway health check error for {config_name}: {str(e)}",
+                                     "SMPP Gateway Daemon")
+
+    def _heartbeat(self):
+        """Publish state and refresh the status journal heartbeat every STATE_INTERVAL seconds until the daemon stops"""
+        frappe.init(site=self.site)
+        try:
+            while not self._stopped.wait(STATE_INTERVAL):
+                try:
+                    self._publish_state()
+                    # A flush backing off a database outage keeps its journal
+                    beat_status_buffer()
+                except Exception as e:
+                    frappe.logger().error(f"SMPP gateway heartbeat failed: {str(e)}")
+        finally:
+            frappe.destroy()
+
+    def _publish_state(self):
+        """Publish daemon state to Redis for get_gateway_status and the web workers"""
+        frappe.cache().set_value(GATEWAY_STATE_KEY, {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "started_at": self.started_at,
+            "heartbeat": time.time(),
+            "queue_length": get_handoff_length(),
+            "sent_count": self.sent_count,
+            "failed_count": self.failed_count,
+            "configurations": {
+                config_name: {
+                    "binds": pool.max_binds,
+                    "connected": sum(1 for session in list(pool.sessions) if session.connected),
+                    "outstanding": pool.outstanding,
+                    "endpoints": pool.get_endpoint_health(),
+                    "keepalive": pool.keepalive_stats
+                }
+                # The pools are read from the heartbeat thread while the main thread adds to them
+                for config_name, pool in list(self.pools.items())
+            }
+        })
+
+
+def run_gateway(site):
+    """Run the SMPP gateway daemon for a site in the foreground"""
+    GatewayDaemon(site).run()
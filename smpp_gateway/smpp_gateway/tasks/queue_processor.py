@@ -2,11 +2,17 @@ import threading
 import time
 from frappe.utils import now, get_datetime, cint, add_to_date
 from smpp_gateway.smpp_gateway.api.smpp_client import get_smpp_client
+from smpp_gateway.smpp_gateway.api.gateway import is_gateway_running
+from smpp_gateway.smpp_gateway.api.routing import get_router
+from smpp_gateway.smpp_gateway.api.throttle import THROTTLE_REQUEUE_DELAY
 import frappe
 
 def process_sms_queue():
     """Process SMS queue - called by scheduler every 5 minutes"""
     try:
+        # The gateway daemon owns the binds and runs the queue itself
+        if is_gateway_running() and not frappe.flags.in_smpp_gateway:
+            return
 
         # Get pending queue items
         queue_items = frappe.db.get_all("SMPP SMS Queue",
@@ -17,7 +23,7 @@ def process_sms_queue():
                                    },
                                    fields=["name", "sms_message", "priority", "attempts", 
                                           "max_attempts", "retry_interval"],
-                                   order_by="priority asc, creation asc",
+                                   order_by="priority desc, creation asc",
                                    limit=100)
         
         if not queue_items:
@@ -25,58 +31,87 @@ def process_sms_queue():
         
         processed_count = 0
         failed_count = 0
+        batches = {}
         
         for item in queue_items:
             try:
-                # Process queue item
-                success = _process_queue_item(item)
+                # Prepare queue item and group it by SMPP configuration
+                sms_doc = _prepare_queue_item(item)
                 
-                if success:
+                if sms_doc is None:
                     processed_count += 1
                 else:
-                    failed_count += 1
+                    batches.setdefault(sms_doc.smpp_configuration, []).append((item, sms_doc))
                     
             except Exception as e:
                 frappe.log_error(f"Queue processing error for {item.name}: {str(e)}", 
                                "SMS Queue Processor")
+                _handle_queue_failure(item, str(e))
                 failed_count += 1
         
+        for config_name, batch in batches.items():
+            success, failed = _process_queue_batch(config_name, batch)
+            processed_count += success
+            failed_count += failed
+        
         if processed_count > 0 or failed_count > 0:
             frappe.logger().info(f"SMS Queue processed: {processed_count} success, {failed_count} failed")
             
     except Exception as e:
         frappe.log_error(f"SMS Queue processor error: {str(e)}", "SMS Queue Processor")
 
-def _process_queue_item(queue_item):
-    """Process individual queue item"""
+def _prepare_queue_item(queue_item):
+    """Load the SMS message for a queue item, or return None if nothing is left to send"""
+    # Get SMS message
+    sms_doc = frappe.get_doc("SMPP SMS Message", queue_item["sms_message"])
+    
+    # Skip if message is already sent
+    if sms_doc.status in ["Sent", "Delivered"]:
+        _update_queue_status(queue_item["name"], "Completed", "Message already sent")
+        return None
+    
+    # Retries leave a configuration that turned unhealthy for another route to the same number
+    if queue_item["attempts"]:
+        config_name = get_router().reroute(sms_doc.recipient_number, sms_doc.smpp_configuration)
+        if config_name != sms_doc.smpp_configuration:
+            sms_doc.db_set("smpp_configuration", config_name, update_modified=False)
+    
+    # Update queue status to Processing
+    _update_queue_status(queue_item["name"], "Processing", f"Attempt {queue_item['attempts'] + 1}")
+    
+    return sms_doc
+
+def _process_queue_batch(config_name, batch):
+    """Send queue items sharing one SMPP configuration through a single submit window"""
+    success_count = 0
+    failed_count = 0
+    
     try:
-        # Get SMS message
-        sms_doc = frappe.get_doc("SMPP SMS Message", queue_item["sms_message"])
-        
-        # Skip if message is already sent
-        if sms_doc.status in ["Sent", "Delivered"]:
-            _update_queue_status(queue_item["name"], "Completed", "Message already sent")
-            return True
-        
         # Get SMPP client
-        client = get_smpp_client(sms_doc.smpp_configuration)
-        
-        # Update queue status to Processing
-        _update_queue_status(queue_item["name"], "Processing", f"Attempt {queue_item['attempts'] + 1}")
+        client = get_smpp_client(config_name)
         
         # Send SMS
-        result = client.send_sms(sms_doc)
+        results = client.send_sms_batch([sms_doc for _item, sms_doc in batch])
         
+    except Exception as e:
+        for queue_item, _sms_doc in batch:
+            _handle_queue_failure(queue_item, str(e))
+        return 0, len(batch)
+    
+    for (queue_item, _sms_doc), result in zip(batch, results):
         if result["success"]:
             # Mark queue item as completed
             _update_queue_status(queue_item["name"], "Completed", "SMS sent successfully")
-            return True
+            success_count += 1
+        elif result.get("throttled"):
+            # The SMSC was over its rate; try again soon without using up an attempt
+            _reschedule_throttled(queue_item, result["error"])
         else:
             # Handle failure
-            return _handle_queue_failure(queue_item, result["error"])
-            
-    except Exception as e:
-        return _handle_queue_failure(queue_item, str(e))
+            _handle_queue_failure(queue_item, result["error"])
+            failed_count += 1
+    
+    return success_count, failed_count
 
 def _handle_queue_failure(queue_item, error_message):
     """Handle queue item failure with retry logic"""
@@ -110,6 +145,24 @@ def _handle_queue_failure(queue_item, error_message):
         frappe.log_error(f"Queue failure handling error: {str(e)}", "SMS Queue Processor")
         return False
 
+def _reschedule_throttled(queue_item, error_message):
+    """Reschedule a throttled queue item without counting an attempt"""
+    try:
+        scheduled_for = add_to_date(now(), seconds=THROTTLE_REQUEUE_DELAY)
+        
+        frappe.db.set_value("SMPP SMS Queue", queue_item["name"], {
+            "status": "Retrying",
+            "last_attempt": now(),
+            "scheduled_for": scheduled_for,
+            "next_retry": scheduled_for,
+            "processing_notes": f"{now()}: Throttled by SMSC: {error_message}\n" +
+                              (frappe.db.get_value("SMPP SMS Queue", queue_item["name"], "processing_notes") or "")
+        })
+        frappe.db.commit()
+        
+    except Exception as e:
+        frappe.log_error(f"Queue throttle handling error: {str(e)}", "SMS Queue Processor")
+
 def _update_queue_status(queue_name, status, notes=None):
     """Update queue item status"""
     try: